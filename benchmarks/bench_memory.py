@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Compare the cost of rss and pss memory accounting.
+
+The rss pass is the scan of /proc/[pid]/stat and status every scan does. The
+pss pass reads /proc/[pid]/smaps_rollup of the processes of the users whose
+rss total is over the memory threshold. For reference, reading smaps_rollup
+of all processes is timed as well, that is what pss accounting would cost
+without the rss filter.
+
+On synthetic process tables, see synthetic.py, only the cost of reading and
+parsing the files is measured. With --live the /proc of this node is used,
+where the kernel walks the mappings of a process for every read of its
+smaps_rollup. Run that as root, smaps_rollup of other users can not be read
+otherwise.
+
+Usage:
+    python -m benchmarks.bench_memory [--scenarios 1000x10] [--live]
+"""
+
+from benchmarks import synthetic
+from benchmarks.bench_scan import SCENARIOS, parse_scenarios
+from kill_hogs.memory import SharedMemoryAccounting
+from kill_hogs.samplers import ProcSampler
+from kill_hogs.usage import Users
+import argparse
+import tempfile
+import time
+
+
+def users_of(snapshot):
+    """
+    Returns:
+        usage.Users: the memory usage per uid in <snapshot>, root excluded.
+    """
+    users = Users(len(snapshot))
+    for i in range(len(snapshot)):
+        if snapshot.uids[i] == 0:
+            continue
+        user = users.add(str(snapshot.uids[i]))
+        user.memory_percent += snapshot.memory_percent[i]
+        users.owners[i] = user.number
+    return users
+
+
+def bench(procfs: str, threshold: float, repeat: int):
+    """
+    Returns:
+        dict: number of processes, best time in seconds of the rss pass, the
+            pss pass over the users above <threshold> and over all users, and
+            the number of processes read by the pss pass.
+    """
+    sampler = ProcSampler(procfs)
+    accounting = SharedMemoryAccounting('pss', procfs)
+    best = {'rss': float('inf'), 'pss': float('inf'), 'pss_all': float('inf')}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        snapshot = sampler.sample()
+        users = users_of(snapshot)
+        best['rss'] = min(best['rss'], time.perf_counter() - start)
+
+        start = time.perf_counter()
+        candidates = accounting.refine(users, snapshot, threshold)
+        best['pss'] = min(best['pss'], time.perf_counter() - start)
+
+        users = users_of(snapshot)
+        start = time.perf_counter()
+        accounting.refine(users, snapshot, -1)
+        best['pss_all'] = min(best['pss_all'], time.perf_counter() - start)
+    best['processes'] = len(snapshot)
+    best['candidates'] = candidates
+    return best
+
+
+def report(name: str, result: dict):
+    print('{:18} {:6d} processes rss {:8.2f} ms, pss of {:5d} processes '
+          '{:8.2f} ms, pss of all {:8.2f} ms'.format(
+              name, result['processes'], result['rss'] * 1000,
+              result['candidates'], result['pss'] * 1000,
+              result['pss_all'] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", default=SCENARIOS,
+                        help="comma separated processesxusers.")
+    parser.add_argument("--memory_threshold", type=float, default=10)
+    parser.add_argument("--shared", type=float, default=.5,
+                        help="share of the rss of synthetic processes that "
+                        "is shared.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--live", action='store_true',
+                        help="measure /proc of this node instead.")
+    args = parser.parse_args()
+
+    if args.live:
+        report('live', bench('/proc', args.memory_threshold, args.repeat))
+        return
+    for processes, users in parse_scenarios(args.scenarios):
+        table = synthetic.generate(processes, users)
+        with tempfile.TemporaryDirectory() as procfs:
+            synthetic.write_procfs(procfs, table, shared=args.shared)
+            report('{}x{}'.format(processes, users),
+                   bench(procfs, args.memory_threshold, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Compare the scan time of the samplers on this machine.
+
+Usage:
+    python -m benchmarks.bench_samplers [--repeat 5]
+"""
+
+from kill_hogs.samplers import SAMPLERS
+import argparse
+import time
+
+
+def bench(sampler, repeat: int):
+    """
+    Returns:
+        tuple: (number of processes, best time in seconds of prime() + sample())
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sampler.prime()
+        snapshot = sampler.sample()
+        best = min(best, time.perf_counter() - start)
+    return len(snapshot), best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, sampler_class in sorted(SAMPLERS.items()):
+        count, seconds = bench(sampler_class(), args.repeat)
+        print('{:8} {:6d} processes {:8.2f} ms {:8.2f} ms per 1k processes'.format(
+            name, count, seconds * 1000, seconds * 1e6 / max(count, 1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Benchmark a whole scan on synthetic process tables.
+
+kill_hogs() runs against tables of 1k to 50k processes, see synthetic.py,
+through a mocked psutil or a fake /proc. Both see the same cpu and memory
+usage, so they find the same offenders and count the same kills. Nothing is
+signalled: terminate() is replaced and only counts the processes it would
+have killed. For every sampler and table size the best scan time, the cpu
+time and the peak memory allocated during a scan are reported per process.
+
+The mocked psutil makes no syscalls at all, unlike the proc sampler which
+reads real files, so its times are a baseline of the work in kill hogs
+itself and not comparable to those of the proc sampler.
+
+With --check the results are compared to a stored baseline and the exit
+status is 1 when one of them got worse than the tolerance allows.
+--update stores the results as the new baseline.
+
+Usage:
+    python -m benchmarks.bench_scan [--check | --update] [--scenarios 1000x10]
+"""
+
+from benchmarks import synthetic
+from kill_hogs import kill_hogs
+from kill_hogs.identity import IdentityCache
+from kill_hogs.notify import Notifier
+from kill_hogs.samplers import PsutilSampler
+from unittest import mock
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+SCENARIOS = '1000x10,10000x200,50000x2000'
+# How the samplers are shown in the output.
+LABELS = {'psutil': 'psutil (mocked)'}
+CONFIG = {
+    'user_pattern': '^p?[0-9]+$',
+    'software_whitelist': ['git', 'tmux'],
+    'terminal_warning': 'stop it',
+}
+
+
+def parse_scenarios(text: str):
+    """
+    Returns:
+        list: (processes, users) for every 'processesxusers' in <text>.
+    """
+    scenarios = []
+    for scenario in text.split(','):
+        processes, users = scenario.split('x')
+        scenarios.append((int(processes), int(users)))
+    return scenarios
+
+
+def scan(sampler, procs):
+    """
+    Run one scan with <procs> as the processes psutil knows about.
+
+    Returns:
+        tuple: (ScanProfile, number of processes that would have been killed)
+    """
+    killed = []
+
+    def terminate(kill_list, **kwargs):
+        killed.extend(kill_list)
+        return {}
+
+    with mock.patch('psutil.process_iter', lambda: iter(procs)), \
+            mock.patch('kill_hogs.kill_hogs.procs_using_gpu', lambda: []), \
+            mock.patch('kill_hogs.kill_hogs.terminate', terminate):
+        profile = kill_hogs.kill_hogs(
+            config=CONFIG, memory_threshold=20, cpu_threshold=400,
+            gpu_max_walltime=0, interval=0, sampler=sampler,
+            identity=IdentityCache(),
+            notifier=Notifier(write_terminals=lambda user, message: None))
+    return profile, len(killed)
+
+
+def measure(make_sampler, procs, processes: int, repeat: int):
+    """
+    Returns:
+        dict: metric -> value for scanning <processes> processes.
+    """
+    best_wall = best_cpu = float('inf')
+    for _ in range(repeat):
+        sampler = make_sampler()
+        gc.collect()
+        wall, cpu = time.perf_counter(), time.process_time()
+        profile, killed = scan(sampler, procs)
+        best_wall = min(best_wall, time.perf_counter() - wall)
+        best_cpu = min(best_cpu, time.process_time() - cpu)
+
+    # Separately, tracing makes allocating a lot slower.
+    sampler = make_sampler()
+    tracemalloc.start()
+    try:
+        scan(sampler, procs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'ms_per_1k_processes': round(best_wall * 1e6 / processes, 3),
+        'cpu_ms_per_1k_processes': round(best_cpu * 1e6 / processes, 3),
+        'peak_bytes_per_process': round(peak / processes, 1),
+        'offenders': profile.counts['offenders'],
+        'killed': killed,
+    }
+
+
+def run(scenarios, sampler_names, repeat: int = 3):
+    """
+    Returns:
+        dict: '<sampler> <processes>x<users>' -> metrics.
+    """
+    results = {}
+    for processes, users in scenarios:
+        table = synthetic.generate(processes, users)
+        procs = synthetic.processes(table)
+        for name in sampler_names:
+            key = '{} {}x{}'.format(name, processes, users)
+            if name == 'psutil':
+                results[key] = measure(PsutilSampler, procs, processes, repeat)
+                continue
+            with tempfile.TemporaryDirectory() as procfs:
+                synthetic.write_procfs(procfs, table)
+                results[key] = measure(
+                    lambda: synthetic.SyntheticProcSampler(procfs, table),
+                    procs, processes, repeat)
+    return results
+
+
+def compare(results: dict, baseline: dict, time_tolerance: float = 2,
+            memory_tolerance: float = 1.2):
+    """
+    Returns:
+        list: a message for every metric that regressed past its tolerance.
+    """
+    tolerances = {
+        'ms_per_1k_processes': time_tolerance,
+        'cpu_ms_per_1k_processes': time_tolerance,
+        'peak_bytes_per_process': memory_tolerance,
+    }
+    regressions = []
+    for key, metrics in sorted(results.items()):
+        if key not in baseline:
+            continue
+        for metric, tolerance in tolerances.items():
+            old, new = baseline[key][metric], metrics[metric]
+            if new > old * tolerance:
+                regressions.append('{} {}: {:.2f} -> {:.2f} ({:.0%})'.format(
+                    key, metric, old, new, new / old - 1))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", default=SCENARIOS,
+                        help="comma separated processesxusers.")
+    parser.add_argument("--samplers", default='psutil,proc')
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--check", action='store_true',
+                        help="exit with 1 if a result regressed.")
+    parser.add_argument("--update", action='store_true',
+                        help="store the results as the new baseline.")
+    parser.add_argument("--time_tolerance", type=float, default=2)
+    parser.add_argument("--memory_tolerance", type=float, default=1.2)
+    args = parser.parse_args()
+
+    results = run(parse_scenarios(args.scenarios), args.samplers.split(','),
+                  args.repeat)
+    for key, metrics in sorted(results.items()):
+        name, scenario = key.split(' ')
+        print('{:31} {:8.2f} ms {:8.2f} cpu ms per 1k processes '
+              '{:8.0f} peak bytes per process {:4d} offenders {:6d} '
+              'killed'.format(
+                  '{} {}'.format(LABELS.get(name, name), scenario),
+                  metrics['ms_per_1k_processes'],
+                  metrics['cpu_ms_per_1k_processes'],
+                  metrics['peak_bytes_per_process'], metrics['offenders'],
+                  metrics['killed']))
+
+    if args.update:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if args.check:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f),
+                                  args.time_tolerance, args.memory_tolerance)
+        for regression in regressions:
+            print('Regression: ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+Synthetic process tables for benchmarking a scan.
+
+A table looks like a busy login node: a few percent of the processes belong
+to root, users own a very unequal number of processes (a pareto
+distribution), most processes are idle and small, and a couple of users run
+hogs. The same table can be served through a mocked psutil or written out as
+a fake /proc for the proc sampler. The usage is rounded to what /proc can
+express, whole clock ticks per second of cpu and whole pages of memory, so
+both see exactly the same.
+"""
+
+from collections import namedtuple
+from kill_hogs.samplers import CLOCK_TICKS, PAGE_SIZE, ProcSampler
+from unittest import mock
+import os
+import random
+
+FIRST_UID = 5000000
+BOOT_TIME = 1600000000
+TOTAL_KB = 256 * 1024 * 1024
+DAEMONS = ['systemd', 'sshd', 'rsyslogd', 'crond', 'dbus-daemon', 'munged']
+PROGRAMS = ['bash', 'python', 'vim', 'R', 'matlab', 'sshd', 'tmux', 'git',
+            'make', 'gcc', 'java', 'Rscript']
+
+Entry = namedtuple('Entry', ['pid', 'uid', 'username', 'name', 'cpu_percent',
+                             'memory_percent', 'cpu_time', 'create_time'])
+uids = namedtuple('uids', ['real', 'effective', 'saved'])
+cpu_times = namedtuple('cpu_times', ['user', 'system'])
+
+
+def exact(cpu_percent: float, memory_percent: float):
+    """
+    Returns:
+        tuple: (cpu %, memory %) rounded to whole clock ticks per second and
+            whole pages, computed like the proc sampler does.
+    """
+    ticks = round(cpu_percent / 100 * CLOCK_TICKS)
+    pages = round(memory_percent / 100 * TOTAL_KB * 1024 / PAGE_SIZE)
+    return (ticks * (100 / CLOCK_TICKS / 1),
+            pages * (PAGE_SIZE * 100 / (TOTAL_KB * 1024)))
+
+
+def generate(processes: int, users: int, seed: int = 0,
+             root_share: float = .05, hog_share: float = .02):
+    """
+    Returns:
+        list: <processes> Entry tuples spread over <users> users.
+    """
+    rng = random.Random(seed)
+    user_ids = [FIRST_UID + u for u in range(users)]
+    cum_weights = []
+    total = 0
+    for _ in user_ids:
+        total += rng.paretovariate(1.2)
+        cum_weights.append(total)
+    hogs = set(rng.sample(user_ids, max(1, int(users * hog_share))))
+    owners = rng.choices(user_ids, cum_weights=cum_weights, k=processes)
+
+    table = []
+    for pid, uid in enumerate(owners, start=1000):
+        create_time = BOOT_TIME + rng.uniform(0, 30 * 24 * 3600)
+        if rng.random() < root_share:
+            cpu_percent, memory_percent = exact(rng.expovariate(2),
+                                                rng.uniform(0, .05))
+            table.append(Entry(pid, 0, 'root', rng.choice(DAEMONS),
+                               cpu_percent, memory_percent,
+                               rng.uniform(0, 100), create_time))
+            continue
+        if uid in hogs and rng.random() < .5:
+            cpu_percent = rng.uniform(50, 400)
+            memory_percent = rng.uniform(1, 10)
+        elif rng.random() < .8:
+            cpu_percent = 0.
+            memory_percent = min(rng.lognormvariate(-4, 1.5), 5)
+        else:
+            cpu_percent = rng.expovariate(.5)
+            memory_percent = min(rng.lognormvariate(-3, 1.5), 5)
+        cpu_percent, memory_percent = exact(cpu_percent, memory_percent)
+        table.append(Entry(pid, uid, 'p{}'.format(uid), rng.choice(PROGRAMS),
+                           cpu_percent, memory_percent,
+                           rng.uniform(0, 3600), create_time))
+    return table
+
+
+class SyntheticProcess:
+    """
+    The part of psutil.Process a scan uses, answered from an Entry.
+    """
+    __slots__ = ['pid', 'entry']
+
+    def __init__(self, entry: Entry):
+        self.pid = entry.pid
+        self.entry = entry
+
+    def name(self):
+        return self.entry.name
+
+    def username(self):
+        return self.entry.username
+
+    def uids(self):
+        return uids(self.entry.uid, self.entry.uid, self.entry.uid)
+
+    def cpu_percent(self):
+        return self.entry.cpu_percent
+
+    def memory_percent(self):
+        return self.entry.memory_percent
+
+    def cpu_times(self):
+        return cpu_times(self.entry.cpu_time, 0.)
+
+    def create_time(self):
+        return self.entry.create_time
+
+
+def processes(table):
+    """
+    Returns:
+        list: a SyntheticProcess per entry of <table>, to return from a
+            mocked psutil.process_iter().
+    """
+    return [SyntheticProcess(entry) for entry in table]
+
+
+SMAPS_ROLLUP = '''00400000-7fff0000 ---p 00000000 00:00 0    [rollup]
+Rss:            {rss:8d} kB
+Pss:            {pss:8d} kB
+Shared_Clean:   {shared:8d} kB
+Shared_Dirty:          0 kB
+Private_Clean:  {private_clean:8d} kB
+Private_Dirty:  {private_dirty:8d} kB
+Referenced:     {rss:8d} kB
+Anonymous:      {private_dirty:8d} kB
+Swap:                  0 kB
+SwapPss:               0 kB
+Locked:                0 kB
+'''
+
+
+def write_procfs(procfs: str, table, clock_ticks: int = CLOCK_TICKS,
+                 page_size: int = PAGE_SIZE, shared: float = None):
+    """
+    Write <table> as /proc/[pid]/stat and status files, plus meminfo and
+    stat, below <procfs>. Usernames of the uids do not exist, so the proc
+    sampler reports them as the uid. The stat of every process is also
+    written as stat.later: one second later, after it used its cpu_percent,
+    see SyntheticProcSampler.
+
+    Args:
+        shared (float): if given, also write smaps_rollup files in which
+            this share of the rss is shared with 4 other processes.
+    """
+    with open(os.path.join(procfs, 'meminfo'), 'w') as f:
+        f.write('MemTotal:       {} kB\nMemFree:        1000 kB\n'.format(TOTAL_KB))
+    with open(os.path.join(procfs, 'stat'), 'w') as f:
+        f.write('cpu  1 2 3 4\nbtime {}\n'.format(BOOT_TIME))
+    for entry in table:
+        path = os.path.join(procfs, str(entry.pid))
+        os.mkdir(path)
+        rss_pages = round(entry.memory_percent / 100 * TOTAL_KB * 1024
+                          / page_size)
+        ticks = int(entry.cpu_time * clock_ticks)
+        later = ticks + round(entry.cpu_percent / 100 * clock_ticks)
+        for name, utime in (('stat', ticks), ('stat.later', later)):
+            fields = ['S', '1', str(entry.pid), str(entry.pid), '0', '-1',
+                      '4194304', '0', '0', '0', '0', str(utime), '0', '0',
+                      '0', '20', '0', '1', '0',
+                      str(int((entry.create_time - BOOT_TIME) * clock_ticks)),
+                      '1000000', str(rss_pages)] + ['0'] * 30
+            with open(os.path.join(path, name), 'w') as f:
+                f.write('{} ({}) {}\n'.format(entry.pid, entry.name,
+                                              ' '.join(fields)))
+        with open(os.path.join(path, 'status'), 'w') as f:
+            f.write('Name:\t{}\nState:\tS (sleeping)\n'
+                    'Uid:\t{uid}\t{uid}\t{uid}\t{uid}\n'
+                    'Gid:\t100\t100\t100\t100\n'.format(entry.name, uid=entry.uid))
+        if shared is not None:
+            rss = rss_pages * page_size // 1024
+            shared_kb = int(rss * shared)
+            with open(os.path.join(path, 'smaps_rollup'), 'w') as f:
+                f.write(SMAPS_ROLLUP.format(
+                    rss=rss, pss=rss - shared_kb + shared_kb // 5,
+                    shared=shared_kb, private_clean=0,
+                    private_dirty=rss - shared_kb))
+
+
+class SyntheticProcSampler(ProcSampler):
+    """
+    Proc sampler over a procfs written by write_procfs(), which measures the
+    same as the mocked psutil: prime() reads stat and sample() stat.later,
+    as if exactly a second passed in between, so every process gets its
+    cpu_percent. Processes are handed out as SyntheticProcess, so the
+    offenders can be killed.
+    """
+
+    def __init__(self, procfs: str, table):
+        super().__init__(procfs)
+        self.handles = {entry.pid: SyntheticProcess(entry) for entry in table}
+        self._stat = 'stat'
+
+    def _read(self, pid: int, name: str):
+        return super()._read(pid, self._stat if name == 'stat' else name)
+
+    def prime(self, *args, **kwargs):
+        self._stat = 'stat'
+        skipped = super().prime(*args, **kwargs)
+        self._stat = 'stat.later'
+        return skipped
+
+    def sample(self, *args, **kwargs):
+        with mock.patch('kill_hogs.samplers.time.monotonic',
+                        return_value=self._primed_at + 1):
+            snapshot = super().sample(*args, **kwargs)
+        handles = self.handles
+        snapshot.process = lambda i: handles[snapshot.pids[i]]
+        return snapshot
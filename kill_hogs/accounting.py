@@ -0,0 +1,105 @@
+"""
+Cpu accounting from cumulative cpu times, without sleeping.
+
+Instead of measuring every process for --cpu_interval seconds, remember the
+cumulative cpu time of every process and divide the difference by the wall
+time between two scans. Moving averages per user, to tell sustained hogs
+from short spikes, are rules with minutes in the policy, see policy.py.
+
+The io counters of every process are kept the same way, so io rates can be
+computed without priming when run from cron as well.
+
+In daemon mode the state lives in memory. When run from cron it is stored in
+a small json file between runs.
+"""
+
+from kill_hogs.samplers import io_rates
+import json
+import logging
+import os
+import psutil
+import time
+
+
+class CpuAccountant:
+    """
+    Args:
+        state_file (str): where to keep the state between runs, or None to
+            only keep it in memory.
+    """
+
+    def __init__(self, state_file: str = None):
+        self.state_file = state_file
+        # (pid, create time) -> (cpu seconds, timestamp, io counters or None)
+        self.processes = {}
+        if state_file is not None:
+            self.load()
+
+    def update_processes(self, snapshot, now: float = None):
+        """
+        Fill in snapshot.cpu_percent from the cpu time used since the previous
+        call. Processes that were not seen before get their average over their
+        lifetime. When the snapshot was sampled with io, its io rates are
+        replaced by the ones since the previous call too.
+        """
+        now = time.time() if now is None else now
+        processes = {}
+        io = len(snapshot.io_counters) == len(snapshot) > 0
+        for i in range(len(snapshot)):
+            cpu_time = snapshot.cpu_times[i]
+            try:
+                create_time = snapshot.create_time(i)
+            except (psutil.NoSuchProcess, FileNotFoundError):
+                continue
+            # Together with the pid, the create time identifies a process.
+            key = (snapshot.pids[i], round(create_time, 2))
+            previous = self.processes.get(key)
+            if previous is not None and now > previous[1]:
+                cpu_percent = (cpu_time - previous[0]) * 100 / (now - previous[1])
+            elif now > create_time:
+                cpu_percent = cpu_time * 100 / (now - create_time)
+            else:
+                cpu_percent = 0
+            snapshot.cpu_percent[i] = max(0, cpu_percent)
+            counters = None
+            if io:
+                counters = snapshot.io_counters[i]
+                if previous is not None and previous[2] is not None:
+                    (snapshot.io_read[i], snapshot.io_write[i],
+                     snapshot.io_syscalls[i]) = io_rates(
+                         counters, previous[2], now - previous[1])
+            processes[key] = (cpu_time, now, counters)
+        # Processes that are gone are dropped here.
+        self.processes = processes
+
+    def load(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logging.warning('Ignoring broken cpu state file {}: {}'.format(
+                self.state_file, e))
+            return
+        # Files written before io was kept have no io counters. The per user
+        # averages older files have are left alone.
+        self.processes = {
+            (row[0], row[1]): (row[2], row[3],
+                               tuple(row[4]) if len(row) > 4 and row[4]
+                               else None)
+            for row in state['processes']
+        }
+
+    def save(self):
+        if self.state_file is None:
+            return
+        state = {
+            'processes': [[pid, create_time, cpu_time, timestamp, io]
+                          for (pid, create_time), (cpu_time, timestamp, io)
+                          in self.processes.items()],
+        }
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_file)
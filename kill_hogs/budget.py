@@ -0,0 +1,140 @@
+"""
+Scan within a time budget when the node is overloaded.
+
+A thrashing node makes a full scan slowest exactly when it is needed most.
+With --scan_budget a scan has a fixed number of seconds:
+
+- a cheap first pass, with the proc sampler one read of /proc/[pid]/stat
+  per process, puts the processes in priority order, the largest resident
+  sets and cumulative cpu times first, see samplers.priority_order();
+- the processes are primed and sampled in that order, and whatever is not
+  reached in time is left for the next scan;
+- the users over a threshold are dealt with kills first, the heaviest
+  first, and the wait for processes to exit after SIGTERM is cut short to
+  what is left of the budget.
+
+What was skipped is logged and counted in the scan profile. So the scan can
+still run when memory is short, kill hogs locks its own memory and raises
+its cpu and io priority, see harden().
+"""
+
+import ctypes
+import logging
+import os
+import psutil
+import time
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+# Since Linux 4.4: only lock pages once they are used, so reserved but
+# unused memory such as thread stacks is not locked.
+MCL_ONFAULT = 4
+
+# Share of the budget after which each phase has to stop.
+RANK = .2
+PRIME = .35
+SAMPLE = .7
+
+
+class ScanBudget:
+    """
+    The deadlines of one scan and what was skipped to meet them.
+
+    Args:
+        seconds (float): the whole scan, enforcement included.
+        clock (callable): returns the time in seconds, time.monotonic like
+            the samplers.
+    """
+
+    def __init__(self, seconds: float, clock=time.monotonic):
+        self.seconds = seconds
+        self.clock = clock
+        self.start = clock()
+        # Processes that were not sampled.
+        self.skipped = 0
+        # Users over a threshold that were not dealt with.
+        self.skipped_users = []
+
+    def deadline(self, share: float = 1):
+        """
+        Returns:
+            float: the time at which <share> of the budget is used.
+        """
+        return self.start + self.seconds * share
+
+    def remaining(self):
+        return max(0, self.deadline() - self.clock())
+
+    def expired(self):
+        return self.clock() >= self.deadline()
+
+    def skip(self, n: int = 1):
+        self.skipped += n
+
+    def skip_user(self, username: str):
+        self.skipped_users.append(username)
+
+    def report(self):
+        """
+        Returns:
+            str: what was skipped, or None when nothing was.
+        """
+        parts = []
+        if self.skipped:
+            parts.append('{} processes'.format(self.skipped))
+        if self.skipped_users:
+            parts.append('users {}'.format(', '.join(self.skipped_users)))
+        if not parts:
+            return None
+        return 'Scan budget of {:g} s used up, skipped: {}'.format(
+            self.seconds, '; '.join(parts))
+
+
+def lock_memory():
+    """
+    Lock the memory of this process, so it is not swapped out.
+
+    Returns:
+        bool: whether it was locked. Needs root or a large enough
+            RLIMIT_MEMLOCK.
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+    except OSError:
+        return False
+    # Older kernels fail with EINVAL on MCL_ONFAULT.
+    for flags in (MCL_CURRENT | MCL_FUTURE | MCL_ONFAULT,
+                  MCL_CURRENT | MCL_FUTURE):
+        if libc.mlockall(flags) == 0:
+            return True
+    logging.warning('Unable to lock memory: {}'.format(
+        os.strerror(ctypes.get_errno())))
+    return False
+
+
+def raise_priority(niceness: int = -10):
+    """
+    Run this process at <niceness> and at the highest best effort io
+    priority.
+
+    Returns:
+        bool: whether both were set. Needs root.
+    """
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, niceness)
+        psutil.Process().ionice(psutil.IOPRIO_CLASS_BE, 0)
+    except (OSError, psutil.AccessDenied) as e:
+        logging.warning('Unable to raise the priority: {}'.format(e))
+        return False
+    return True
+
+
+def harden(niceness: int = -10):
+    """
+    Lock the memory and raise the priority of this process, see
+    lock_memory() and raise_priority().
+    """
+    locked = lock_memory()
+    raised = raise_priority(niceness)
+    logging.info('Memory {}locked, priority {}raised.'.format(
+        '' if locked else 'not ', '' if raised else 'not '))
@@ -0,0 +1,229 @@
+"""
+Per user accounting from the cgroup v2 user slices systemd creates.
+
+Every logged in user has /sys/fs/cgroup/user.slice/user-<uid>.slice. Its
+cpu.stat, memory.current and io.stat hold the usage of all processes of that
+user, so finding the users that are over a threshold costs a few reads per
+user instead of a few reads per process.
+"""
+
+from collections import namedtuple
+import logging
+import os
+import psutil
+import re
+import time
+
+SLICE_PATTERN = re.compile(r'^user-(\d+)\.slice$')
+
+# io_read and io_write are MiB/s, None when they were not read.
+SliceUsage = namedtuple('SliceUsage', ['uid', 'cpu_percent', 'memory_percent',
+                                       'io_read', 'io_write'])
+
+
+def read_cpu_usec(path: str):
+    """
+    Returns:
+        int: usage_usec from the cpu.stat file in cgroup <path>.
+    """
+    with open(os.path.join(path, 'cpu.stat'), 'rb') as f:
+        for line in f:
+            if line.startswith(b'usage_usec '):
+                return int(line.split()[1])
+    raise ValueError('usage_usec not found in {}/cpu.stat'.format(path))
+
+
+def read_memory_bytes(path: str):
+    with open(os.path.join(path, 'memory.current'), 'rb') as f:
+        return int(f.read())
+
+
+def read_io_bytes(path: str):
+    """
+    Returns:
+        tuple: (rbytes, wbytes) from the io.stat file in cgroup <path>,
+            summed over all devices.
+    """
+    rbytes = wbytes = 0
+    with open(os.path.join(path, 'io.stat'), 'rb') as f:
+        for line in f:
+            for field in line.split()[1:]:
+                key, _, value = field.partition(b'=')
+                if key == b'rbytes':
+                    rbytes += int(value)
+                elif key == b'wbytes':
+                    wbytes += int(value)
+    return rbytes, wbytes
+
+
+def is_cgroup2(root: str):
+    """
+    True if a cgroup v2 hierarchy with user slices is mounted at <root>.
+    """
+    return (os.path.exists(os.path.join(root, 'cgroup.controllers'))
+            and os.path.isdir(os.path.join(root, 'user.slice')))
+
+
+class UserSliceAccounting:
+    """
+    Compute per user cpu and memory usage from systemd user slices.
+
+    Note that memory.current includes the page cache of the user, so it is
+    an upper bound of what memory_percent() adds up to. It is meant as a
+    cheap first pass: only the processes of users found here are sampled.
+    io.stat only holds bytes, read and write syscalls can not be told from
+    it.
+
+    Args:
+        root (str): where cgroup2 is mounted.
+        total_memory (int): bytes of memory, defaults to psutil's total.
+    """
+
+    def __init__(self, root: str = '/sys/fs/cgroup', total_memory: int = None):
+        self.root = root
+        self.total_memory = total_memory
+        self._cpu_usec = {}
+        self._io_bytes = {}
+        self._primed_at = None
+        self._warned = False
+
+    def slices(self):
+        """
+        Returns:
+            dict: uid -> path of the slice of that user.
+        """
+        user_slice = os.path.join(self.root, 'user.slice')
+        slices = {}
+        for entry in os.listdir(user_slice):
+            match = SLICE_PATTERN.match(entry)
+            if match:
+                slices[int(match.group(1))] = os.path.join(user_slice, entry)
+        return slices
+
+    def prime(self, io: bool = False):
+        """
+        Args:
+            io (bool): read io.stat too, for the io rates of sample().
+        """
+        usage = {}
+        io_bytes = {}
+        for uid, path in self.slices().items():
+            try:
+                usage[uid] = read_cpu_usec(path)
+            except (FileNotFoundError, ValueError):
+                continue
+            if io:
+                try:
+                    io_bytes[uid] = read_io_bytes(path)
+                except (FileNotFoundError, ValueError):
+                    pass
+        self._cpu_usec = usage
+        self._io_bytes = io_bytes
+        self._primed_at = time.monotonic()
+
+    def sample(self):
+        """
+        Returns:
+            dict: uid -> SliceUsage, for every user that was also present
+                during prime().
+        """
+        elapsed = time.monotonic() - self._primed_at
+        total_memory = self.total_memory or psutil.virtual_memory().total
+        usage = {}
+        for uid, path in self.slices().items():
+            if uid not in self._cpu_usec:
+                continue
+            try:
+                cpu_usec = read_cpu_usec(path)
+                memory = read_memory_bytes(path)
+            except (FileNotFoundError, ValueError):
+                continue
+            cpu_percent = 0
+            if elapsed > 0:
+                cpu_percent = (
+                    max(0, cpu_usec - self._cpu_usec[uid]) / 1e4 / elapsed)
+            io_read = io_write = None
+            if uid in self._io_bytes and elapsed > 0:
+                try:
+                    rbytes, wbytes = read_io_bytes(path)
+                except (FileNotFoundError, ValueError):
+                    pass
+                else:
+                    primed = self._io_bytes[uid]
+                    io_read = max(0, rbytes - primed[0]) / 2**20 / elapsed
+                    io_write = max(0, wbytes - primed[1]) / 2**20 / elapsed
+            usage[uid] = SliceUsage(uid, cpu_percent,
+                                    memory * 100 / total_memory,
+                                    io_read, io_write)
+        self._cpu_usec = {}
+        self._io_bytes = {}
+        return usage
+
+    def over(self, thresholds: dict):
+        """
+        Sample the slices and return the users over any of <thresholds>.
+        An io rate that could not be read counts as over, so is a threshold
+        on io_syscalls, which io.stat does not have: the processes of those
+        users are looked at instead.
+
+        Args:
+            thresholds (dict): metric -> the lowest threshold on it. The
+                metrics are those of SliceUsage and io_syscalls.
+
+        Returns:
+            list: uids, without root.
+        """
+        everyone = thresholds.get('io_syscalls') is not None
+        if everyone and not self._warned:
+            logging.warning(
+                'There are no io syscalls in the user slices, the processes '
+                'of all users are sampled for the io_syscalls rules.')
+            self._warned = True
+        thresholds = {metric: threshold
+                      for metric, threshold in thresholds.items()
+                      if threshold is not None and metric != 'io_syscalls'}
+
+        def is_over(usage):
+            for metric, threshold in thresholds.items():
+                value = getattr(usage, metric)
+                if value is None or value > threshold:
+                    return True
+            return False
+
+        return [usage.uid for usage in self.sample().values()
+                if usage.uid != 0 and (everyone or is_over(usage))]
+
+    def pids(self, uids):
+        """
+        Return the pids in the slices of <uids>, including all sub cgroups
+        (session scopes, user@.service, ...).
+        """
+        slices = self.slices()
+        pids = []
+        for uid in uids:
+            if uid not in slices:
+                continue
+            for dirpath, _, filenames in os.walk(slices[uid]):
+                if 'cgroup.procs' not in filenames:
+                    continue
+                try:
+                    with open(os.path.join(dirpath, 'cgroup.procs'), 'rb') as f:
+                        pids.extend(int(pid) for pid in f.read().split())
+                except FileNotFoundError:
+                    pass
+        return pids
+
+
+def get_accounting(name: str, root: str = '/sys/fs/cgroup'):
+    """
+    Return a UserSliceAccounting for name 'cgroup', None for 'processes'.
+    Falls back to per process accounting when there are no user slices.
+    """
+    if name != 'cgroup':
+        return None
+    if not is_cgroup2(root):
+        logging.warning(
+            'No cgroup v2 user slices at {}, '
+            'falling back to per process accounting.'.format(root))
+        return None
+    return UserSliceAccounting(root)
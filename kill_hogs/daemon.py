@@ -0,0 +1,125 @@
+"""
+Run kill hogs as a long running process instead of from cron.
+
+The config and everything a scan keeps between cycles stay in memory.
+SIGHUP reloads the config, SIGTERM and SIGINT stop the loop after the
+current scan has finished. With a scheduler, see pressure.py, a cycle only
+scans when the scheduler finds it worth it.
+"""
+
+import logging
+import signal
+import threading
+import time
+
+
+class Daemon:
+    """
+    Call <scan> with the current config every <period> seconds.
+
+    Args:
+        scan (callable): Called with the config dict once per cycle.
+        load_config (callable): Returns a fresh config dict.
+        period (float): Seconds between the start of two scans.
+        scheduler: a pressure.AdaptiveScheduler that decides per cycle
+            whether to scan and how long to wait for the next cycle.
+    """
+
+    def __init__(self, scan, load_config, period: float = 5, scheduler=None):
+        self.scan = scan
+        self.load_config = load_config
+        self.period = period
+        self.scheduler = scheduler
+        self.config = None
+        self.cycles = 0
+        self.skipped = 0
+        self._reload = threading.Event()
+        self._stop = threading.Event()
+        # Set to end the wait for the next cycle early.
+        self._wakeup = threading.Event()
+        self._forced = False
+
+    def request_reload(self, signum=None, frame=None):
+        """
+        Reload the config before the next scan. Used as SIGHUP handler.
+        """
+        logging.info('Config reload requested.')
+        self._reload.set()
+
+    def stop(self, signum=None, frame=None):
+        """
+        Stop the loop. Used as SIGTERM and SIGINT handler.
+        """
+        logging.info('Stopping kill hogs daemon.')
+        self._stop.set()
+        self._wakeup.set()
+
+    def wake(self):
+        """
+        Scan now instead of at the next cycle, also when the scheduler would
+        skip it.
+        """
+        self._forced = True
+        self._wakeup.set()
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGHUP, self.request_reload)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+    def reload(self):
+        """
+        Load the config. A broken config is logged and the old one is kept,
+        so a typo in the config file does not take enforcement down.
+        """
+        self._reload.clear()
+        try:
+            self.config = self.load_config()
+        except Exception as e:
+            if self.config is None:
+                raise
+            logging.error(
+                'Unable to reload config, keeping the old one.\n'
+                'The error was:\n{}'.format(e))
+
+    def run_once(self):
+        if self._reload.is_set() or self.config is None:
+            self.reload()
+        try:
+            self.scan(self.config)
+        except Exception:
+            logging.exception('Scan failed.')
+        self.cycles += 1
+
+    def run(self, max_cycles: int = None):
+        """
+        Scan until stopped.
+
+        Args:
+            max_cycles (int): Stop after this many cycles, scanned or
+                skipped. Run forever if None.
+        """
+        while not self.stopped:
+            start = time.monotonic()
+            self._wakeup.clear()
+            forced, self._forced = self._forced, False
+            if self.scheduler is None:
+                self.run_once()
+            elif self.scheduler.due(start) or forced:
+                self.run_once()
+                self.scheduler.scanned(time.monotonic())
+            else:
+                self.skipped += 1
+                self.cycles += 1
+            if max_cycles is not None and self.cycles >= max_cycles:
+                break
+            if self.scheduler is None:
+                self._wakeup.wait(max(0, self.period - (time.monotonic() - start)))
+            else:
+                self.scheduler.wait(
+                    max(0, self.scheduler.interval() - (time.monotonic() - start)),
+                    self._wakeup)
@@ -0,0 +1,430 @@
+"""
+Enforce on the usage of users summed over all nodes.
+
+Every node runs kill hogs with --controller. Instead of evaluating the
+policy itself, the agent sends the per user totals of every scan to the
+controller and gets back what to do with which user. The controller adds up
+the latest totals of every node and evaluates its policy on those, so a user
+running a bit on every login node is treated like one running all of it on
+one node.
+
+Agents and the controller talk json lines over one long lived unix or tcp
+connection per agent: one request and one reply per scan. When the
+controller can not be reached, the agent falls back to its local policy.
+
+    kill-hogs-controller --listen 0.0.0.0:7070 --cpu_threshold 600
+
+Anyone who can connect can report usage, so only listen on a management
+network or a unix socket.
+"""
+
+from kill_hogs.policy import Policy, WARNING
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+import yaml
+
+# The per user values an agent reports, in this order.
+FIELDS = ['cpu_percent', 'memory_percent', 'gpu_walltime', 'gpu_memory',
+          'gpu_utilization', 'io_read', 'io_write', 'io_syscalls']
+
+
+def parse_address(address: str):
+    """
+    Returns:
+        tuple: (socket family, address) for 'unix:/path' or 'host:port'.
+    """
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[5:]
+    host, port = address.rsplit(':', 1)
+    return socket.AF_INET, (host, int(port))
+
+
+def encode_users(users: dict):
+    """
+    Returns:
+        dict: username -> list of FIELDS, for the totals of collect_users().
+    """
+    return {username: [round(data.get(field, 0), 2) for field in FIELDS]
+            for username, data in users.items()}
+
+
+def decode_users(users: dict):
+    return {username: dict(zip(FIELDS, values))
+            for username, values in users.items()}
+
+
+class Reason(str):
+    """
+    A violated rule as described by the controller.
+    """
+
+    def describe(self):
+        return str(self)
+
+    @property
+    def metric(self):
+        return self.split()[0] if self else 'unknown'
+
+
+class Controller:
+    """
+    Keeps the latest report of every node and evaluates <policy> on the sum.
+
+    Args:
+        policy: a configured policy.Policy.
+        period (float): evaluate at most this often, in seconds. Should be a
+            bit shorter than the time between scans on the nodes, so every
+            scan round is one evaluation.
+        stale_after (float): forget the report of a node after this many
+            seconds.
+    """
+
+    def __init__(self, policy: Policy, period: float = 10,
+                 stale_after: float = 120):
+        self.policy = policy
+        self.period = period
+        self.stale_after = stale_after
+        # node -> (time, users)
+        self.nodes = {}
+        # username -> (action, reasons) of the latest evaluation.
+        self.decisions = {}
+        self.evaluation = 0
+        self.evaluated_at = None
+        # node -> the last evaluation whose decisions it got.
+        self.delivered = {}
+        self._lock = threading.Lock()
+
+    def totals(self, now: float):
+        """
+        Returns:
+            dict: username -> usage summed over the nodes that reported in
+                the last stale_after seconds.
+        """
+        totals = {}
+        for node, (reported_at, users) in list(self.nodes.items()):
+            if now - reported_at > self.stale_after:
+                del self.nodes[node]
+                continue
+            for username, data in users.items():
+                total = totals.setdefault(username, dict.fromkeys(FIELDS, 0))
+                for field in FIELDS:
+                    total[field] += data.get(field, 0)
+        return totals
+
+    def report(self, node: str, users: dict, now: float = None):
+        """
+        Store the usage per user of <node>.
+
+        Returns:
+            dict: username -> (action, reasons) for the users of <node> that
+                something should be done about. Every decision is given to
+                a node once.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self.nodes[node] = (now, users)
+            if self.evaluated_at is None or now - self.evaluated_at >= self.period:
+                decisions = self.policy.evaluate(self.totals(now), now)
+                self.decisions = {
+                    username: (action, [rule.describe() for rule in rules])
+                    for username, (action, rules) in decisions.items()
+                }
+                self.evaluation += 1
+                self.evaluated_at = now
+            if self.delivered.get(node) == self.evaluation:
+                return {}
+            self.delivered[node] = self.evaluation
+            return {username: decision
+                    for username, decision in self.decisions.items()
+                    if username in users}
+
+    def floor(self, metric: str):
+        """
+        Returns:
+            float: the lowest threshold on <metric> divided by the number of
+                nodes. A user below it on a node can only be over the
+                threshold when over the floor on another node, so nodes
+                need not report users below it. None without a rule on
+                <metric>.
+        """
+        threshold = self.policy.lowest_threshold(metric, None)
+        if threshold is None:
+            return None
+        with self._lock:
+            return threshold / max(1, len(self.nodes))
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """
+    Answers the json lines of one agent until it disconnects.
+    """
+
+    def handle(self):
+        controller = self.server.controller
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+                decisions = controller.report(
+                    message['node'], decode_users(message['users']))
+                reply = {
+                    'decisions': decisions,
+                    'uses_gpu': controller.policy.uses_gpu(),
+                    'uses_io': controller.policy.uses_io(),
+                    'lowest': {
+                        metric: controller.floor(metric)
+                        for metric in ('cpu_percent', 'memory_percent')
+                    },
+                }
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {'error': 'bad request: {}'.format(e)}
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+            self.wfile.flush()
+
+
+class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(address: str, controller: Controller):
+    """
+    Returns:
+        socketserver.BaseServer: serving <controller> at <address>.
+    """
+    family, address = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(address):
+            os.remove(address)
+        server = UnixServer(address, Handler)
+    else:
+        server = TCPServer(address, Handler)
+    server.controller = controller
+    return server
+
+
+class FleetAgent:
+    """
+    Stands in for a policy.Policy in kill_hogs(): evaluate() asks the
+    controller at <address>. When it can not be reached, <fallback>, a
+    local policy, decides instead.
+
+    Args:
+        address (str): 'unix:/path' or 'host:port' of the controller.
+        node (str): name of this node, defaults to the hostname.
+        timeout (float): seconds to wait for the controller.
+        fallback: a policy.Policy.
+    """
+
+    def __init__(self, address: str, node: str = None, timeout: float = 5,
+                 fallback: Policy = None):
+        self.address = address
+        self.node = node or socket.gethostname()
+        self.timeout = timeout
+        self.fallback = fallback or Policy()
+        self._sock = None
+        self._file = None
+        # What the controller told about its rules, None before it did.
+        self._uses_gpu = None
+        self._uses_io = None
+        self._lowest = None
+
+    @property
+    def warning(self):
+        return self.fallback.warning or WARNING
+
+    def configure(self, *args, **kwargs):
+        self.fallback.configure(*args, **kwargs)
+
+    def uses_gpu(self):
+        if self._uses_gpu is None:
+            return self.fallback.uses_gpu()
+        return self._uses_gpu or self.fallback.uses_gpu()
+
+    def uses_io(self):
+        if self._uses_io is None:
+            return self.fallback.uses_io()
+        return self._uses_io or self.fallback.uses_io()
+
+    def lowest_threshold(self, metric: str, default: float):
+        if self._lowest is None:
+            # Report everyone until the controller told its floors.
+            return 0
+        lowest = self._lowest.get(metric)
+        local = self.fallback.lowest_threshold(metric, default)
+        return local if lowest is None else min(lowest, local)
+
+    def connect(self):
+        family, address = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self._file = sock.makefile('rwb')
+
+    def close(self):
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                self._file.close()
+            except OSError:
+                # Unable to flush to a controller that went away.
+                pass
+            sock.close()
+        self._file = None
+
+    def request(self, message: dict):
+        """
+        Send <message> over the connection, reconnecting once when the
+        controller went away in the meantime.
+
+        Returns:
+            dict: the reply.
+        """
+        data = json.dumps(message).encode() + b'\n'
+        for attempt in range(2):
+            try:
+                if self._sock is None:
+                    self.connect()
+                self._file.write(data)
+                self._file.flush()
+                line = self._file.readline()
+                if not line:
+                    raise ConnectionError('controller closed the connection')
+                return json.loads(line)
+            except OSError:
+                self.close()
+                if attempt:
+                    raise
+
+    def evaluate(self, users: dict, now: float):
+        """
+        Returns:
+            dict: username -> (action, reasons), like Policy.evaluate().
+        """
+        try:
+            reply = self.request({'node': self.node, 'time': now,
+                                  'users': encode_users(users)})
+            if 'error' in reply:
+                raise ValueError(reply['error'])
+        except (OSError, ValueError) as e:
+            logging.warning('Controller {} not available, using the local '
+                            'policy: {}'.format(self.address, e))
+            return self.fallback.evaluate(users, now)
+        self._uses_gpu = reply.get('uses_gpu', False)
+        self._uses_io = reply.get('uses_io', False)
+        self._lowest = reply.get('lowest', {})
+        return {username: (action, [Reason(reason) for reason in reasons])
+                for username, (action, reasons) in reply['decisions'].items()}
+
+    def save(self):
+        self.fallback.save()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Evaluate the usage of users summed over all nodes.")
+    parser.add_argument(
+        "--listen",
+        type=str,
+        default='unix:/run/kill_hogs.sock',
+        help="unix:/path or host:port to listen on.")
+    parser.add_argument(
+        "--config_file",
+        type=str,
+        default='{}/.kill_hogs/kill_hogs.yml'.format(os.environ['HOME']),
+        help="Config file with the policy, default: ~/.kill_hogs/kill_hogs.yml")
+    parser.add_argument(
+        "--memory_threshold",
+        type=float,
+        default=10,
+        help="memory percentage, summed over nodes, above which processes "
+        "are killed")
+    parser.add_argument(
+        "--cpu_threshold",
+        type=float,
+        default=600,
+        help="cpu percentage, summed over nodes, above which processes are "
+        "killed")
+    parser.add_argument(
+        "--gpu_max_walltime",
+        type=float,
+        default=0,
+        help="maximum wall time limit in minutes for using a gpu")
+    parser.add_argument(
+        "--gpu_memory_threshold",
+        type=float,
+        default=0,
+        help="MiB of gpu memory, summed over nodes, a user can use, 0 for no "
+        "limit")
+    parser.add_argument(
+        "--gpu_util_threshold",
+        type=float,
+        default=0,
+        help="gpu utilisation percentage, summed over nodes, a user can use, "
+        "0 for no limit. Needs nvml on the nodes.")
+    parser.add_argument(
+        "--io_read_threshold",
+        type=float,
+        default=0,
+        help="MiB/s, summed over nodes, a user can read, 0 for no limit")
+    parser.add_argument(
+        "--io_write_threshold",
+        type=float,
+        default=0,
+        help="MiB/s, summed over nodes, a user can write, 0 for no limit")
+    parser.add_argument(
+        "--io_syscall_threshold",
+        type=float,
+        default=0,
+        help="read and write syscalls per second, summed over nodes, a user "
+        "can do, 0 for no limit")
+    parser.add_argument(
+        "--period",
+        type=float,
+        default=10,
+        help="Evaluate at most every this many seconds. A bit less than the "
+        "time between scans on the nodes.")
+    parser.add_argument(
+        "--stale_after",
+        type=float,
+        default=120,
+        help="Forget the usage of a node that did not report for this many "
+        "seconds.")
+    args = parser.parse_args()
+
+    with open(args.config_file, 'r') as f:
+        config = yaml.load(f, Loader=yaml.BaseLoader)
+    policy = Policy()
+    policy.configure(config, args.memory_threshold, args.cpu_threshold,
+                     args.gpu_max_walltime,
+                     gpu_memory_threshold=args.gpu_memory_threshold,
+                     gpu_util_threshold=args.gpu_util_threshold,
+                     io_read_threshold=args.io_read_threshold,
+                     io_write_threshold=args.io_write_threshold,
+                     io_syscall_threshold=args.io_syscall_threshold)
+    controller = Controller(policy, args.period, args.stale_after)
+    server = make_server(args.listen, controller)
+    logging.info('Listening on {}.'.format(args.listen))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+GPU usage per process.
+
+A gpu sampler returns a dict pid -> GpuUsage for every process using a GPU.
+The nvml sampler asks the NVIDIA driver directly through the pynvml
+bindings: no process is started and it also reports the SM utilisation of
+every process. Without pynvml, nvidia-smi is run instead, which only knows
+the memory used by every process.
+"""
+
+from collections import namedtuple
+import logging
+import subprocess
+
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+
+MiB = 1024 * 1024
+
+# memory in MiB, utilization in % of the SMs of one GPU.
+GpuUsage = namedtuple('GpuUsage', ['memory', 'utilization'])
+
+
+def add(usage: dict, pid: int, memory: float = 0, utilization: float = 0):
+    """
+    Add usage of <pid> on one GPU to <usage>. A process can use more than one.
+    """
+    previous = usage.get(pid)
+    if previous is not None:
+        memory += previous.memory
+        utilization += previous.utilization
+    usage[pid] = GpuUsage(memory, utilization)
+
+
+class NvmlSampler:
+    """
+    Sample GPU usage through NVML.
+    """
+    name = 'nvml'
+
+    def __init__(self):
+        if pynvml is None:
+            raise RuntimeError('pynvml is not installed')
+        pynvml.nvmlInit()
+        self.handles = [pynvml.nvmlDeviceGetHandleByIndex(i)
+                        for i in range(pynvml.nvmlDeviceGetCount())]
+        # Utilisation samples newer than this were not seen yet, per GPU.
+        self._last_seen = [0] * len(self.handles)
+
+    def sample(self):
+        """
+        Returns:
+            dict: pid -> GpuUsage
+        """
+        usage = {}
+        for i, handle in enumerate(self.handles):
+            for proc in pynvml.nvmlDeviceGetComputeRunningProcesses(handle):
+                add(usage, proc.pid, (proc.usedGpuMemory or 0) / MiB)
+            try:
+                samples = pynvml.nvmlDeviceGetProcessUtilization(
+                    handle, self._last_seen[i])
+            except pynvml.NVMLError:
+                # No samples since the previous call.
+                continue
+            latest = {}
+            for sample in samples:
+                if sample.timeStamp >= latest.get(sample.pid, (0, 0))[0]:
+                    latest[sample.pid] = (sample.timeStamp, sample.smUtil)
+                self._last_seen[i] = max(self._last_seen[i], sample.timeStamp)
+            for pid, (_, utilization) in latest.items():
+                add(usage, pid, utilization=utilization)
+        return usage
+
+
+def parse_compute_apps(output: str):
+    """
+    Parse the output of
+    nvidia-smi --query-compute-apps=pid,used_memory --format=csv,noheader,nounits
+
+    Returns:
+        dict: pid -> GpuUsage
+    """
+    usage = {}
+    for line in output.splitlines():
+        fields = [field.strip() for field in line.split(',')]
+        if not fields[0].isdigit():
+            continue
+        memory = 0
+        if len(fields) > 1:
+            try:
+                memory = float(fields[1])
+            except ValueError:
+                # [N/A] without permission to see the memory of the process.
+                pass
+        add(usage, int(fields[0]), memory)
+    return usage
+
+
+class NvidiaSmiSampler:
+    """
+    Sample GPU usage by running nvidia-smi. Does not know utilisation.
+    """
+    name = 'nvidia-smi'
+
+    def sample(self):
+        try:
+            nvidia_smi = subprocess.run(
+                ['nvidia-smi', '--query-compute-apps=pid,used_memory',
+                 '--format=csv,noheader,nounits'],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            return {}
+        if nvidia_smi.returncode != 0:
+            return {}
+        return parse_compute_apps(nvidia_smi.stdout.decode('ascii', 'replace'))
+
+
+class FakeGpuSampler:
+    """
+    Returns the usage it was given. For tests and benchmarks.
+    """
+    name = 'fake'
+
+    def __init__(self, usage: dict = None):
+        self.usage = dict(usage or {})
+
+    def sample(self):
+        return dict(self.usage)
+
+
+GPU_SAMPLERS = {
+    'nvml': NvmlSampler,
+    'nvidia-smi': NvidiaSmiSampler,
+}
+
+
+def get_gpu_sampler(name: str = 'auto'):
+    """
+    Return the gpu sampler called <name>. auto uses nvml when pynvml and a
+    driver are available and nvidia-smi otherwise.
+    """
+    if name in ('auto', 'nvml'):
+        try:
+            return NvmlSampler()
+        except Exception as e:
+            if name == 'nvml':
+                logging.warning('nvml not available, falling back to '
+                                'nvidia-smi: {}'.format(e))
+            return NvidiaSmiSampler()
+    return GPU_SAMPLERS[name]()
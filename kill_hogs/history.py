@@ -0,0 +1,298 @@
+"""
+Keep the per user usage of every scan in a fixed size ring file.
+
+Every scan appends one record per counted user, one record for the scan
+itself and optionally records for its heaviest processes. The file is a
+small header followed by <capacity> fixed size records and is memory
+mapped, so appending is a few struct.pack_into calls and the file never
+grows. When it is full the oldest records are overwritten.
+
+The header keeps the number of records ever written, so a new run, from
+cron or after a restart, continues where the previous one stopped.
+
+    kill-hogs-history --since 1h --top 10
+
+shows who used the most over the last hour.
+"""
+
+from collections import namedtuple
+from kill_hogs.usage import counted_processes
+import argparse
+import heapq
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import time
+
+MAGIC = b'KHHIST01'
+# magic, record size, capacity, number of records written.
+HEADER = struct.Struct('<8sIIQ')
+# time, username, pid (0 for a user total), cpu %, memory %, gpu minutes.
+RECORD = struct.Struct('<d32sifff')
+# The record with this username holds the totals of a scan.
+SCAN = ''
+
+Record = namedtuple(
+    'Record', ['time', 'user', 'pid', 'cpu_percent', 'memory_percent',
+               'gpu_walltime'])
+
+
+class HistoryStore:
+    """
+    Args:
+        path (str): the ring file. Made if it does not exist.
+        capacity (int): number of records in a new file. An existing file
+            keeps its own capacity.
+        top_processes (int): also store this many of the processes using
+            the most cpu every scan.
+        readonly (bool): only read an existing file.
+    """
+
+    def __init__(self, path: str, capacity: int = 100000,
+                 top_processes: int = 0, readonly: bool = False):
+        self.path = path
+        self.top_processes = top_processes
+        if readonly:
+            fd = os.open(path, os.O_RDONLY)
+        else:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            if size == 0 and not readonly:
+                size = HEADER.size + capacity * RECORD.size
+                os.ftruncate(fd, size)
+                os.pwrite(fd, HEADER.pack(MAGIC, RECORD.size, capacity, 0), 0)
+            if size < HEADER.size:
+                raise ValueError('{} is not a kill hogs history file'.format(path))
+            self._map = mmap.mmap(
+                fd, size, access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+        finally:
+            os.close(fd)
+        magic, record_size, self.capacity, _ = HEADER.unpack_from(self._map)
+        if magic != MAGIC or record_size != RECORD.size or \
+                size != HEADER.size + self.capacity * RECORD.size:
+            self._map.close()
+            raise ValueError('{} is not a kill hogs history file'.format(path))
+
+    @property
+    def written(self):
+        """
+        Number of records ever appended.
+        """
+        return HEADER.unpack_from(self._map)[3]
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def append(self, now: float, rows):
+        """
+        Append <rows> of (username, pid, cpu %, memory %, gpu minutes)
+        recorded at <now>.
+        """
+        written = self.written
+        for user, pid, cpu_percent, memory_percent, gpu_walltime in rows:
+            offset = HEADER.size + written % self.capacity * RECORD.size
+            RECORD.pack_into(self._map, offset, now, user.encode()[:32], pid,
+                             cpu_percent, memory_percent, gpu_walltime)
+            written += 1
+        # Only count the records once they have all been written.
+        struct.pack_into('<Q', self._map, HEADER.size - 8, written)
+
+    def record(self, now: float, users: dict, snapshot=None):
+        """
+        Append the totals of one scan as returned by collect_users(), and
+        the heaviest processes in <snapshot>.
+        """
+        rows = [(SCAN, 0,
+                 sum(data['cpu_percent'] for data in users.values()),
+                 sum(data['memory_percent'] for data in users.values()),
+                 sum(data['gpu_walltime'] for data in users.values()))]
+        for username, data in users.items():
+            rows.append((username, 0, data['cpu_percent'],
+                         data['memory_percent'], data['gpu_walltime']))
+        if snapshot is not None and self.top_processes:
+            counted = counted_processes(users)
+            for username, i in heapq.nlargest(
+                    self.top_processes, counted,
+                    key=lambda item: snapshot.cpu_percent[item[1]]):
+                rows.append((username, snapshot.pids[i],
+                             snapshot.cpu_percent[i],
+                             snapshot.memory_percent[i], 0))
+        self.append(now, rows)
+
+    def _ranges(self):
+        """
+        Returns:
+            list: (first, last) byte offsets of the stored records, oldest
+                first.
+        """
+        written = self.written
+        start = max(0, written - self.capacity) % self.capacity
+        end = HEADER.size + self.capacity * RECORD.size
+        if written <= self.capacity:
+            end = HEADER.size + written * RECORD.size
+        offsets = [(HEADER.size + start * RECORD.size, end)]
+        if start:
+            offsets.append((HEADER.size, HEADER.size + start * RECORD.size))
+        return offsets
+
+    def chunks(self):
+        """
+        Returns:
+            list: memoryviews of the packed records, oldest first, without
+                copying them. Release them before close().
+        """
+        with memoryview(self._map) as view:
+            return [view[first:last] for first, last in self._ranges()]
+
+    def records(self, since: float = 0, until: float = float('inf')):
+        """
+        Yield the stored records from <since> up to <until>, oldest first.
+        """
+        for first, last in self._ranges():
+            for record in RECORD.iter_unpack(self._map[first:last]):
+                if since <= record[0] < until:
+                    yield Record(record[0],
+                                 record[1].rstrip(b'\0').decode('utf-8', 'replace'),
+                                 *record[2:])
+
+    def close(self):
+        self._map.close()
+
+
+def summarize_users(records, sort: str = 'cpu', top: int = 10):
+    """
+    Usage per user over all scans in <records>. A user missing from a scan
+    did not use anything worth counting in that scan.
+
+    Returns:
+        list: dicts of the <top> users with the highest <sort>, one of cpu,
+            memory or gpu.
+    """
+    scans = 0
+    users = {}
+    for record in records:
+        if record.pid:
+            continue
+        if record.user == SCAN:
+            scans += 1
+            continue
+        if record.user not in users:
+            users[record.user] = {
+                'user': record.user, 'scans': 0, 'cpu_total': 0,
+                'cpu_max': 0, 'memory_total': 0, 'memory_max': 0,
+                'gpu_max': 0, 'last_seen': 0}
+        data = users[record.user]
+        data['scans'] += 1
+        data['cpu_total'] += record.cpu_percent
+        data['cpu_max'] = max(data['cpu_max'], record.cpu_percent)
+        data['memory_total'] += record.memory_percent
+        data['memory_max'] = max(data['memory_max'], record.memory_percent)
+        data['gpu_max'] = max(data['gpu_max'], record.gpu_walltime)
+        data['last_seen'] = record.time
+    for data in users.values():
+        data['cpu_mean'] = data.pop('cpu_total') / max(scans, data['scans'])
+        data['memory_mean'] = data.pop('memory_total') / max(scans, data['scans'])
+    key = {'cpu': 'cpu_mean', 'memory': 'memory_mean', 'gpu': 'gpu_max'}[sort]
+    return heapq.nlargest(top, users.values(), key=lambda data: data[key])
+
+
+def summarize_processes(records, sort: str = 'cpu', top: int = 10):
+    """
+    Returns:
+        list: dicts of the <top> stored processes with the highest peak
+            <sort>, one of cpu or memory.
+    """
+    processes = {}
+    for record in records:
+        if not record.pid:
+            continue
+        key = (record.user, record.pid)
+        if key not in processes:
+            processes[key] = {
+                'user': record.user, 'pid': record.pid, 'scans': 0,
+                'cpu_max': 0, 'memory_max': 0, 'first_seen': record.time}
+        data = processes[key]
+        data['scans'] += 1
+        data['cpu_max'] = max(data['cpu_max'], record.cpu_percent)
+        data['memory_max'] = max(data['memory_max'], record.memory_percent)
+        data['last_seen'] = record.time
+    key = {'cpu': 'cpu_max', 'memory': 'memory_max'}[sort]
+    return heapq.nlargest(top, processes.values(), key=lambda data: data[key])
+
+
+def parse_duration(text: str):
+    """
+    Returns:
+        float: seconds in <text>, like 90, 90s, 30m, 1h or 2d.
+    """
+    match = re.match(r'^([0-9.]+)([smhd]?)$', text)
+    if match is None:
+        raise ValueError('Not a duration: {}'.format(text))
+    factor = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+    return float(match.group(1)) * factor
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Show who used the most according to the kill hogs history.")
+    parser.add_argument(
+        "--history_file",
+        type=str,
+        default='{}/.kill_hogs/history.bin'.format(os.environ['HOME']),
+        help="History written by kill-hogs --history_file.")
+    parser.add_argument(
+        "--since",
+        type=str,
+        default='1h',
+        help="Start of the window, as a duration ago: 90s, 30m, 1h or 2d.")
+    parser.add_argument(
+        "--until",
+        type=str,
+        default='0',
+        help="End of the window, as a duration ago.")
+    parser.add_argument(
+        "--top", type=int, default=10, help="Number of users to show.")
+    parser.add_argument(
+        "--sort", choices=['cpu', 'memory', 'gpu'], default='cpu')
+    parser.add_argument(
+        "--processes",
+        action='store_true',
+        help="Show the stored heaviest processes instead of users.")
+    parser.add_argument(
+        "--json", action='store_true', help="Print json lines.")
+    args = parser.parse_args()
+
+    now = time.time()
+    store = HistoryStore(args.history_file, readonly=True)
+    records = store.records(now - parse_duration(args.since),
+                            now - parse_duration(args.until))
+    if args.processes:
+        if args.sort == 'gpu':
+            parser.error('gpu time is only stored per user')
+        rows = summarize_processes(records, args.sort, args.top)
+    else:
+        rows = summarize_users(records, args.sort, args.top)
+    store.close()
+
+    for row in rows:
+        if args.json:
+            print(json.dumps(row, sort_keys=True))
+        elif args.processes:
+            print('{:12} pid {:8d} cpu max {:8.2f}% memory max {:6.2f}% '
+                  'in {} scans'.format(row['user'], row['pid'], row['cpu_max'],
+                                       row['memory_max'], row['scans']))
+        else:
+            print('{:12} cpu mean {:8.2f}% max {:8.2f}% memory mean {:6.2f}% '
+                  'max {:6.2f}% gpu {:6.0f} min in {} scans'.format(
+                      row['user'], row['cpu_mean'], row['cpu_max'],
+                      row['memory_mean'], row['memory_max'], row['gpu_max'],
+                      row['scans']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Cache who is who: uid -> username, username -> email address and whether a
+user is restricted.
+
+Looking up a username for every process and forking finger for every
+offender on every run adds up. In daemon mode the cache lives in memory,
+from cron it can be kept in a json file between runs.
+"""
+
+import json
+import logging
+import os
+import re
+import time
+
+
+class TTLCache:
+    """
+    A dict whose entries expire <ttl> seconds after they were added.
+    Counts hits and misses.
+    """
+
+    def __init__(self, ttl: float, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, compute):
+        """
+        Return the cached value for <key>, or call <compute>() and cache
+        the result if there is none or it has expired.
+        """
+        now = self.clock()
+        entry = self._data.get(key)
+        if entry is not None and entry[0] > now:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = compute()
+        self._data[key] = (now + self.ttl, value)
+        return value
+
+    def expire(self):
+        """
+        Drop expired entries.
+        """
+        now = self.clock()
+        self._data = {
+            key: entry for key, entry in self._data.items() if entry[0] > now
+        }
+
+    def dump(self):
+        """
+        Returns:
+            list: [key, expiry, value] for every entry.
+        """
+        return [[key, expiry, value] for key, (expiry, value) in self._data.items()]
+
+    def restore(self, entries):
+        for key, expiry, value in entries:
+            self._data[key] = (expiry, value)
+
+
+class IdentityCache:
+    """
+    Args:
+        ttl (float): seconds to remember usernames and restriction results.
+        email_ttl (float): seconds to remember email addresses.
+        cache_file (str): json file to keep the cache in between runs.
+    """
+
+    def __init__(self, ttl: float = 3600, email_ttl: float = 86400,
+                 cache_file: str = None):
+        self.usernames = TTLCache(ttl)
+        self.emails = TTLCache(email_ttl)
+        self.restricted = TTLCache(ttl)
+        self.cache_file = cache_file
+        self._patterns = {}
+        if cache_file is not None:
+            self.load()
+
+    def username(self, uid: int, lookup):
+        """
+        Args:
+            uid (int): the uid to resolve.
+            lookup (callable): returns the username, called on a miss.
+        """
+        return self.usernames.get(uid, lookup)
+
+    def email(self, username: str, lookup):
+        """
+        Args:
+            username (str): whose email address to return.
+            lookup (callable): called with <username> on a miss, like find_email().
+        """
+        return self.emails.get(username, lambda: lookup(username))
+
+    def is_restricted(self, username: str, pattern: str):
+        """
+        Memoized version of kill_hogs.is_restricted().
+        """
+        if pattern not in self._patterns:
+            self._patterns[pattern] = re.compile(pattern)
+        compiled = self._patterns[pattern]
+        return self.restricted.get(
+            (pattern, username), lambda: compiled.match(username) is not None)
+
+    def stats(self):
+        """
+        Returns:
+            dict: cache name -> {'hits': int, 'misses': int, 'size': int}
+        """
+        return {
+            name: {'hits': cache.hits, 'misses': cache.misses, 'size': len(cache)}
+            for name, cache in (('usernames', self.usernames),
+                                ('emails', self.emails),
+                                ('restricted', self.restricted))
+        }
+
+    def load(self):
+        try:
+            with open(self.cache_file, 'r') as f:
+                data = json.load(f)
+            self.usernames.restore(data['usernames'])
+            self.emails.restore(data['emails'])
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning('Ignoring broken identity cache {}: {}'.format(
+                self.cache_file, e))
+
+    def save(self):
+        """
+        Write usernames and email addresses to the cache file, if any.
+        """
+        if self.cache_file is None:
+            return
+        self.usernames.expire()
+        self.emails.expire()
+        tmp = self.cache_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'usernames': self.usernames.dump(),
+                       'emails': self.emails.dump()}, f)
+        os.replace(tmp, self.cache_file)
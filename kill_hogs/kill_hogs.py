@@ -1,6 +1,29 @@
 #!/usr/bin/env python3
 
-from collections import defaultdict
+from functools import partial
+from kill_hogs import request_channel
+from kill_hogs import budget as scan_budget
+from kill_hogs.accounting import CpuAccountant
+from kill_hogs.cgroups import get_accounting
+from kill_hogs.daemon import Daemon
+from kill_hogs.fleet import FleetAgent
+from kill_hogs.gpu import GPU_SAMPLERS, NvidiaSmiSampler, get_gpu_sampler
+from kill_hogs.history import HistoryStore
+from kill_hogs.identity import IdentityCache
+from kill_hogs.memory import MEMORY_ACCOUNTING, get_memory_accounting
+from kill_hogs.metrics import Metrics, serve
+from kill_hogs.notify import Notifier, mail_text
+from kill_hogs.policy import IO_METRICS, Policy
+from kill_hogs.pressure import (
+    AdaptiveScheduler, DEFAULT_TRIGGERS, PressureMonitor, PressureTrigger,
+    parse_thresholds)
+from kill_hogs.proc_events import ProcessTable, start_listener
+from kill_hogs.proctree import ProcessTree
+from kill_hogs.profiler import ScanProfile, write_profile
+from kill_hogs.samplers import PsutilSampler, SAMPLERS, get_sampler
+from kill_hogs.throttle import Throttler
+from kill_hogs.terminals import TerminalIndex, write_to_tty
+from kill_hogs.usage import Users, top_processes
 from pathlib import Path
 import argparse
 import json
@@ -14,15 +37,32 @@ import subprocess
 import time
 import yaml
 
-flagfile = '/tmp/kill_hogs_flagfile'
+flagfile = request_channel.FLAG_FILE
 
-def post_to_slack(message: str, slack_url: str):
+# Introduces the processes in the message about a user, per action.
+HEADINGS = {
+    'warn': 'The user was warned about the following processes:',
+    'renice': 'The following processes will be reniced:',
+    'pause': 'The following processes will be paused part of the time:',
+    'throttle': 'The following processes will be throttled:',
+    'kill': 'The following processes will be killed:',
+}
+
+# Parsed again only when it changes.
+utmp = TerminalIndex()
+
+def post_to_slack(message: str, slack_url: str, session=None, timeout: float = 10):
     """
     Post a message to slack.
 
     Args:
         message (str): Message to post
         slack_url (str): url to post message to
+        session (requests.Session): session to reuse, if any.
+        timeout (float): seconds to wait for slack.
+
+    Returns:
+        requests.Response: the response of slack.
     """
     data = json.dumps({
         'channel': '#kill-hogs',
@@ -30,18 +70,20 @@ def post_to_slack(message: str, slack_url: str):
         'text': message,
         'icon_emoji': ':scales:'
     }).encode('utf-8')
-    response = requests.post(
-        slack_url, data=data, headers={'Content-Type': 'application/json'})
+    response = (session or requests).post(
+        slack_url, data=data, headers={'Content-Type': 'application/json'},
+        timeout=timeout)
     logging.info('Posting to slack')
     logging.info(str(response.status_code) + str(response.text))
+    return response
 
 
-def request_enforcement():
+def request_enforcement(reason: str = ''):
     """
-    Make a file in /tmp
+    Ask the daemon for a scan. Without a daemon, make a file in /tmp
     that wil signal the script to run.
     """
-    Path(flagfile).touch()
+    return request_channel.request_enforcement(reason, flagfile=flagfile)
 
 
 def check_and_remove():
@@ -58,32 +100,37 @@ def check_and_remove():
     return False
 
 
-def send_message_to_terminals(user: str, message: str):
+def send_message_to_terminals(user: str, message: str,
+                              index: TerminalIndex = None, terminals=None):
     """
-    Sends <message> to all terminals on which <user> is logged in.
+    Sends <message> to all terminals on which <user> is logged in, or to
+    <terminals> when given.
+
+    Returns:
+        list: the terminals writing to failed with an error, to retry.
     """
-    terminals = find_terminals_of_user(user)
+    if terminals is None:
+        terminals = find_terminals_of_user(user, index)
+    failed = []
     for terminal in terminals:
-        subprocess.run(
-            'echo "{message}" | write {user} {terminal}'.format(
-                message=message, user=user, terminal=terminal),
-            shell=True)
+        try:
+            write_to_tty(terminal, message)
+        except OSError as e:
+            logging.warning('Unable to write to terminal {}: {}'.format(
+                terminal, e))
+            failed.append(terminal)
+    return failed
 
 
-def find_terminals_of_user(user: str):
+def find_terminals_of_user(user: str, index: TerminalIndex = None):
     """
     Args:
         user (str): The user who's terminals to return.
+        index (TerminalIndex): where to look, defaults to /var/run/utmp.
     Returns:
         list: A list of terminals (string)
     """
-    terminals = subprocess.run(
-        'w -s -h', shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    return [
-        t.split()[1]
-        for t in str(terminals.stdout).strip('b\'').strip('').split('\\n')
-        if user in t
-    ]
+    return (index or utmp).terminals(user)
 
 
 def on_terminate(proc):
@@ -94,20 +141,166 @@ def on_terminate(proc):
         proc, proc.returncode))
 
 
-def terminate(kill_list):
+def process_groups(kill_list):
+    """
+    Return the process groups the processes in <kill_list> are in.
+
+    Returns:
+        dict: (uid, pgid) -> the earliest start time of the processes of
+            <kill_list> in it. Root processes are left out.
+    """
+    groups = {}
+    own = os.getpgid(0)
+    for proc in kill_list:
+        try:
+            uid = proc.uids().real
+            create_time = proc.create_time()
+            pgid = os.getpgid(proc.pid)
+        except (psutil.NoSuchProcess, ProcessLookupError, FileNotFoundError):
+            continue
+        if uid == 0 or pgid == own:
+            continue
+        key = (uid, pgid)
+        groups[key] = min(groups.get(key, create_time), create_time)
+    return groups
+
+
+def group_members(groups: dict, exclude):
+    """
+    Find the processes in <groups> (see process_groups()), for instance
+    children that were forked while waiting for their parents to terminate
+    and lost their parent since. Only processes of the uid the group was
+    found for that started with or after the killed processes in it are
+    returned, so a shell without job control is left alone.
+
+    Args:
+        exclude (iterable): pids to leave out.
+    """
+    exclude = set(exclude)
+    members = []
+    for proc in psutil.process_iter():
+        if proc.pid in exclude:
+            continue
+        try:
+            uid = proc.uids().real
+            since = groups.get((uid, os.getpgid(proc.pid)))
+            if since is not None and proc.create_time() >= since:
+                members.append(proc)
+        except (psutil.NoSuchProcess, ProcessLookupError, FileNotFoundError):
+            pass
+    return members
+
+
+def descendants(kill_list, process_tree: ProcessTree = None):
+    """
+    Find the descendants of the processes in <kill_list> of the same user:
+    those in <process_tree> when given, and those running now.
+
+    Returns:
+        list: psutil.Process objects, without the ones in <kill_list>.
+    """
+    seen = {proc.pid for proc in kill_list}
+    found = []
+    if process_tree is not None and process_tree.snapshot is not None:
+        index = process_tree.index
+        indices = set()
+        for proc in kill_list:
+            if proc.pid in index:
+                indices.update(process_tree.subtree(index[proc.pid]))
+        snapshot = process_tree.snapshot
+        for proc in snapshot.processes(sorted(
+                i for i in indices if snapshot.pids[i] not in seen)):
+            seen.add(proc.pid)
+            found.append(proc)
+    for proc in list(kill_list) + found:
+        try:
+            uid = proc.uids().real
+            children = proc.children(recursive=True)
+        except (psutil.NoSuchProcess, FileNotFoundError):
+            continue
+        for child in children:
+            try:
+                if child.pid not in seen and child.uids().real == uid:
+                    seen.add(child.pid)
+                    found.append(child)
+            except (psutil.NoSuchProcess, FileNotFoundError):
+                pass
+    return found
+
+
+def terminate(kill_list, timeout: float = 3,
+              process_tree: ProcessTree = None):
     """
     Terminate processes. Kill if terminate is unsuccesful.
 
+    The processes, their descendants of the same user and what that user
+    started since in their process groups get SIGTERM at once and are
+    waited for together, so the grace period is paid once per scan instead
+    of once per user. What is left after that gets SIGKILL, as does
+    whatever the processes forked in the meantime. The rest of the session,
+    such as the login shell and its other jobs, is left alone.
+
     Args:
-        kill_list (list): List of processes to kill.
+        kill_list (list): List of processes to kill, of all users.
+        timeout (float): seconds to wait after SIGTERM.
+        process_tree: the proctree.ProcessTree of the scan, if any, to find
+            the descendants in.
+
+    Returns:
+        dict: seconds spent per stage ('terminate', 'wait', 'kill').
     """
-    for proc in kill_list:
-        proc.terminate()
+    timings = {}
+    start = time.monotonic()
+    groups = process_groups(kill_list)
+    members = descendants(kill_list, process_tree)
+    targeted = {proc.pid for proc in kill_list + members}
+    members += group_members(groups, targeted)
+    targets = list(kill_list) + members
+    for proc in targets:
+        try:
+            proc.terminate()
+        except psutil.NoSuchProcess:
+            pass
+    timings['terminate'] = time.monotonic() - start
+
+    start = time.monotonic()
     gone, alive = psutil.wait_procs(
-        kill_list, timeout=3, callback=on_terminate)
-    for proc in alive:
+        targets, timeout=timeout, callback=on_terminate)
+    timings['wait'] = time.monotonic() - start
+
+    start = time.monotonic()
+    targeted = {proc.pid for proc in targets}
+    stragglers = [proc for proc in descendants(alive)
+                  if proc.pid not in targeted]
+    targeted.update(proc.pid for proc in stragglers)
+    stragglers += group_members(groups, targeted)
+    for proc in alive + stragglers:
         logging.info('Killing {} with signal 9'.format(proc))
-        proc.kill()
+        try:
+            proc.kill()
+        except psutil.NoSuchProcess:
+            pass
+    timings['kill'] = time.monotonic() - start
+
+    logging.info(
+        'Terminated {} processes and {} descendants and group members, '
+        'killed {} survivors and {} late children. terminate '
+        '{terminate:.3f} s, wait {wait:.3f} s, kill {kill:.3f} s'.format(
+            len(kill_list), len(members), len(alive), len(stragglers),
+            **timings))
+    return timings
+
+
+def renice(procs, niceness: int = 19):
+    """
+    Give <procs> the lowest cpu and io priority.
+    """
+    for proc in procs:
+        try:
+            proc.nice(niceness)
+            proc.ionice(psutil.IOPRIO_CLASS_IDLE)
+        except (psutil.NoSuchProcess, psutil.AccessDenied, FileNotFoundError):
+            pass
 
 
 def is_restricted(username: str, pattern: str = '^(?!root).*'):
@@ -124,28 +317,136 @@ def is_restricted(username: str, pattern: str = '^(?!root).*'):
 
 def procs_using_gpu():
     """
-    Return which process IDs are using the GPU, based on the output of the nvidia-smi tool.
+    Return the GPU usage of the processes using a GPU, based on the output of
+    the nvidia-smi tool.
+
+    Returns:
+        dict: pid -> gpu.GpuUsage
     """
-    nvidia_smi = subprocess.run(
-        'nvidia-smi --query-compute-apps=pid --format=csv,noheader',
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE)
-    if nvidia_smi.returncode == 127:  # nvidia_smi not found.
-        return []
-    pids = [int(pid) for pid in nvidia_smi.stdout.decode('ascii').splitlines()]
-    return pids
+    return NvidiaSmiSampler().sample()
+
+
+def collect_users(config: dict, snapshot, gpu_usage,
+                  identity: IdentityCache = None, profile: ScanProfile = None):
+    """
+    Add up the usage in <snapshot> per user.
+    Usernames and restrictions are looked up through <identity>.
+    For efficiency reasons only processes using more than .1 % of the available
+    resources, a GPU or doing io are counted. <gpu_usage> maps pids to their
+    gpu.GpuUsage. What happened to every process is counted in <profile>.
+
+    Returns:
+        usage.Users: username -> usage of the user, see usage.py.
+    """
+    users = Users(len(snapshot))
+    if identity is None:
+        identity = IdentityCache()
+    if profile is None:
+        profile = ScanProfile()
+    counts = profile.counts
+    username_time = 0
+    # uid -> UserUsage, or None for users that are not restricted.
+    by_uid = {}
+    whitelist = config['software_whitelist']
+    owners = users.owners
+    uids = snapshot.uids
+    cpu = snapshot.cpu_percent
+    memory = snapshot.memory_percent
+    # Only filled in when the snapshot was sampled with io.
+    io = len(snapshot.io_read) > 0
+    io_read = snapshot.io_read
+    io_write = snapshot.io_write
+    io_syscalls = snapshot.io_syscalls
+
+    counts['scanned'] += len(snapshot)
+    counts['vanished'] += snapshot.vanished
+    for i in range(len(snapshot)):
+        cpu_percent = cpu[i]
+        memory_percent = memory[i]
+        uid = uids[i]
+        if uid == 0:
+            counts['root'] += 1
+            continue  # do not kill root processes.
+        gpu = gpu_usage.get(snapshot.pids[i]) if gpu_usage else None
+        if memory_percent < .1 and cpu_percent < 1 and gpu is None and (
+                not io or (io_read[i] + io_write[i] < 1
+                           and io_syscalls[i] < 100)):
+            counts['below_threshold'] += 1
+            continue
+        user = by_uid.get(uid, False)
+        if user is None:
+            # Known to be unrestricted, no need to look at the process.
+            counts['unrestricted'] += 1
+            continue
+        try:
+            # Do not count usage by whitelisted software.
+            if snapshot.name(i) in whitelist:
+                counts['whitelisted'] += 1
+                continue
+
+            if user is False:
+                # Check username here, once per uid. It is somewhat expensive.
+                start = time.perf_counter()
+                username = identity.username(uid, partial(snapshot.username, i))
+                user = None
+                if identity.is_restricted(username, config['user_pattern']):
+                    user = users.add(username)
+                by_uid[uid] = user
+                username_time += time.perf_counter() - start
+                if user is None:
+                    counts['unrestricted'] += 1
+                    continue
+
+            user.memory_percent += memory_percent
+            user.cpu_percent += cpu_percent
+            if gpu is not None:
+                user.gpu_walltime += (time.time() - snapshot.create_time(i)) / 60
+                user.gpu_memory += gpu.memory
+                user.gpu_utilization += gpu.utilization
+            if io:
+                user.io_read += io_read[i]
+                user.io_write += io_write[i]
+                user.io_syscalls += io_syscalls[i]
+
+            owners[i] = user.number
+            counts['counted'] += 1
+        except (psutil.NoSuchProcess, FileNotFoundError):
+            counts['vanished'] += 1
+    profile.add_time('usernames', username_time)
+    return users
 
 
 def kill_hogs(config: dict,
               memory_threshold,
               cpu_threshold,
               gpu_max_walltime: float = 1e9,
+              gpu_memory_threshold: float = 0,
+              gpu_util_threshold: float = 0,
+              io_read_threshold: float = 0,
+              io_write_threshold: float = 0,
+              io_syscall_threshold: float = 0,
               dummy: bool = False,
               slack: bool = False,
               email: bool = False,
               request_only: bool = False,
-              interval: float = .3):
+              interval: float = .3,
+              sampler=None,
+              accounting=None,
+              cpu_accountant=None,
+              cpu_window: float = 0,
+              process_table=None,
+              identity: IdentityCache = None,
+              notifier: Notifier = None,
+              history: HistoryStore = None,
+              policy: Policy = None,
+              throttler: Throttler = None,
+              gpu_sampler=None,
+              metrics: Metrics = None,
+              report_processes: int = 10,
+              request_pending=None,
+              memory_accounting=None,
+              process_tree: ProcessTree = None,
+              budget: float = 0):
     """
     Kill all processes of a user using more than <threshold> % of memory. And cpu.
     For efficiency reasons only processes using more than .1 % of the available
@@ -154,98 +455,345 @@ def kill_hogs(config: dict,
     Args:
         memory_threshold (float): Percentage of user resources above which to kill.
         cpu_threshold (float): Percentage of user resources above which to kill.
+        gpu_max_walltime (float): Minutes a user can use a gpu.
+        gpu_memory_threshold (float): MiB of gpu memory a user can use, 0 for
+            no limit.
+        gpu_util_threshold (float): Percentage of gpu SMs a user can use, 0
+            for no limit.
+        io_read_threshold (float): MiB/s a user can read from storage, 0 for
+            no limit.
+        io_write_threshold (float): MiB/s a user can write to storage, 0 for
+            no limit.
+        io_syscall_threshold (float): read and write syscalls per second a
+            user can do, 0 for no limit.
         dummy (bool): If true, do not actually kill processes.
         slack (bool): send messages to slack.
+        sampler: where to get process usage from, see samplers.py.
+            Defaults to psutil.
+        accounting: a cgroups.UserSliceAccounting. If given, only the
+            processes of users whose slice is over a threshold are sampled.
+        cpu_accountant: an accounting.CpuAccountant. If given, cpu usage is
+            computed from the cpu time used since the previous scan and there
+            is no waiting for <interval>.
+        cpu_window (float): without a policy in <config>, compare the
+            moving average over this many seconds to <cpu_threshold>, like a
+            policy rule with minutes. 0 uses the usage of the scan.
+        process_table: a proc_events.ProcessTable. If given, only the
+            processes in it are sampled instead of all processes.
+        identity: an identity.IdentityCache to keep usernames and email
+            addresses in between scans.
+        notifier: a notify.Notifier. Notifications are queued on it and
+            delivered after all processes have been dealt with.
+        history: a history.HistoryStore to append the usage per user to.
+        policy: a policy.Policy that decides what to do with users over a
+            threshold and keeps its state between scans. By default users
+            over a threshold are killed right away. A fleet.FleetAgent lets
+            a controller decide on the usage summed over all nodes.
+        throttler: a throttle.Throttler for the pause and throttle actions.
+            Without one, these actions renice.
+        gpu_sampler: where to get gpu usage from, see gpu.py. Defaults to
+            nvidia-smi. The gpus are only asked when a rule needs them.
+        metrics: a metrics.Metrics to update with the users and actions of
+            this scan.
+        report_processes (int): list this many of the heaviest processes of
+            a user in reports, and how many more there are.
+        request_pending (callable): with <request_only>, returns whether a
+            scan was requested. Defaults to looking for the flagfile.
+        memory_accounting: a memory.SharedMemoryAccounting. If given, the
+            memory usage of users whose RSS total is over the lowest memory
+            threshold is replaced by their PSS or USS.
+        process_tree: a proctree.ProcessTree. If given, what is done about
+            a user is done to the whole trees of the processes of the user,
+            idle parents included, and the usage per tree is reported.
+        budget (float): seconds the scan can take, 0 for no limit. The
+            processes are sampled and the users dealt with in priority
+            order, and what did not fit is skipped, see budget.py.
+
+    Returns:
+        ScanProfile: time spent per phase and what happened to the processes,
+            or None if no scan was done.
     """
-    if request_only and not check_and_remove():
+    if request_pending is None:
+        request_pending = check_and_remove
+    if request_only and not request_pending():
         logging.debug("Not enforcing since no flagfile is present.")
         return None
     else:
         logging.debug("enforcing...")
 
-    users = defaultdict(lambda: {'cpu_percent': 0, 'memory_percent': 0, 'processes': [], 'gpu_walltime': 0})
+    profile = ScanProfile()
+    start = time.perf_counter()
+    if sampler is None:
+        sampler = PsutilSampler()
+    if policy is None:
+        policy = Policy()
+    policy.configure(config, memory_threshold, cpu_threshold, gpu_max_walltime,
+                     gpu_memory_threshold, gpu_util_threshold,
+                     io_read_threshold, io_write_threshold,
+                     io_syscall_threshold, cpu_minutes=cpu_window / 60)
+    # The io counters are read in the same pass, but only when a rule needs
+    # them.
+    io = policy.uses_io()
+    if throttler is not None:
+        throttler.configure(config)
+    limit = scan_budget.ScanBudget(budget) if budget > 0 else None
+    # Pids that were ranked but not sampled because time ran out.
+    unvisited = []
 
-    procs = list(psutil.process_iter())
+    def deadline(share):
+        return None if limit is None else limit.deadline(share)
 
-    for proc in procs:
-        try:
-            proc.cpu_percent()
-        except (psutil.NoSuchProcess, FileNotFoundError):
-            pass
+    def rank(pids):
+        if limit is None:
+            return pids
+        with profile.phase('rank'):
+            return sampler.rank(pids, deadline=deadline(scan_budget.RANK))
 
-    gpu_pids = procs_using_gpu()
+    def prime(pids):
+        with profile.phase('prime'):
+            skipped = sampler.prime(pids, io=io,
+                                    deadline=deadline(scan_budget.PRIME))
+        if limit is not None:
+            unvisited.extend(skipped)
 
-    time.sleep(interval)
-    for proc in procs:
-        try:
-            # First call of cpu_percent() without blocking interval is meaningless.
-            # see https://psutil.readthedocs.io/en/latest/
-            proc.cached_cpu_percent = proc.cpu_percent()
-            proc.cached_memory_percent = proc.memory_percent()
+    def sleep():
+        with profile.phase('sleep'):
+            time.sleep(interval if limit is None
+                       else min(interval, limit.remaining()))
 
-            if proc.uids().real == 0 or (proc.cached_memory_percent < .1
-                                         and proc.cached_cpu_percent < 1):
-                continue  # do not kill root processes.
+    def sample_gpu():
+        if not policy.uses_gpu():
+            return {}
+        with profile.phase('gpu'):
+            if gpu_sampler is None:
+                return procs_using_gpu()
+            return gpu_sampler.sample()
 
-            # Do not count usage by whitelisted software.
-            if proc.name() in config['software_whitelist']:
-                continue
+    # None means all processes.
+    pids = None
+    if accounting is None:
+        if process_table is not None:
+            pids = process_table.pids()
+        # What update_from_scan() needs, the table may be stale.
+        requested = pids
+        pids = rank(pids)
+        if cpu_accountant is None:
+            prime(pids)
+            gpu_usage = sample_gpu()
+            sleep()
+        else:
+            gpu_usage = sample_gpu()
+    else:
+        # Find the users over a threshold from their slices and only sample
+        # their processes. That takes a second interval, but only when
+        # someone is over a threshold.
+        with profile.phase('cgroup'):
+            accounting.prime(io=io)
+        gpu_usage = sample_gpu()
+        with profile.phase('sleep'):
+            time.sleep(interval)
+        with profile.phase('cgroup'):
+            thresholds = {
+                'memory_percent': policy.lowest_threshold(
+                    'memory_percent', memory_threshold),
+                'cpu_percent': policy.lowest_threshold(
+                    'cpu_percent', cpu_threshold),
+            }
+            if io:
+                for metric in IO_METRICS:
+                    thresholds[metric] = policy.lowest_threshold(metric, None)
+            pids = accounting.pids(accounting.over(thresholds))
+        if gpu_usage:
+            pids.extend(gpu_usage)
+        if not pids:
+            profile.add_time('total', time.perf_counter() - start)
+            if metrics is not None:
+                metrics.update_users({})
+                metrics.scan_done(profile)
+            return profile
+        pids = rank(pids)
+        if cpu_accountant is None:
+            prime(pids)
+            sleep()
 
-            # Check username here. It is somewhat expensive.
-            username = proc.username()
-            if not is_restricted(username, config['user_pattern']):
-                continue
+    with profile.phase('sample'):
+        snapshot = sampler.sample(pids, io=io, tree=process_tree is not None,
+                                  deadline=deadline(scan_budget.SAMPLE))
+        unvisited.extend(snapshot.skipped)
+        if process_table is not None and accounting is None:
+            process_table.update_from_scan(requested, snapshot.pids,
+                                           unvisited)
+        if cpu_accountant is not None:
+            cpu_accountant.update_processes(snapshot)
+    if process_tree is not None:
+        with profile.phase('tree'):
+            process_tree.update(snapshot)
+    if identity is None:
+        identity = IdentityCache()
+    with profile.phase('aggregate'):
+        users = collect_users(config, snapshot, gpu_usage, identity, profile)
+        if cpu_accountant is not None:
+            cpu_accountant.save()
+    if memory_accounting is not None:
+        with profile.phase(memory_accounting.kind):
+            profile.count(memory_accounting.kind, memory_accounting.refine(
+                users, snapshot,
+                policy.lowest_threshold('memory_percent', memory_threshold)))
+    if history is not None:
+        with profile.phase('history'):
+            history.record(time.time(), users, snapshot)
+    if metrics is not None:
+        metrics.update_users(users)
+    if notifier is None:
+        notifier = Notifier(send_message_to_terminals, post_to_slack,
+                            mail_port=config.get('mail_server_port', 25))
 
-            users[username]['memory_percent'] += proc.cached_memory_percent
-            users[username]['cpu_percent'] += proc.cached_cpu_percent
-            if gpu_max_walltime > 0 and proc.pid in gpu_pids:
-                users[username]['gpu_walltime'] += (time.time() - proc.create_time()) / 60
+    with profile.phase('policy'):
+        now = time.time()
+        decisions = policy.evaluate(users, now)
+        policy.save()
+        if throttler is not None:
+            for username in throttler.update(users, now):
+                logging.info('Lifted the limits of {}.'.format(username))
 
-            users[username]['processes'].append(proc)
-        except (psutil.NoSuchProcess, FileNotFoundError):
-            pass
+    kill_list = []
+    report_start = time.perf_counter()
+    users.materialize(decisions)
+    decided = list(decisions.items())
+    if limit is not None:
+        limit.skip(len(unvisited))
 
-    for username, data in users.items():
-        if (data['memory_percent'] > memory_threshold
-                or data['cpu_percent'] > cpu_threshold
-                or data['gpu_walltime'] > gpu_max_walltime):
-            # This process exceeds one or more limits and should be killed.
-            message = [
-                'User {} uses \n {:.2f} % of cpu. '.format(
-                    username, data['cpu_percent']),
-                '{:.2f} % of memory. '.format(data['memory_percent']),
-                '{:.0f} minutes of GPU time'.format(data['gpu_walltime']),
-                'The following processes will be killed:'
-            ]
-            for proc in data['processes']:
+        def priority(item):
+            username, (action, _) = item
+            data = users.get(username)
+            if data is None:
+                return (True, 0, 0)
+            return (action != 'kill', -data['memory_percent'],
+                    -data['cpu_percent'])
+        # Kills first, as they free the most, then the heaviest users.
+        decided.sort(key=priority)
+    for username, (action, violated) in decided:
+        data = users.get(username)
+        if data is None:
+            # Only over a moving average, nothing running right now.
+            continue
+        if limit is not None and limit.expired():
+            limit.skip_user(username)
+            continue
+        profile.count('offenders')
+        # This user exceeds one or more limits.
+        message = [
+            'User {} uses \n {:.2f} % of cpu. '.format(
+                username, data['cpu_percent']),
+            '{:.2f} % of memory. '.format(data['memory_percent']),
+            '{:.0f} minutes of GPU time, {:.0f} MiB of GPU memory, '
+            '{:.0f} % of GPU SMs.'.format(data['gpu_walltime'], data['gpu_memory'],
+                                         data['gpu_utilization']),
+        ]
+        if io:
+            message.append(
+                '{:.1f} MiB/s read, {:.1f} MiB/s written, {:.0f} io syscalls '
+                'per second.'.format(data['io_read'], data['io_write'],
+                                     data['io_syscalls']))
+        message += [
+            'Over: {}'.format(', '.join(rule.describe() for rule in violated)),
+            HEADINGS[action]
+        ]
+        shown = top_processes(data['processes'], snapshot, report_processes)
+        for i in shown:
+            try:
+                message.append(
+                    '{} pid {} {} memory {:.2f}% cpu {:.2f}%'.format(
+                        username, snapshot.pids[i], snapshot.name(i),
+                        snapshot.memory_percent[i],
+                        snapshot.cpu_percent[i]))
+            except (psutil.NoSuchProcess, FileNotFoundError):
+                pass
+        if len(data['processes']) > len(shown):
+            message.append('{} and {} more processes'.format(
+                username, len(data['processes']) - len(shown)))
+        targets = data['processes']
+        if process_tree is not None:
+            for root, (count, cpu, memory) in sorted(process_tree.rollup(
+                    targets).items()):
                 try:
-                    message.append(
-                        '{} pid {} {} memory {:.2f}% cpu {:.2f}%'.format(
-                            proc.username(), proc.pid, proc.name(),
-                            proc.cached_memory_percent,
-                            proc.cached_cpu_percent))
+                    name = snapshot.name(process_tree.index[root])
                 except (psutil.NoSuchProcess, FileNotFoundError):
-                    pass
-            logging.info('\n'.join(message))
+                    name = '?'
+                message.append(
+                    '{} tree of pid {} {}: {} processes memory {:.2f}% '
+                    'cpu {:.2f}%'.format(username, root, name, count, memory,
+                                         cpu))
+            targets = process_tree.expand(targets)
+        logging.info('\n'.join(message))
 
-            if not dummy:
-                send_message_to_terminals(proc.username(),
-                                          config['terminal_warning'])
-                if slack:
-                    post_to_slack('\n'.join(message), config['slack_url'])
+        if dummy:
+            continue
+        # Only what is carried out is counted.
+        profile.count(action)
+        if metrics is not None:
+            metrics.action(username, action, violated)
+        if slack:
+            notifier.slack('\n'.join(message), config['slack_url'])
+        if action == 'warn':
+            notifier.terminal(username, policy.warning)
+            continue
+        if action == 'renice':
+            renice(snapshot.processes(targets))
+            notifier.terminal(username, policy.warning)
+            continue
+        if action in ('pause', 'throttle'):
+            procs = snapshot.processes(targets)
+            uid = snapshot.uids[data['processes'][0]]
+            if throttler is None or not throttler.apply(
+                    action, username, uid, procs, now):
+                logging.warning('Unable to {} {}, renicing instead.'.format(
+                    action, username))
+                renice(procs)
+            notifier.terminal(username, policy.warning)
+            continue
 
-                if email:
-                    email_address = find_email(proc.username())
-                    if email_address is not None:
-                        if request_only:
-                            email_message = config['mail_body_request_only']
-                        else:
-                            email_message = config['mail_body']
-                        email_message += '\n'.join(message)
-                        send_mail(config['from_address'], email_address,
-                                  email_message, config['mail_server_port'])
+        kill_list.extend(snapshot.processes(targets))
+        notifier.terminal(username, config['terminal_warning'])
+        if email:
+            email_address = identity.email(username, find_email)
+            if email_address is not None:
+                if request_only:
+                    email_message = config['mail_body_request_only']
+                else:
+                    email_message = config['mail_body']
+                email_message += '\n'.join(message)
+                notifier.mail(config['from_address'], email_address,
+                              email_message)
+    profile.add_time('report', time.perf_counter() - report_start)
 
-                terminate(data['processes'])
+    # Kill first, notifications can wait.
+    if kill_list:
+        profile.count('killed', len(kill_list))
+        with profile.phase('terminate'):
+            if limit is None:
+                stages = terminate(kill_list, process_tree=process_tree)
+            else:
+                stages = terminate(kill_list, timeout=limit.remaining(),
+                                   process_tree=process_tree)
+        for stage, seconds in (stages or {}).items():
+            profile.add_time('terminate.' + stage, seconds)
+    with profile.phase('notify'):
+        notifier.flush()
+    identity.save()
+    if throttler is not None:
+        throttler.save()
+    if limit is not None:
+        profile.count('skipped', limit.skipped)
+        profile.count('skipped_users', len(limit.skipped_users))
+        skipped = limit.report()
+        if skipped is not None:
+            logging.warning(skipped)
+    logging.debug('Identity cache: {}'.format(identity.stats()))
+    profile.add_time('total', time.perf_counter() - start)
+    if metrics is not None:
+        metrics.scan_done(profile)
+    return profile
 
 
 def find_email(username):
@@ -280,12 +828,7 @@ def send_mail(sender: str, receiver: str, message: str, port: int = 25):
     Send a message to a user whose processes have been killed.
     """
 
-    message = f"""From: "(Kill Hogs)" <{sender}>
-To: <{receiver}>
-Subject: Processes killed.
-
-{message}
-    """
+    message = mail_text(sender, receiver, message)
 
     try:
         smtpObj = smtplib.SMTP('localhost', port=port)
@@ -296,6 +839,42 @@ Subject: Processes killed.
             "Error: unable to send email.\nThe error was:\n{}".format(e))
 
 
+def load_config(config_file: str):
+    """
+    Read the yaml config file.
+
+    Args:
+        config_file (str): path of the config file.
+
+    Returns:
+        dict: the config.
+    """
+    with open(config_file, 'r') as f:
+        return yaml.load(f.read(), Loader=yaml.BaseLoader)
+
+
+def make_scheduler(args, thresholds: dict):
+    """
+    Returns:
+        AdaptiveScheduler: for the --adaptive options in <args>, or None
+            when there is no pressure information.
+    """
+    monitor = PressureMonitor(args.pressure_root, thresholds)
+    if not monitor.available():
+        logging.warning('No pressure information in {}, scanning every '
+                        '--period.'.format(args.pressure_root))
+        return None
+    triggers = []
+    for spec in args.pressure_trigger or DEFAULT_TRIGGERS:
+        try:
+            triggers.append(PressureTrigger(spec, args.pressure_root))
+        except (OSError, ValueError) as e:
+            logging.warning('Unable to set pressure trigger {}: {}'.format(
+                spec, e))
+    return AdaptiveScheduler(monitor, args.period, args.fast_period,
+                             args.max_idle, triggers)
+
+
 def main():
     logging.basicConfig(level=logging.INFO)
     parser = argparse.ArgumentParser()
@@ -304,6 +883,24 @@ def main():
         type=float,
         default=0,
         help="maximum wall time limit in minutes for using a gpu")
+    parser.add_argument(
+        "--gpu_memory_threshold",
+        type=float,
+        default=0,
+        help="MiB of gpu memory per user above which processes are killed, "
+        "0 for no limit")
+    parser.add_argument(
+        "--gpu_util_threshold",
+        type=float,
+        default=0,
+        help="gpu utilisation percentage per user above which processes are "
+        "killed, 0 for no limit. Needs nvml.")
+    parser.add_argument(
+        "--gpu_sampler",
+        choices=['auto'] + sorted(GPU_SAMPLERS),
+        default='auto',
+        help="How to collect gpu usage. auto uses nvml when pynvml is "
+        "installed and nvidia-smi otherwise.")
     parser.add_argument(
         "--memory_threshold",
         type=float,
@@ -314,6 +911,24 @@ def main():
         type=float,
         default=600,
         help="cpu percentage above which processes are killed")
+    parser.add_argument(
+        "--io_read_threshold",
+        type=float,
+        default=0,
+        help="MiB/s per user read from storage above which processes are "
+        "killed, 0 for no limit")
+    parser.add_argument(
+        "--io_write_threshold",
+        type=float,
+        default=0,
+        help="MiB/s per user written to storage above which processes are "
+        "killed, 0 for no limit")
+    parser.add_argument(
+        "--io_syscall_threshold",
+        type=float,
+        default=0,
+        help="read and write syscalls per second per user above which "
+        "processes are killed, 0 for no limit")
     parser.add_argument(
         "--cpu_interval",
         type=float,
@@ -331,6 +946,17 @@ def main():
         "--request_only",
         action='store_true',
         help="Only kill processes when a user has requested this.")
+    parser.add_argument(
+        "--request_socket",
+        type=str,
+        default=request_channel.REQUEST_SOCKET,
+        help="In daemon mode, listen for request-enforcement on this unix "
+        "socket. Empty to only use the flagfile.")
+    parser.add_argument(
+        "--request_interval",
+        type=float,
+        default=60,
+        help="Seconds a user has to wait between two requests.")
     parser.add_argument(
         "--slack", action='store_true', help="Post messages to slack")
     parser.add_argument(
@@ -338,21 +964,332 @@ def main():
         type=str,
         default='{}/.kill_hogs/kill_hogs.yml'.format(os.environ['HOME']),
         help="Config file, default: ~/.kill_hogs/kill_hogs.yml")
+    parser.add_argument(
+        "--daemon",
+        action='store_true',
+        help="Keep running and scan every --period seconds.")
+    parser.add_argument(
+        "--period",
+        type=float,
+        default=5,
+        help="Seconds between scans in daemon mode.")
+    parser.add_argument(
+        "--adaptive",
+        action='store_true',
+        help="In daemon mode, only check the pressure in /proc/pressure every "
+        "--period and do a full scan when it is high, when a pressure "
+        "trigger fires or every --max_idle seconds.")
+    parser.add_argument(
+        "--pressure_thresholds",
+        type=str,
+        default='cpu=40,memory=10,io=40',
+        help="avg10 pressure in %% above which the node is under pressure, "
+        "e.g. cpu=40,memory.full=5. Without .full, some is meant.")
+    parser.add_argument(
+        "--pressure_trigger",
+        action='append',
+        default=None,
+        help="resource.some or .full=stall/window in microseconds, wakes the "
+        "daemon when tasks stall that long. Can be given more than once, "
+        "default: {}".format(' '.join(DEFAULT_TRIGGERS)))
+    parser.add_argument(
+        "--pressure_root",
+        type=str,
+        default='/proc/pressure',
+        help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--fast_period",
+        type=float,
+        default=1,
+        help="With --adaptive, seconds between scans under pressure.")
+    parser.add_argument(
+        "--max_idle",
+        type=float,
+        default=60,
+        help="With --adaptive, seconds between scans without pressure.")
+    parser.add_argument(
+        "--sampler",
+        choices=sorted(SAMPLERS),
+        default='psutil',
+        help="How to collect process usage. proc reads /proc directly and "
+        "falls back to psutil when that is not possible.")
+    parser.add_argument(
+        "--accounting",
+        choices=['processes', 'cgroup'],
+        default='processes',
+        help="cgroup: find users over a threshold from their systemd user "
+        "slice (cgroup v2) and only look at the processes of those users.")
+    parser.add_argument(
+        "--cgroup_root",
+        type=str,
+        default='/sys/fs/cgroup',
+        help="Where cgroup v2 is mounted.")
+    parser.add_argument(
+        "--memory_accounting",
+        choices=MEMORY_ACCOUNTING,
+        default='rss',
+        help="rss: count every page a process maps. pss: share shared pages "
+        "out over the processes mapping them, uss: only count private pages. "
+        "pss and uss are only read for users whose rss is over "
+        "--memory_threshold.")
+    parser.add_argument(
+        "--cpu_accounting",
+        choices=['interval', 'incremental'],
+        default='interval',
+        help="interval: measure cpu usage over --cpu_interval. "
+        "incremental: use the cpu time used since the previous scan.")
+    parser.add_argument(
+        "--cpu_window",
+        type=float,
+        default=0,
+        help="Compare the moving average of the cpu usage of a user over "
+        "this many seconds to --cpu_threshold, like a policy rule with "
+        "minutes. 0 uses the usage of the scan. Not used with a policy.")
+    parser.add_argument(
+        "--state_file",
+        type=str,
+        default='{}/.kill_hogs/cpu_state.json'.format(os.environ['HOME']),
+        help="Where incremental cpu accounting keeps its state between "
+        "runs. Not used in daemon mode.")
+    parser.add_argument(
+        "--proc_events",
+        action='store_true',
+        help="In daemon mode, keep track of processes with the netlink proc "
+        "connector instead of listing all processes every scan.")
+    parser.add_argument(
+        "--identity_cache",
+        type=str,
+        default=None,
+        help="json file to keep usernames and email addresses in between "
+        "runs. Not needed in daemon mode.")
+    parser.add_argument(
+        "--identity_ttl",
+        type=float,
+        default=3600,
+        help="Seconds to remember usernames and email addresses.")
+    parser.add_argument(
+        "--profile",
+        action='store_true',
+        help="Write the time spent per phase of every scan as a json line.")
+    parser.add_argument(
+        "--profile_file",
+        type=str,
+        default='-',
+        help="Where to append --profile output, default: stdout.")
+    parser.add_argument(
+        "--policy_state_file",
+        type=str,
+        default='{}/.kill_hogs/policy_state.json'.format(os.environ['HOME']),
+        help="Where the policy keeps strikes and averages per user between "
+        "runs. Not used in daemon mode.")
+    parser.add_argument(
+        "--throttle_state_file",
+        type=str,
+        default='{}/.kill_hogs/throttle_state.json'.format(os.environ['HOME']),
+        help="Where the users whose cgroups are limited are kept between "
+        "runs, so the limits can be lifted. Not used in daemon mode.")
+    parser.add_argument(
+        "--pause_state_file",
+        type=str,
+        default='{}/.kill_hogs/pause_state.json'.format(os.environ['HOME']),
+        help="Where the daemon keeps the processes it pauses, so the next "
+        "start continues them should it die while they are stopped.")
+    parser.add_argument(
+        "--history_file",
+        type=str,
+        default=None,
+        help="Ring file to keep the usage per user of every scan in. "
+        "Query it with kill-hogs-history.")
+    parser.add_argument(
+        "--history_size",
+        type=int,
+        default=100000,
+        help="Number of records in a new --history_file.")
+    parser.add_argument(
+        "--history_top_processes",
+        type=int,
+        default=5,
+        help="Also keep this many of the processes using the most cpu "
+        "every scan.")
+    parser.add_argument(
+        "--controller",
+        type=str,
+        default=None,
+        help="unix:/path or host:port of a kill-hogs-controller that decides "
+        "on the usage summed over all nodes. The thresholds given here are "
+        "used when it can not be reached.")
+    parser.add_argument(
+        "--node",
+        type=str,
+        default=None,
+        help="Name of this node for the controller, default: the hostname.")
+    parser.add_argument(
+        "--metrics_listen",
+        type=str,
+        default=None,
+        help="host:port to serve prometheus metrics on in daemon mode, "
+        "e.g. 127.0.0.1:9310.")
+    parser.add_argument(
+        "--metrics_textfile",
+        type=str,
+        default=None,
+        help="Write prometheus metrics to this file after every scan, for "
+        "the textfile collector of the node exporter.")
+    parser.add_argument(
+        "--metrics_top",
+        type=int,
+        default=20,
+        help="Number of users with usage metrics.")
+    parser.add_argument(
+        "--kill_scope",
+        choices=['processes', 'tree'],
+        default='processes',
+        help="processes: only deal with the processes of a user that use "
+        "something. tree: also with the idle processes in their trees, such "
+        "as the shell loop or launcher that would start them again.")
+    parser.add_argument(
+        "--report_processes",
+        type=int,
+        default=10,
+        help="Number of processes of a user listed in reports, the heaviest "
+        "first.")
+    parser.add_argument(
+        "--scan_budget",
+        type=float,
+        default=0,
+        help="Seconds a scan can take, 0 for no limit. The heaviest processes "
+        "are sampled and dealt with first and the rest is skipped when the "
+        "time is up. Also locks the memory of kill hogs and raises its "
+        "priority, so it keeps working on a thrashing node.")
     args = parser.parse_args()
+    if args.metrics_listen and not args.daemon:
+        parser.error('--metrics_listen needs --daemon')
+    if args.adaptive and not args.daemon:
+        parser.error('--adaptive needs --daemon')
+    try:
+        pressure_thresholds = parse_thresholds(args.pressure_thresholds)
+    except ValueError as e:
+        parser.error(str(e))
 
-    with open(args.config_file, 'r') as f:
-        config = yaml.load(f.read(), Loader=yaml.BaseLoader)
+    if args.scan_budget > 0:
+        scan_budget.harden()
 
-    kill_hogs(
-        config=config,
+    process_table = None
+    if args.daemon and args.proc_events:
+        process_table = ProcessTable()
+        if start_listener(process_table) is None:
+            process_table = None
+
+    cpu_accountant = None
+    if args.cpu_accounting == 'incremental':
+        cpu_accountant = CpuAccountant(
+            None if args.daemon else args.state_file)
+
+    history = None
+    if args.history_file is not None:
+        history = HistoryStore(args.history_file, args.history_size,
+                               args.history_top_processes)
+
+    throttler = Throttler(
+        args.cgroup_root, None if args.daemon else args.throttle_state_file)
+    if args.daemon:
+        throttler.start_cycler(state_file=args.pause_state_file)
+
+    channel = None
+    if args.daemon and args.request_socket:
+        channel = request_channel.RequestChannel(
+            args.request_socket, args.request_interval)
+
+    def request_pending():
+        # The flagfile only works while the socket is not available.
+        return request_channel.scan_requested(channel, flagfile)
+
+    metrics = None
+    if args.metrics_listen or args.metrics_textfile:
+        metrics = Metrics(args.metrics_top)
+        if args.metrics_textfile and not args.daemon:
+            metrics.load_textfile(args.metrics_textfile)
+        if args.metrics_listen:
+            serve(metrics, args.metrics_listen)
+
+    policy = Policy(None if args.daemon else args.policy_state_file)
+    if args.controller is not None:
+        policy = FleetAgent(args.controller, args.node, fallback=policy)
+
+    scan_once = partial(
+        kill_hogs,
         gpu_max_walltime=args.gpu_max_walltime,
+        gpu_memory_threshold=args.gpu_memory_threshold,
+        gpu_util_threshold=args.gpu_util_threshold,
+        gpu_sampler=get_gpu_sampler(args.gpu_sampler),
+        io_read_threshold=args.io_read_threshold,
+        io_write_threshold=args.io_write_threshold,
+        io_syscall_threshold=args.io_syscall_threshold,
         memory_threshold=args.memory_threshold,
         cpu_threshold=args.cpu_threshold,
         interval=args.cpu_interval,
         dummy=args.dummy,
         slack=args.slack,
         email=args.email,
-        request_only=args.request_only)
+        request_only=args.request_only,
+        sampler=get_sampler(args.sampler),
+        accounting=get_accounting(args.accounting, args.cgroup_root),
+        cpu_accountant=cpu_accountant,
+        cpu_window=args.cpu_window,
+        process_table=process_table,
+        history=history,
+        policy=policy,
+        throttler=throttler,
+        metrics=metrics,
+        report_processes=args.report_processes,
+        request_pending=request_pending,
+        memory_accounting=get_memory_accounting(args.memory_accounting),
+        # Kept between scans in daemon mode.
+        process_tree=ProcessTree() if args.kill_scope == 'tree' else None,
+        budget=args.scan_budget,
+        identity=IdentityCache(
+            ttl=args.identity_ttl,
+            email_ttl=args.identity_ttl,
+            cache_file=None if args.daemon else args.identity_cache))
+
+    def scan(config):
+        if channel is not None and not args.request_only:
+            # Requests while scanning anyway are served by this scan.
+            channel.take()
+        profile = scan_once(config)
+        if args.profile and profile is not None:
+            write_profile(profile, args.profile_file)
+        if args.metrics_textfile and profile is not None:
+            metrics.write_textfile(args.metrics_textfile)
+
+    if args.daemon:
+        # process_iter() keeps its Process objects between calls, so the
+        # psutil handles survive from one cycle to the next.
+        scheduler = None
+        if args.adaptive:
+            scheduler = make_scheduler(args, pressure_thresholds)
+        daemon = Daemon(
+            scan, partial(load_config, args.config_file), period=args.period,
+            scheduler=scheduler)
+        daemon.install_signal_handlers()
+        if channel is not None:
+            channel.wake = daemon.wake
+            try:
+                channel.start()
+            except OSError as e:
+                logging.warning('Unable to listen on {}, only the flagfile '
+                                'works: {}'.format(args.request_socket, e))
+                channel = None
+        try:
+            daemon.run()
+        finally:
+            if channel is not None:
+                channel.close()
+            throttler.close()
+            if scheduler is not None:
+                scheduler.close()
+    else:
+        scan(load_config(args.config_file))
 
 
 if __name__ == '__main__':
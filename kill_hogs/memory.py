@@ -0,0 +1,128 @@
+"""
+Memory accounting that understands shared pages.
+
+The resident set size (RSS) of a process counts every page it maps, also the
+pages it shares with other processes: shared libraries, shared memory and the
+copy on write pages of a parent. A user with fifty workers forked from one
+big python process is charged for that process fifty times.
+
+The proportional set size (PSS) divides every shared page over the processes
+that map it, and the unique set size (USS) only counts the private pages.
+The kernel sums both up per process in /proc/[pid]/smaps_rollup. Reading it
+walks all mappings of the process, which is much more expensive than the RSS
+in /proc/[pid]/stat, so it is only done for the processes of users whose RSS
+total is already over the lowest memory threshold. PSS and USS are never
+more than RSS, so nobody below the threshold is missed.
+"""
+
+from kill_hogs.samplers import ProcSampler
+import logging
+import os
+
+MEMORY_ACCOUNTING = ['rss', 'pss', 'uss']
+# Lines of smaps_rollup that make up the size for each accounting, in kB.
+FIELDS = {
+    'pss': (b'Pss:', ),
+    'uss': (b'Private_Clean:', b'Private_Dirty:'),
+}
+
+
+def parse_smaps_rollup(data: bytes, fields=FIELDS['pss']):
+    """
+    Returns:
+        int: the sum of <fields> in the contents of /proc/[pid]/smaps_rollup,
+            in bytes.
+    """
+    size = 0
+    found = False
+    for line in data.splitlines():
+        if line.startswith(fields):
+            size += int(line.split()[1])
+            found = True
+    if not found:
+        raise ValueError('{} not found in smaps_rollup'.format(
+            b', '.join(fields).decode()))
+    return size * 1024
+
+
+class SharedMemoryAccounting:
+    """
+    Replaces the RSS based memory usage of the users over a threshold by
+    their PSS or USS.
+
+    Args:
+        kind (str): 'pss' or 'uss'.
+        procfs (str): where proc is mounted.
+    """
+
+    def __init__(self, kind: str = 'pss', procfs: str = '/proc'):
+        if kind not in FIELDS:
+            raise ValueError('Unknown memory accounting {}'.format(kind))
+        self.kind = kind
+        self.fields = FIELDS[kind]
+        self.procfs = procfs
+        self._total = None
+
+    def available(self):
+        return os.path.exists(self.procfs + '/self/smaps_rollup')
+
+    def read(self, pid: int):
+        """
+        Returns:
+            int: the PSS or USS of <pid> in bytes.
+        """
+        with open('{}/{}/smaps_rollup'.format(self.procfs, pid), 'rb') as f:
+            return parse_smaps_rollup(f.read(), self.fields)
+
+    def refine(self, users: dict, snapshot, threshold: float):
+        """
+        Recompute the memory_percent of the users in <users> whose RSS total
+        is over <threshold>, and of their processes in <snapshot>. Processes
+        whose smaps_rollup can not be read keep their RSS.
+
+        Returns:
+            int: the number of processes whose smaps_rollup was read.
+        """
+        candidates = [username for username, data in users.items()
+                      if data['memory_percent'] > threshold]
+        if not candidates:
+            return 0
+        if self._total is None:
+            self._total = ProcSampler(self.procfs).total_memory()
+        factor = 100 / self._total
+        memory = snapshot.memory_percent
+        users.materialize(candidates)
+        read = 0
+        for username in candidates:
+            data = users[username]
+            memory_percent = 0
+            for i in data['processes']:
+                try:
+                    memory[i] = self.read(snapshot.pids[i]) * factor
+                    read += 1
+                except (FileNotFoundError, ProcessLookupError,
+                        PermissionError, ValueError) as e:
+                    logging.debug('Using rss of pid {}: {}'.format(
+                        snapshot.pids[i], e))
+                memory_percent += memory[i]
+            logging.debug('{} uses {:.2f} % of memory by rss, {:.2f} % by '
+                          '{}.'.format(username, data['memory_percent'],
+                                       memory_percent, self.kind))
+            data['memory_percent'] = memory_percent
+        return read
+
+
+def get_memory_accounting(name: str = 'rss', procfs: str = '/proc'):
+    """
+    Returns:
+        SharedMemoryAccounting: for pss or uss, or None for rss or when
+            smaps_rollup is not available (before linux 4.14).
+    """
+    if name == 'rss':
+        return None
+    accounting = SharedMemoryAccounting(name, procfs)
+    if not accounting.available():
+        logging.warning('{}/[pid]/smaps_rollup not available, using '
+                        'rss.'.format(procfs))
+        return None
+    return accounting
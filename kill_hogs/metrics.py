@@ -0,0 +1,318 @@
+"""
+Prometheus metrics about users and scans.
+
+A Metrics object lives as long as kill hogs and is updated by every scan:
+gauges with the usage of the heaviest users, counters of what was done to
+whom and histograms of how long scans take. It is served over http with
+--metrics_listen in daemon mode, or written for the textfile collector of
+the node exporter with --metrics_textfile:
+
+    kill_hogs_user_cpu_percent{user="p123456"} 812.5
+    kill_hogs_actions_total{user="p123456",action="kill",reason="cpu_percent"} 3
+
+Only the top users get gauges, and counters are kept for a limited number
+of users, so the number of series stays bounded however many users a node
+has.
+"""
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import heapq
+import logging
+import os
+import re
+import socketserver
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+BUCKETS = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+# Gauge -> key in the users of collect_users().
+USER_GAUGES = {
+    'kill_hogs_user_cpu_percent': 'cpu_percent',
+    'kill_hogs_user_memory_percent': 'memory_percent',
+    'kill_hogs_user_gpu_memory_mib': 'gpu_memory',
+    'kill_hogs_user_gpu_utilization_percent': 'gpu_utilization',
+    'kill_hogs_user_io_read_mib_per_second': 'io_read',
+    'kill_hogs_user_io_write_mib_per_second': 'io_write',
+}
+
+# What happened to the processes of a scan, see collect_users().
+PROCESS_STATES = ['scanned', 'vanished', 'root', 'below_threshold',
+                  'whitelisted', 'unrestricted', 'counted', 'killed',
+                  'skipped']
+SAMPLE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+OTHER = '_other'
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    http.server.ThreadingHTTPServer, which python 3.6 does not have.
+    """
+    daemon_threads = True
+
+
+def escape(value: str):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def unescape(value: str):
+    return re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1),
+                  value)
+
+
+def format_value(value: float):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value)
+
+
+class Metric:
+    """
+    One metric family with a sample per combination of label values.
+    """
+
+    def __init__(self, name: str, kind: str, help: str, labels=()):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = tuple(labels)
+        # label values -> value
+        self.samples = {}
+        # label values -> 'name{labels} ', formatted once.
+        self._prefixes = {}
+
+    def prefix(self, values, name: str = None, extra: str = ''):
+        key = (values, name, extra)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            pairs = ['{}="{}"'.format(label, escape(value))
+                     for label, value in zip(self.labels, values)]
+            if extra:
+                pairs.append(extra)
+            prefix = '{}{} '.format(
+                name or self.name, '{' + ','.join(pairs) + '}' if pairs else '')
+            self._prefixes[key] = prefix
+        return prefix
+
+    def set(self, value: float, *values):
+        self.samples[values] = value
+
+    def inc(self, amount: float = 1, *values):
+        self.samples[values] = self.samples.get(values, 0) + amount
+
+    def remove(self, *values):
+        self.samples.pop(values, None)
+        for key in [key for key in self._prefixes if key[0] == values]:
+            del self._prefixes[key]
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        for values, value in self.samples.items():
+            lines.append(self.prefix(values) + format_value(value))
+        return lines
+
+
+class Histogram(Metric):
+    def __init__(self, name: str, help: str, labels=(), buckets=BUCKETS):
+        super().__init__(name, 'histogram', help, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value: float, *values):
+        counts, total = self.samples.get(values, ([0] * len(self.buckets), 0))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self.samples[values] = (counts, total + value)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} histogram'.format(self.name)]
+        for values, (counts, total) in self.samples.items():
+            for bound, count in zip(self.buckets, counts):
+                lines.append(self.prefix(
+                    values, self.name + '_bucket',
+                    'le="{}"'.format(format_value(float(bound))))
+                    + str(count))
+            lines.append(self.prefix(values, self.name + '_sum')
+                         + format_value(total))
+            lines.append(self.prefix(values, self.name + '_count')
+                         + str(counts[-1]))
+        return lines
+
+
+class Metrics:
+    """
+    Args:
+        top (int): number of users with gauges, per usage gauge.
+        max_users (int): number of users with their own counters. Actions on
+            other users are counted as user _other.
+    """
+
+    def __init__(self, top: int = 20, max_users: int = 200):
+        self.top = top
+        self.max_users = max_users
+        self.user_gauges = {
+            name: Metric(name, 'gauge', 'Usage of the top {} users by this '
+                         'metric in the last scan.'.format(top), ['user'])
+            for name in USER_GAUGES
+        }
+        self.users = Metric('kill_hogs_users', 'gauge',
+                            'Users with processes counted in the last scan.')
+        self.processes = Metric(
+            'kill_hogs_scan_processes', 'gauge',
+            'Processes per state in the last scan.', ['state'])
+        self.actions = Metric(
+            'kill_hogs_actions_total', 'counter',
+            'Actions taken per user, action and violated metric.',
+            ['user', 'action', 'reason'])
+        self.scans = Metric('kill_hogs_scans_total', 'counter', 'Scans done.')
+        self.last_scan = Metric('kill_hogs_last_scan_timestamp_seconds', 'gauge',
+                                'When the last scan started.')
+        self.duration = Histogram('kill_hogs_scan_duration_seconds',
+                                  'Time a scan takes.')
+        self.phases = Histogram('kill_hogs_scan_phase_seconds',
+                                'Time a scan spends per phase.', ['phase'])
+        self.families = (list(self.user_gauges.values())
+                         + [self.users, self.processes, self.actions,
+                            self.scans, self.last_scan, self.duration,
+                            self.phases])
+        # Users with their own counters.
+        self._counted_users = set()
+        self._lock = threading.Lock()
+
+    def update_users(self, users: dict):
+        """
+        Set the gauges of the users that are in the top for any of them
+        and drop those of users that fell out of it.
+        """
+        with self._lock:
+            self.users.set(len(users))
+            for name, key in USER_GAUGES.items():
+                gauge = self.user_gauges[name]
+                top = heapq.nlargest(self.top, users.items(),
+                                     key=lambda item: item[1].get(key, 0))
+                shown = set()
+                for username, data in top:
+                    if data.get(key, 0) > 0:
+                        gauge.set(data[key], username)
+                        shown.add(username)
+                for username in list(gauge.samples):
+                    if username[0] not in shown:
+                        gauge.remove(*username)
+
+    def action(self, username: str, action: str, violated):
+        """
+        Count <action> on <username> for every rule in <violated>.
+        """
+        with self._lock:
+            if username not in self._counted_users:
+                if len(self._counted_users) < self.max_users:
+                    self._counted_users.add(username)
+                else:
+                    username = OTHER
+            for rule in violated or [None]:
+                reason = getattr(rule, 'metric', 'unknown')
+                self.actions.inc(1, username, action, reason)
+
+    def scan_done(self, profile):
+        """
+        Take the counts and timings of a finished scan.ScanProfile.
+        """
+        with self._lock:
+            self.scans.inc()
+            self.last_scan.set(profile.started)
+            for state in PROCESS_STATES:
+                self.processes.set(profile.counts.get(state, 0), state)
+            timings = dict(profile.timings)
+            total = timings.pop('total', None)
+            if total is not None:
+                self.duration.observe(total)
+            for phase, seconds in timings.items():
+                self.phases.observe(seconds, phase)
+
+    def render(self):
+        """
+        Returns:
+            str: all metrics in the prometheus text format.
+        """
+        with self._lock:
+            lines = []
+            for family in self.families:
+                lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path: str):
+        """
+        Replace <path> with the metrics, so the node exporter never reads
+        half a file.
+        """
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                f.write(self.render())
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning('Unable to write metrics to {}: {}'.format(path, e))
+
+    def load_textfile(self, path: str):
+        """
+        Continue the counters of a previous run from its textfile, for when
+        kill hogs runs from cron.
+        """
+        counters = {family.name: family for family in self.families
+                    if family.kind == 'counter'}
+        try:
+            with open(path, 'r') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        with self._lock:
+            for line in lines:
+                match = SAMPLE.match(line)
+                if match is None or match.group(1) not in counters:
+                    continue
+                counter = counters[match.group(1)]
+                labels = dict((name, unescape(value)) for name, value in
+                              LABEL.findall(match.group(2) or ''))
+                try:
+                    values = tuple(labels[name] for name in counter.labels)
+                    counter.set(float(match.group(3)), *values)
+                except (KeyError, ValueError):
+                    continue
+                if counter is self.actions and values[0] != OTHER:
+                    self._counted_users.add(values[0])
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('metrics: ' + format % args)
+
+
+def serve(metrics: Metrics, address: str = '127.0.0.1:9310'):
+    """
+    Serve <metrics> over http on host:port <address> from a thread.
+
+    Returns:
+        ThreadingHTTPServer: call shutdown() on it to stop.
+    """
+    host, port = address.rsplit(':', 1)
+    server = ThreadingHTTPServer((host, int(port)), Handler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    thread = threading.Thread(target=server.serve_forever, daemon=True,
+                              name='kill-hogs-metrics')
+    thread.start()
+    return server
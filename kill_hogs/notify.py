@@ -0,0 +1,182 @@
+"""
+Deliver notifications after the kill instead of before it.
+
+During a scan, terminal messages, slack posts and emails are queued on a
+Notifier. flush() delivers them concurrently once the processes have been
+dealt with, so a slow slack webhook or mail server does not delay the kill.
+All slack posts of a batch share one HTTP session and all mails one SMTP
+connection. Failed deliveries are retried a bounded number of times.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import requests
+import smtplib
+import time
+
+
+def mail_text(sender: str, receiver: str, message: str):
+    return f"""From: "(Kill Hogs)" <{sender}>
+To: <{receiver}>
+Subject: Processes killed.
+
+{message}
+    """
+
+
+def retry(func, retries: int, delay: float = .5):
+    """
+    Call <func> until it does not raise, at most <retries> + 1 times.
+    Waits <delay> seconds after the first failure, doubling every time.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(delay * 2 ** attempt)
+
+
+class Notifier:
+    """
+    Args:
+        write_terminals (callable): called with (user, message), and with
+            terminals= the ones that failed when retrying. Returns the
+            terminals that failed, like kill_hogs.send_message_to_terminals.
+        post (callable): called with (message, url, session=, timeout=),
+            like kill_hogs.post_to_slack.
+        mail_host (str): smtp server.
+        mail_port (int): smtp port.
+        retries (int): extra attempts per delivery.
+        timeout (float): seconds before a slack post or smtp command fails.
+        workers (int): deliveries running at the same time.
+    """
+
+    def __init__(self, write_terminals=None, post=None,
+                 mail_host: str = 'localhost', mail_port: int = 25,
+                 retries: int = 2, timeout: float = 10, workers: int = 4,
+                 retry_delay: float = .5):
+        self.write_terminals = write_terminals
+        self.post = post
+        self.mail_host = mail_host
+        self.mail_port = int(mail_port)
+        self.retries = retries
+        self.timeout = timeout
+        self.workers = workers
+        self.retry_delay = retry_delay
+        self.terminals = []
+        self.slack_posts = []
+        self.mails = []
+
+    def __len__(self):
+        return len(self.terminals) + len(self.slack_posts) + len(self.mails)
+
+    def terminal(self, user: str, message: str):
+        self.terminals.append((user, message))
+
+    def slack(self, message: str, url: str):
+        self.slack_posts.append((message, url))
+
+    def mail(self, sender: str, receiver: str, message: str):
+        self.mails.append((sender, receiver, message))
+
+    def _retry(self, func):
+        return retry(func, self.retries, self.retry_delay)
+
+    def _deliver_terminals(self, user, message):
+        # None until the terminals of the user have been looked up.
+        failed = None
+
+        def write():
+            nonlocal failed
+            if failed is None:
+                failed = self.write_terminals(user, message) or []
+            else:
+                failed = self.write_terminals(
+                    user, message, terminals=failed) or []
+            if failed:
+                raise IOError('Unable to write to {} of {}'.format(
+                    ', '.join(failed), user))
+
+        self._retry(write)
+        return 1
+
+    def _deliver_slack(self, posts):
+        delivered = 0
+        with requests.Session() as session:
+            for message, url in posts:
+
+                def post():
+                    response = self.post(
+                        message, url, session=session, timeout=self.timeout)
+                    if response.status_code >= 500:
+                        raise IOError('slack returned {}'.format(
+                            response.status_code))
+
+                try:
+                    self._retry(post)
+                    delivered += 1
+                except Exception as e:
+                    logging.error('Unable to post to slack: {}'.format(e))
+        return delivered
+
+    def _deliver_mails(self, mails):
+        delivered = 0
+        smtp = None
+        for sender, receiver, message in mails:
+
+            def send():
+                nonlocal smtp
+                if smtp is None:
+                    smtp = smtplib.SMTP(
+                        self.mail_host, port=self.mail_port, timeout=self.timeout)
+                try:
+                    smtp.sendmail(sender, [receiver],
+                                  mail_text(sender, receiver, message))
+                except smtplib.SMTPServerDisconnected:
+                    smtp = None
+                    raise
+
+            try:
+                self._retry(send)
+                delivered += 1
+                logging.info(f"Successfully sent email to {receiver}.")
+            except Exception as e:
+                logging.error(
+                    "Error: unable to send email.\nThe error was:\n{}".format(e))
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except smtplib.SMTPException:
+                pass
+        return delivered
+
+    def flush(self):
+        """
+        Deliver everything that is queued and empty the queue.
+
+        Returns:
+            dict: kind -> number of delivered notifications.
+        """
+        terminals, self.terminals = self.terminals, []
+        slack_posts, self.slack_posts = self.slack_posts, []
+        mails, self.mails = self.mails, []
+        delivered = {'terminals': 0, 'slack': 0, 'mail': 0}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = []
+            if slack_posts:
+                futures.append(
+                    ('slack', pool.submit(self._deliver_slack, slack_posts)))
+            if mails:
+                futures.append(('mail', pool.submit(self._deliver_mails, mails)))
+            for user, message in terminals:
+                futures.append(('terminals', pool.submit(
+                    self._deliver_terminals, user, message)))
+            for kind, future in futures:
+                try:
+                    delivered[kind] += future.result()
+                except Exception as e:
+                    logging.error('Unable to deliver {} notification: {}'.format(
+                        kind, e))
+        return delivered
@@ -0,0 +1,362 @@
+"""
+Decide what to do with users over a threshold.
+
+Without a policy in kill_hogs.yml every user over --cpu_threshold,
+--memory_threshold or --gpu_max_walltime is killed in the scan it is seen,
+just like before. A policy declares rules instead:
+
+    policy:
+      actions: [warn, renice, kill]
+      strike_interval: 2
+      forgive_after: 30
+      rules:
+        - metric: cpu_percent
+          threshold: 300
+          scans: 3
+        - metric: cpu_percent
+          threshold: 200
+          minutes: 10
+        - metric: memory_percent
+          threshold: 10
+          actions: [kill]
+
+A rule with `scans` is violated by a user over the threshold in that many
+consecutive scans, a rule with `minutes` by a user whose moving average over
+that many minutes is over the threshold. Every violation is a strike, at
+most one per `strike_interval` minutes, and every strike takes the next
+action of the rule. The actions are warn, renice, pause, throttle (see
+throttle.py) and kill. After `forgive_after` minutes without violations a user
+starts over with the first action.
+
+Evaluating a scan only touches the users in it and the users with state, so
+it is O(users). The state of a user is one small record.
+"""
+
+from array import array
+import json
+import logging
+import math
+import os
+
+# From mild to severe.
+ACTIONS = ['warn', 'renice', 'pause', 'throttle', 'kill']
+WARNING = '''Your processes use more than is allowed on this node.
+Please submit them as a job. If they keep running they will be killed.'''
+METRICS = {
+    'cpu': 'cpu_percent',
+    'memory': 'memory_percent',
+    'gpu': 'gpu_walltime',
+    'gpu_memory': 'gpu_memory',
+    'gpu_utilization': 'gpu_utilization',
+    'io_read': 'io_read',
+    'io_write': 'io_write',
+    'io_syscalls': 'io_syscalls',
+}
+GPU_METRICS = ['gpu_walltime', 'gpu_memory', 'gpu_utilization']
+IO_METRICS = ['io_read', 'io_write', 'io_syscalls']
+
+
+class Rule:
+    """
+    Args:
+        metric (str): cpu_percent, memory_percent, gpu_walltime (minutes),
+            gpu_memory (MiB), gpu_utilization (% of the SMs of one gpu),
+            io_read or io_write (MiB/s from or to storage) or io_syscalls
+            (read and write syscalls per second).
+        threshold (float): a user over this value violates the rule.
+        scans (int): number of consecutive scans over <threshold>.
+        minutes (float): compare the moving average over this many minutes
+            instead of single scans.
+        actions (list): what to do on the first, second, ... strike. The
+            last action is repeated.
+    """
+    __slots__ = ['metric', 'threshold', 'scans', 'minutes', 'actions']
+
+    def __init__(self, metric: str, threshold: float, scans: int = 1,
+                 minutes: float = 0, actions=('kill',)):
+        self.metric = METRICS.get(metric, metric)
+        if self.metric not in METRICS.values():
+            raise ValueError('Unknown metric {}'.format(metric))
+        for action in actions:
+            if action not in ACTIONS:
+                raise ValueError('Unknown action {}'.format(action))
+        self.threshold = float(threshold)
+        self.scans = max(1, int(scans))
+        self.minutes = float(minutes)
+        self.actions = tuple(actions)
+
+    def key(self):
+        return (self.metric, self.threshold, self.scans, self.minutes,
+                self.actions)
+
+    def describe(self):
+        if self.minutes:
+            return '{} averaged over {:g} minutes > {:g}'.format(
+                self.metric, self.minutes, self.threshold)
+        if self.scans > 1:
+            return '{} > {:g} in {} scans'.format(
+                self.metric, self.threshold, self.scans)
+        return '{} > {:g}'.format(self.metric, self.threshold)
+
+
+class UserState:
+    """
+    What a policy remembers about one user.
+    """
+    __slots__ = ['over', 'averages', 'strikes', 'last_strike',
+                 'last_violation', 'action']
+
+    def __init__(self, rules: int):
+        # Consecutive scans over the threshold and moving average per rule.
+        self.over = array('I', [0] * rules)
+        self.averages = array('d', [0] * rules)
+        self.strikes = 0
+        self.last_strike = None
+        self.last_violation = None
+        self.action = None
+
+    def to_list(self):
+        return [list(self.over), list(self.averages), self.strikes,
+                self.last_strike, self.last_violation, self.action]
+
+    @classmethod
+    def from_list(cls, values):
+        over, averages, strikes, last_strike, last_violation, action = values
+        state = cls(len(over))
+        state.over = array('I', over)
+        state.averages = array('d', averages)
+        state.strikes = strikes
+        state.last_strike = last_strike
+        state.last_violation = last_violation
+        state.action = action
+        return state
+
+
+def rules_from_thresholds(memory_threshold, cpu_threshold, gpu_max_walltime,
+                          gpu_memory_threshold=0, gpu_util_threshold=0,
+                          io_read_threshold=0, io_write_threshold=0,
+                          io_syscall_threshold=0, cpu_minutes=0):
+    """
+    The rules kill hogs used before there were policies: kill in the first
+    scan a user is over a threshold. Gpu and io thresholds of 0 are no limit.
+    With <cpu_minutes> the cpu threshold is on the moving average over that
+    many minutes instead.
+    """
+    rules = [
+        Rule('memory_percent', memory_threshold),
+        Rule('cpu_percent', cpu_threshold, minutes=cpu_minutes),
+    ]
+    for metric, threshold in [('gpu_walltime', gpu_max_walltime),
+                              ('gpu_memory', gpu_memory_threshold),
+                              ('gpu_utilization', gpu_util_threshold),
+                              ('io_read', io_read_threshold),
+                              ('io_write', io_write_threshold),
+                              ('io_syscalls', io_syscall_threshold)]:
+        if float(threshold) > 0:
+            rules.append(Rule(metric, threshold))
+    return rules
+
+
+class Policy:
+    """
+    Args:
+        state_file (str): where to keep the state between runs, or None to
+            only keep it in memory.
+    """
+
+    def __init__(self, state_file: str = None):
+        self.state_file = state_file
+        self.rules = []
+        self.strike_interval = 0
+        self.forgive_after = 30 * 60
+        self.warning = WARNING
+        # username -> UserState
+        self.users = {}
+        # When evaluate() was last called.
+        self.updated_at = None
+        self._loaded_rules = None
+        if state_file is not None:
+            self.load()
+
+    def configure(self, config: dict, memory_threshold, cpu_threshold,
+                  gpu_max_walltime, gpu_memory_threshold=0,
+                  gpu_util_threshold=0, io_read_threshold=0,
+                  io_write_threshold=0, io_syscall_threshold=0,
+                  cpu_minutes=0):
+        """
+        Take the rules from the policy section of <config>, or from the
+        thresholds when there is none, see rules_from_thresholds(). The state of users is kept as long as
+        the rules stay the same, so a config reload does not forgive anyone.
+        """
+        policy = config.get('policy') or {}
+        if policy.get('rules'):
+            actions = policy.get('actions', ['kill'])
+            rules = [
+                Rule(rule['metric'], rule['threshold'],
+                     scans=rule.get('scans', 1),
+                     minutes=rule.get('minutes', 0),
+                     actions=rule.get('actions', actions))
+                for rule in policy['rules']
+            ]
+        else:
+            rules = rules_from_thresholds(
+                memory_threshold, cpu_threshold, gpu_max_walltime,
+                gpu_memory_threshold, gpu_util_threshold, io_read_threshold,
+                io_write_threshold, io_syscall_threshold, cpu_minutes)
+        self.strike_interval = float(policy.get('strike_interval', 0)) * 60
+        self.forgive_after = float(policy.get('forgive_after', 30)) * 60
+        self.warning = policy.get('warning', WARNING)
+
+        keys = [rule.key() for rule in rules]
+        if self._loaded_rules is not None:
+            # State read from the state file belongs to these rules.
+            current, self._loaded_rules = self._loaded_rules, None
+        else:
+            current = [rule.key() for rule in self.rules]
+        if keys != current:
+            if self.users:
+                logging.info('Policy rules changed, forgetting user state.')
+            self.users = {}
+        self.rules = rules
+
+    def uses_gpu(self):
+        """
+        Whether a rule needs the gpu usage of processes.
+        """
+        return any(rule.metric in GPU_METRICS for rule in self.rules)
+
+    def uses_io(self):
+        """
+        Whether a rule needs the io rates of processes.
+        """
+        return any(rule.metric in IO_METRICS for rule in self.rules)
+
+    def lowest_threshold(self, metric: str, default: float):
+        """
+        Returns:
+            float: the lowest threshold of the rules on <metric>, so users
+                below it can be skipped.
+        """
+        thresholds = [rule.threshold for rule in self.rules if rule.metric == metric]
+        return min(thresholds) if thresholds else default
+
+    def evaluate(self, users: dict, now: float):
+        """
+        Update the state with the per user totals of a scan as returned by
+        collect_users().
+
+        Returns:
+            dict: username -> (action, list of violated rules) for the users
+                something should be done about.
+        """
+        decisions = {}
+        stateful = self.stateful
+        # In the order of the scan, then the users only tracked from earlier
+        # scans, so the decisions do not depend on the hash seed.
+        tracked = [username for username in self.users
+                   if username not in users]
+        for username in list(users) + tracked:
+            data = users.get(username)
+            state = self.users.get(username)
+            if state is None:
+                state = UserState(len(self.rules))
+            last = self.updated_at if self.updated_at is not None else now
+            elapsed = max(0, now - last)
+
+            violated = []
+            for r, rule in enumerate(self.rules):
+                value = data[rule.metric] if data is not None else 0
+                over = value > rule.threshold
+                state.over[r] = state.over[r] + 1 if over else 0
+                if rule.minutes:
+                    state.averages[r] += (
+                        1 - math.exp(-elapsed / (rule.minutes * 60))) * (
+                            value - state.averages[r])
+                    if state.averages[r] > rule.threshold:
+                        violated.append(rule)
+                elif state.over[r] >= rule.scans:
+                    violated.append(rule)
+
+            if violated:
+                action = self._strike(state, violated, now)
+                if action is not None:
+                    decisions[username] = (action, violated)
+            elif state.last_violation is None or \
+                    now - state.last_violation > self.forgive_after:
+                state.strikes = 0
+                state.action = None
+
+            if not stateful or (state.strikes == 0 and not any(state.over)
+                                and max(state.averages, default=0) < .1):
+                self.users.pop(username, None)
+            else:
+                self.users[username] = state
+        self.updated_at = now
+        return decisions
+
+    def _strike(self, state: UserState, violated, now: float):
+        """
+        Returns:
+            str: the action to take for a user violating <violated>, or None
+                when the user has been warned already.
+        """
+        state.last_violation = now
+        if state.last_strike is None or \
+                now - state.last_strike >= self.strike_interval:
+            state.strikes += 1
+            state.last_strike = now
+            state.action = max(
+                (rule.actions[min(state.strikes, len(rule.actions)) - 1]
+                 for rule in violated), key=ACTIONS.index)
+            return state.action
+        # Keep renicing and killing until the next strike, but warn once.
+        if state.action == 'warn':
+            return None
+        return state.action
+
+    def load(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logging.warning('Ignoring broken policy state file {}: {}'.format(
+                self.state_file, e))
+            return
+        self.updated_at = state['updated_at']
+        self._loaded_rules = [
+            (metric, threshold, scans, minutes, tuple(actions))
+            for metric, threshold, scans, minutes, actions in state['rules']
+        ]
+        self.users = {
+            username: UserState.from_list(values)
+            for username, values in state['users'].items()
+        }
+
+    @property
+    def stateful(self):
+        """
+        Whether a rule depends on earlier scans. Killing on the first
+        violation does not.
+        """
+        return any(rule.scans > 1 or rule.minutes or len(rule.actions) > 1
+                   for rule in self.rules)
+
+    def save(self):
+        if self.state_file is None or not self.stateful:
+            return
+        state = {
+            'updated_at': self.updated_at,
+            'rules': [rule.key() for rule in self.rules],
+            'users': {username: state.to_list()
+                      for username, state in self.users.items()},
+        }
+        tmp = self.state_file + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_file)
+        except OSError as e:
+            logging.warning('Unable to save policy state to {}: {}'.format(
+                self.state_file, e))
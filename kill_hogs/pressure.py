@@ -0,0 +1,236 @@
+"""
+Scan when the node is under pressure, not on a fixed cadence.
+
+The kernel reports in /proc/pressure/{cpu,memory,io} which share of the time
+tasks were stalled waiting for that resource. Reading those three files is
+much cheaper than a scan of all processes, so in daemon mode with
+--adaptive every cycle only looks at the pressure:
+
+- while it is below the thresholds, a full scan is only done every
+  --max_idle seconds, to still catch hogs on a quiet node;
+- once it is over a threshold, a full scan is done every --fast_period
+  seconds;
+- a PSI trigger (see Documentation/accounting/psi.rst) wakes the daemon as
+  soon as the kernel sees the configured stall, for instance 150 ms of
+  memory stall in one second, so hogs are dealt with before the OOM killer
+  steps in.
+"""
+
+import logging
+import os
+import select
+import time
+
+RESOURCES = ['cpu', 'memory', 'io']
+DEFAULT_TRIGGERS = ['memory.some=150000/1000000']
+
+
+def parse_pressure(text: str):
+    """
+    Parse a /proc/pressure file.
+
+    Returns:
+        dict: 'some' and 'full' -> dict with avg10, avg60, avg300 in % and
+            total in microseconds.
+    """
+    pressure = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        values = {}
+        for field in fields[1:]:
+            key, _, value = field.partition('=')
+            values[key] = float(value)
+        pressure[fields[0]] = values
+    return pressure
+
+
+def parse_thresholds(text: str):
+    """
+    Parse 'cpu=40,memory.full=5' into {('cpu', 'some'): 40,
+    ('memory', 'full'): 5}. Without .some or .full, some is meant.
+    """
+    thresholds = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, _, value = item.partition('=')
+        resource, _, kind = name.strip().partition('.')
+        if resource not in RESOURCES or kind not in ('', 'some', 'full'):
+            raise ValueError('Unknown pressure {}'.format(name))
+        thresholds[(resource, kind or 'some')] = float(value)
+    return thresholds
+
+
+class PressureMonitor:
+    """
+    Reads the avg10 pressure of cpu, memory and io.
+
+    Args:
+        root (str): where the pressure files are.
+        thresholds (dict): (resource, 'some' or 'full') -> avg10 in % above
+            which the node is under pressure, see parse_thresholds().
+    """
+
+    def __init__(self, root: str = '/proc/pressure', thresholds: dict = None):
+        self.root = root
+        self.thresholds = thresholds if thresholds is not None else {
+            ('cpu', 'some'): 40, ('memory', 'some'): 10, ('io', 'some'): 40}
+        # resource -> file descriptor, kept open so a check is one pread.
+        self._fds = {}
+
+    def available(self):
+        return all(os.path.exists(os.path.join(self.root, resource))
+                   for resource, _ in self.thresholds)
+
+    def read(self, resource: str):
+        fd = self._fds.get(resource)
+        if fd is None:
+            fd = os.open(os.path.join(self.root, resource), os.O_RDONLY)
+            self._fds[resource] = fd
+        return parse_pressure(os.pread(fd, 4096, 0).decode())
+
+    def sample(self):
+        """
+        Returns:
+            dict: (resource, kind) -> avg10 for every threshold.
+        """
+        pressure = {}
+        for resource, kind in self.thresholds:
+            pressure[(resource, kind)] = self.read(resource).get(
+                kind, {}).get('avg10', 0)
+        return pressure
+
+    def over(self, pressure: dict):
+        """
+        Returns:
+            list: the (resource, kind) whose pressure is over its threshold.
+        """
+        return [key for key, value in pressure.items()
+                if value > self.thresholds[key]]
+
+    def close(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds = {}
+
+
+class PressureTrigger:
+    """
+    A PSI trigger: the kernel signals POLLPRI on its file descriptor when
+    tasks stalled on <resource> for <stall> microseconds within a <window>.
+    Needs a kernel with PSI and, for unprivileged users, a window that is a
+    multiple of 2 seconds.
+
+    Args:
+        spec (str): 'resource.some=stall/window', e.g.
+            memory.some=150000/1000000.
+    """
+
+    def __init__(self, spec: str, root: str = '/proc/pressure'):
+        name, _, values = spec.partition('=')
+        resource, _, kind = name.strip().partition('.')
+        stall, _, window = values.partition('/')
+        if resource not in RESOURCES or kind not in ('some', 'full'):
+            raise ValueError('Unknown pressure {}'.format(name))
+        self.spec = spec
+        self.fd = os.open(os.path.join(root, resource),
+                          os.O_RDWR | os.O_NONBLOCK)
+        try:
+            os.write(self.fd, '{} {} {}\0'.format(
+                kind, int(stall), int(window)).encode())
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        os.close(self.fd)
+
+
+class AdaptiveScheduler:
+    """
+    Decides for Daemon when to do a full scan.
+
+    Args:
+        monitor: a PressureMonitor.
+        period (float): seconds between pressure checks.
+        fast_period (float): seconds between scans under pressure.
+        max_idle (float): scan at least this often, also without pressure.
+        triggers (list): PressureTrigger objects that wake the daemon.
+    """
+
+    def __init__(self, monitor: PressureMonitor, period: float = 5,
+                 fast_period: float = 1, max_idle: float = 60, triggers=()):
+        self.monitor = monitor
+        self.period = period
+        self.fast_period = fast_period
+        self.max_idle = max_idle
+        self.triggers = list(triggers)
+        self.pressure = {}
+        self.under_pressure = []
+        self.last_scan = None
+        self.triggered = False
+        self._poll = select.poll()
+        for trigger in self.triggers:
+            self._poll.register(trigger, select.POLLPRI)
+
+    def due(self, now: float):
+        """
+        Returns:
+            bool: whether to do a full scan now.
+        """
+        try:
+            self.pressure = self.monitor.sample()
+        except OSError as e:
+            logging.warning('Unable to read pressure, scanning: {}'.format(e))
+            return True
+        self.under_pressure = self.monitor.over(self.pressure)
+        if self.under_pressure:
+            logging.debug('Under pressure: {}'.format(self.under_pressure))
+            return True
+        return (self.triggered or self.last_scan is None
+                or now - self.last_scan >= self.max_idle)
+
+    def scanned(self, now: float):
+        self.last_scan = now
+        self.triggered = False
+
+    def interval(self):
+        """
+        Returns:
+            float: seconds from the start of this cycle to the next one.
+        """
+        return self.fast_period if self.under_pressure else self.period
+
+    def wait(self, timeout: float, stop):
+        """
+        Wait <timeout> seconds, until a trigger fires or until the event
+        <stop> is set.
+        """
+        if not self.triggers:
+            stop.wait(timeout)
+            return
+        deadline = time.monotonic() + timeout
+        while not stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            # Short slices, so setting <stop> is noticed.
+            for fd, event in self._poll.poll(min(remaining, .25) * 1000):
+                if event & (select.POLLERR | select.POLLNVAL):
+                    logging.warning('Pressure trigger stopped working.')
+                    self._poll.unregister(fd)
+                    continue
+                if event & select.POLLPRI:
+                    logging.info('Pressure trigger fired.')
+                    self.triggered = True
+                    return
+
+    def close(self):
+        for trigger in self.triggers:
+            trigger.close()
+        self.monitor.close()
@@ -0,0 +1,236 @@
+"""
+Keep track of the running processes with the netlink proc connector.
+
+The kernel sends an event for every fork, exec and exit. In daemon mode a
+ProcessTable is kept up to date from these events, so a scan only has to
+look at the processes in the table instead of listing /proc every time.
+
+Listening needs root (CAP_NET_ADMIN). When the connector is not available,
+start_listener() returns None and scans enumerate all processes as before.
+"""
+
+import errno
+import logging
+import os
+import socket
+import struct
+import threading
+
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+NLMSG_DONE = 3
+PROC_CN_MCAST_LISTEN = 1
+PROC_CN_MCAST_IGNORE = 2
+
+PROC_EVENT_FORK = 0x00000001
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_UID = 0x00000004
+PROC_EVENT_EXIT = 0x80000000
+
+NLMSGHDR = struct.Struct('=IHHII')
+CN_MSG = struct.Struct('=IIIIHH')
+PROC_EVENT_HEADER = struct.Struct('=IIQ')
+FORK_EVENT = struct.Struct('=iiii')
+PID_TGID = struct.Struct('=ii')
+UID_EVENT = struct.Struct('=iiII')
+
+
+class ProcessTable:
+    """
+    The set of running processes (thread group leaders), updated from fork,
+    exec and exit events.
+
+    When events may have been lost the table is marked stale, and pids()
+    returns None until the next full enumeration is fed to update_from_scan().
+    """
+
+    def __init__(self):
+        self._pids = set()
+        self._lock = threading.Lock()
+        self.stale = True
+        self.events = 0
+
+    def __len__(self):
+        return len(self._pids)
+
+    def __contains__(self, pid):
+        return pid in self._pids
+
+    def fork(self, parent_pid: int, child_pid: int, child_tgid: int):
+        # New threads share the tgid of their process, they are not tracked.
+        if child_pid == child_tgid:
+            with self._lock:
+                self._pids.add(child_pid)
+
+    def exec(self, pid: int, tgid: int):
+        with self._lock:
+            self._pids.add(tgid)
+
+    def exit(self, pid: int, tgid: int):
+        if pid == tgid:
+            with self._lock:
+                self._pids.discard(pid)
+
+    def lost_events(self):
+        self.stale = True
+
+    def handle(self, event: tuple):
+        """
+        Apply an event as returned by parse_events().
+        """
+        self.events += 1
+        what = event[0]
+        if what == PROC_EVENT_FORK:
+            self.fork(*event[1:])
+        elif what == PROC_EVENT_EXEC:
+            self.exec(*event[1:])
+        elif what == PROC_EVENT_EXIT:
+            self.exit(*event[1:])
+
+    def pids(self):
+        """
+        Returns:
+            list: the known processes, or None if the table has to be
+                rebuilt from a full enumeration.
+        """
+        if self.stale:
+            return None
+        with self._lock:
+            return list(self._pids)
+
+    def update_from_scan(self, requested, seen, unvisited=()):
+        """
+        Bring the table in line with what a scan found.
+
+        Args:
+            requested (list): the pids that were sampled, None if all
+                processes were enumerated.
+            seen (iterable): the pids that could be sampled.
+            unvisited (iterable): the pids the scan did not get to, for
+                instance because it ran out of time. They are kept.
+        """
+        unvisited = set(unvisited)
+        with self._lock:
+            if requested is None:
+                # Keep what was added by events during the scan.
+                self._pids.update(seen)
+                self._pids.update(unvisited)
+                self.stale = False
+            else:
+                self._pids.difference_update(
+                    set(requested) - set(seen) - unvisited)
+
+
+def parse_events(data: bytes):
+    """
+    Parse the netlink messages in <data> into event tuples:
+    (PROC_EVENT_FORK, parent_pid, child_pid, child_tgid),
+    (PROC_EVENT_EXEC, pid, tgid) or (PROC_EVENT_EXIT, pid, tgid).
+    Other events are skipped.
+    """
+    events = []
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length = NLMSGHDR.unpack_from(data, offset)[0]
+        if length < NLMSGHDR.size:
+            break
+        start = offset + NLMSGHDR.size + CN_MSG.size
+        what = PROC_EVENT_HEADER.unpack_from(data, start)[0]
+        body = start + PROC_EVENT_HEADER.size
+        if what == PROC_EVENT_FORK:
+            parent_pid, _, child_pid, child_tgid = FORK_EVENT.unpack_from(data, body)
+            events.append((what, parent_pid, child_pid, child_tgid))
+        elif what in (PROC_EVENT_EXEC, PROC_EVENT_EXIT):
+            events.append((what, ) + PID_TGID.unpack_from(data, body))
+        # Messages are aligned to 4 bytes.
+        offset += (length + 3) & ~3
+    return events
+
+
+def pack_event(what: int, *fields):
+    """
+    Build the netlink message the kernel sends for an event. Used in tests.
+    """
+    if what == PROC_EVENT_FORK:
+        parent_pid, child_pid, child_tgid = fields
+        body = FORK_EVENT.pack(parent_pid, parent_pid, child_pid, child_tgid)
+    elif what == PROC_EVENT_EXIT:
+        body = PID_TGID.pack(*fields) + struct.pack('=II', 0, 17)
+    elif what == PROC_EVENT_UID:
+        body = UID_EVENT.pack(*fields)
+    else:
+        body = PID_TGID.pack(*fields)
+    event = PROC_EVENT_HEADER.pack(what, 0, 0) + body
+    message = CN_MSG.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(event), 0) + event
+    return NLMSGHDR.pack(NLMSGHDR.size + len(message), NLMSG_DONE, 0, 0, 0) + message
+
+
+def subscription_message(operation: int = PROC_CN_MCAST_LISTEN):
+    payload = struct.pack('=I', operation)
+    message = CN_MSG.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(payload), 0) + payload
+    return NLMSGHDR.pack(
+        NLMSGHDR.size + len(message), NLMSG_DONE, 0, 0, os.getpid()) + message
+
+
+class ProcEventListener(threading.Thread):
+    """
+    Read proc connector events from <sock> into <table> until stopped.
+    """
+
+    def __init__(self, sock, table: ProcessTable):
+        super().__init__(name='proc-events', daemon=True)
+        self.sock = sock
+        self.table = table
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            try:
+                data = self.sock.recv(65536)
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    # The kernel dropped events, rebuild on the next scan.
+                    logging.warning('Lost process events, rescanning.')
+                    self.table.lost_events()
+                    continue
+                if not self._done.is_set():
+                    logging.error('Process event listener failed: {}'.format(e))
+                    self.table.lost_events()
+                return
+            for event in parse_events(data):
+                self.table.handle(event)
+
+    def stop(self):
+        self._done.set()
+        try:
+            self.sock.send(subscription_message(PROC_CN_MCAST_IGNORE))
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def start_listener(table: ProcessTable):
+    """
+    Subscribe to the proc connector and start feeding <table>.
+
+    Returns:
+        ProcEventListener: the running listener, or None when the proc
+            connector can not be used here.
+    """
+    sock = None
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                             NETLINK_CONNECTOR)
+        sock.bind((os.getpid(), CN_IDX_PROC))
+        sock.send(subscription_message())
+    except (AttributeError, OSError) as e:
+        if sock is not None:
+            sock.close()
+        logging.warning(
+            'Proc connector not available, enumerating processes every scan. '
+            'The error was: {}'.format(e))
+        return None
+    listener = ProcEventListener(sock, table)
+    listener.start()
+    return listener
@@ -0,0 +1,174 @@
+"""
+The process tree of a scan, to deal with whole trees instead of the busy
+processes only.
+
+Usage is added up per user, and only processes over .1 % of memory or 1 %
+of cpu are counted, so the idle parents of the busy processes are left
+alone: the screen or tmux pane, the nohup'ed shell loop, the job launcher.
+They start new workers right after the old ones were killed.
+
+ProcessTree indexes the processes of a scan by parent, and adds up their
+usage per tree, session or process group. With --kill_scope tree, the processes of a
+user that something is done about are extended with their tree: from each
+busy process up to the top of its process group, the job an interactive
+shell started, and from there all descendants of that user. The shell and
+its other jobs are in process groups of their own and are left alone.
+
+In daemon mode the index is kept between scans and only the processes whose
+parent changed are moved, so an update is one pass over the scan.
+"""
+
+
+class ProcessTree:
+    """
+    Parent and child index of the processes in the last snapshot given to
+    update(). The snapshot has to be sampled with tree=True.
+    """
+
+    def __init__(self):
+        # pid -> ppid and ppid -> set of child pids. Parents that are not
+        # in the scan, such as pid 1, only appear as a key of children.
+        self.parents = {}
+        self.children = {}
+        # pid -> index in the snapshot.
+        self.index = {}
+        self.snapshot = None
+        # Processes that were added, moved or removed by the last update.
+        self.changed = 0
+
+    def __len__(self):
+        return len(self.parents)
+
+    def _unlink(self, pid: int, ppid: int):
+        siblings = self.children.get(ppid)
+        if siblings is not None:
+            siblings.discard(pid)
+            if not siblings:
+                del self.children[ppid]
+
+    def update(self, snapshot):
+        """
+        Index the processes of <snapshot>. Processes that are no longer in
+        it are dropped.
+        """
+        if len(snapshot.ppids) != len(snapshot):
+            raise ValueError('The snapshot was not sampled with tree=True')
+        parents = self.parents
+        children = self.children
+        self.index = index = dict(zip(snapshot.pids, range(len(snapshot))))
+        self.snapshot = snapshot
+        changed = 0
+        for pid in [pid for pid in parents if pid not in index]:
+            self._unlink(pid, parents.pop(pid))
+            changed += 1
+        for pid, ppid in zip(snapshot.pids, snapshot.ppids):
+            old = parents.get(pid)
+            if old == ppid:
+                continue
+            if old is not None:
+                self._unlink(pid, old)
+            siblings = children.get(ppid)
+            if siblings is None:
+                children[ppid] = {pid}
+            else:
+                siblings.add(pid)
+            parents[pid] = ppid
+            changed += 1
+        self.changed = changed
+
+    def root(self, i: int):
+        """
+        Returns:
+            int: the index of the top of the tree process <i> is in: the
+                highest ancestor of the same user in the process group of
+                <i>.
+        """
+        snapshot = self.snapshot
+        pids, ppids, pgids, uids = (snapshot.pids, snapshot.ppids,
+                                    snapshot.pgids, snapshot.uids)
+        uid = uids[i]
+        pgid = pgids[i]
+        # Bounded, should the scan have caught a loop of reused pids.
+        for _ in range(len(pids)):
+            parent = self.index.get(ppids[i])
+            if parent is None or uids[parent] != uid or \
+                    pgids[parent] != pgid:
+                return i
+            i = parent
+        return i
+
+    def subtree(self, i: int):
+        """
+        Returns:
+            list: the indices of process <i> and of its descendants of the
+                same user.
+        """
+        snapshot = self.snapshot
+        uids = snapshot.uids
+        uid = uids[i]
+        index = self.index
+        children = self.children
+        indices = []
+        seen = set()
+        stack = [snapshot.pids[i]]
+        while stack:
+            pid = stack.pop()
+            j = index.get(pid)
+            if j is None or uids[j] != uid or pid in seen:
+                continue
+            seen.add(pid)
+            indices.append(j)
+            stack.extend(children.get(pid, ()))
+        return indices
+
+    def trees(self, indices):
+        """
+        Returns:
+            dict: root index -> indices of the tree, see root() and
+                subtree(), of every tree one of <indices> is in.
+        """
+        roots = {self.root(i) for i in indices}
+        return {root: self.subtree(root) for root in roots}
+
+    def expand(self, indices):
+        """
+        Returns:
+            list: <indices> and the other processes in their trees, sorted.
+        """
+        expanded = set(indices)
+        for tree in self.trees(indices).values():
+            expanded.update(tree)
+        return sorted(expanded)
+
+    def rollup(self, indices, by: str = 'tree'):
+        """
+        Add up the usage of the processes in the trees, sessions or process
+        groups of <indices>, idle processes included. Only processes of the
+        same user count for a session or group.
+
+        Args:
+            by (str): 'tree', 'session' or 'group'.
+
+        Returns:
+            dict: pid of the root of the tree, session id or process group
+                id -> (number of processes, cpu %, memory %).
+        """
+        snapshot = self.snapshot
+        cpu = snapshot.cpu_percent
+        memory = snapshot.memory_percent
+        if by == 'tree':
+            groups = {snapshot.pids[root]: tree
+                      for root, tree in self.trees(indices).items()}
+        elif by in ('session', 'group'):
+            ids = snapshot.sids if by == 'session' else snapshot.pgids
+            uids = snapshot.uids
+            wanted = {(ids[i], uids[i]) for i in indices}
+            groups = {}
+            for j in range(len(snapshot)):
+                if (ids[j], uids[j]) in wanted:
+                    groups.setdefault(ids[j], []).append(j)
+        else:
+            raise ValueError('Unknown rollup {}'.format(by))
+        return {key: (len(group), sum(cpu[j] for j in group),
+                      sum(memory[j] for j in group))
+                for key, group in groups.items()}
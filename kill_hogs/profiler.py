@@ -0,0 +1,63 @@
+"""
+Where does a scan spend its time?
+
+kill_hogs() fills in a ScanProfile with the time spent per phase and counts
+of what happened to the processes it looked at. With --profile every scan
+is written as one json line, so scan cost can be graphed against node load.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+import socket
+import sys
+import time
+
+
+class ScanProfile:
+    def __init__(self):
+        self.started = time.time()
+        # phase -> seconds, in the order the phases were first entered.
+        self.timings = {}
+        self.counts = defaultdict(int)
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Add the time spent in the with block to phase <name>.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float):
+        self.timings[name] = self.timings.get(name, 0) + seconds
+
+    def count(self, name: str, n: int = 1):
+        self.counts[name] += n
+
+    def to_dict(self):
+        return {
+            'time': self.started,
+            'host': socket.gethostname(),
+            'load': os.getloadavg(),
+            'timings': self.timings,
+            'counts': dict(self.counts),
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+
+def write_profile(profile: ScanProfile, path: str = '-'):
+    """
+    Append <profile> as a json line to <path>, or to stdout for '-'.
+    """
+    if path == '-':
+        print(profile.to_json(), file=sys.stdout, flush=True)
+        return
+    with open(path, 'a') as f:
+        f.write(profile.to_json() + '\n')
@@ -0,0 +1,289 @@
+"""
+Replay the history to see what other thresholds would have done.
+
+kill hogs with --history_file records the usage of every user in every scan,
+see history.py. kill-hogs-replay reads those records, without copying the
+file, into one array per metric with a row per scan and a column per user,
+and runs every combination of the given thresholds over them:
+
+    kill-hogs-replay --since 30d --cpu_threshold 400 600 800 \
+        --memory_threshold 5 10 --scans 1 3 --minutes 0 10
+
+For every combination it reports how often it would have acted, on which
+users and how long after a user went over the threshold. A rule with
+--minutes compares the moving average over that many minutes, like a rule
+with minutes in a policy, otherwise a user has to be over the threshold in
+--scans consecutive scans. An action is counted once per violation: what
+would have happened after it is not known, so a user that stays over a
+threshold is assumed to be the same hog. Escalation through warn and
+renice is not simulated.
+
+All combinations are evaluated together in one pass over the scans, each
+step vectorized over combinations and users, so a month of 2 minute scans
+and dozens of combinations take seconds. Needs numpy (pip install .[replay]).
+"""
+
+from collections import namedtuple
+from itertools import product
+from kill_hogs.history import HistoryStore, RECORD, SCAN, parse_duration
+import argparse
+import json
+import logging
+import os
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+Combination = namedtuple(
+    'Combination', ['cpu_threshold', 'memory_threshold', 'scans', 'minutes'])
+
+
+def record_dtype():
+    """
+    Returns:
+        numpy.dtype: of the records in a history file, see history.RECORD.
+    """
+    dtype = np.dtype([('time', '<f8'), ('user', 'S32'), ('pid', '<i4'),
+                      ('cpu_percent', '<f4'), ('memory_percent', '<f4'),
+                      ('gpu_walltime', '<f4')])
+    assert dtype.itemsize == RECORD.size
+    return dtype
+
+
+class Recording:
+    """
+    The usage per scan and user.
+
+    Args:
+        times: seconds since the epoch of every scan, ascending.
+        users (list): usernames, one per column.
+        cpu_percent: scans x users array.
+        memory_percent: scans x users array.
+    """
+
+    def __init__(self, times, users, cpu_percent, memory_percent):
+        self.times = times
+        self.users = users
+        self.cpu_percent = cpu_percent
+        self.memory_percent = memory_percent
+
+    def __len__(self):
+        return len(self.times)
+
+
+def load(store: HistoryStore, since: float = 0, until: float = float('inf')):
+    """
+    Returns:
+        Recording: of the scans in <store> from <since> up to <until>.
+    """
+    if np is None:
+        raise RuntimeError('numpy is not installed')
+    dtype = record_dtype()
+    parts = []
+    for chunk in store.chunks():
+        with chunk:
+            records = np.frombuffer(chunk, dtype=dtype)
+            keep = (records['time'] >= since) & (records['time'] < until)
+            # Indexing with a mask copies, so the file can be closed.
+            parts.append(records[keep])
+            del records
+    records = np.concatenate(parts) if parts else np.zeros(0, dtype)
+
+    scans = records['user'] == SCAN.encode()
+    times = records['time'][scans]
+    rows = records[~scans & (records['pid'] == 0)]
+    # Users recorded before the oldest scan record that is left.
+    scan = np.searchsorted(times, rows['time'])
+    found = scan < len(times)
+    found[found] = times[scan[found]] == rows['time'][found]
+    rows, scan = rows[found], scan[found]
+
+    names, column = np.unique(rows['user'], return_inverse=True)
+    shape = (len(times), len(names))
+    cpu_percent = np.zeros(shape, np.float32)
+    memory_percent = np.zeros(shape, np.float32)
+    cpu_percent[scan, column] = rows['cpu_percent']
+    memory_percent[scan, column] = rows['memory_percent']
+    users = [name.decode('utf-8', 'replace') for name in names]
+    return Recording(times, users, cpu_percent, memory_percent)
+
+
+def replay(recording: Recording, combinations, top_users: int = 5):
+    """
+    Evaluate every combination of thresholds over <recording>.
+
+    Returns:
+        list: a dict per combination with the number of actions, the users
+            acted on and the seconds from a user going over a threshold to
+            the action.
+    """
+    if np is None:
+        raise RuntimeError('numpy is not installed')
+    combinations = list(combinations)
+    count, users = len(combinations), len(recording.users)
+    cpu_threshold = np.array([c.cpu_threshold for c in combinations],
+                             np.float32)[:, None]
+    memory_threshold = np.array([c.memory_threshold for c in combinations],
+                                np.float32)[:, None]
+    scans = np.array([max(1, int(c.scans)) for c in combinations])[:, None]
+    windows = sorted({float(c.minutes) for c in combinations if c.minutes})
+    averaged = np.array([bool(c.minutes) for c in combinations])[:, None]
+    # Combinations without a window use the first one, and ignore it.
+    window = np.array([windows.index(float(c.minutes)) if c.minutes else 0
+                       for c in combinations])
+    seconds = np.array(windows or [1.]) * 60
+
+    shape = (count, users)
+    cpu_over = np.zeros(shape, np.int64)
+    memory_over = np.zeros(shape, np.int64)
+    cpu_average = np.zeros((len(seconds), users))
+    memory_average = np.zeros((len(seconds), users))
+    violated = np.zeros(shape, bool)
+    over = np.zeros(shape, bool)
+    over_since = np.zeros(shape)
+    actions = np.zeros(shape, np.int64)
+    delays = [[] for _ in combinations]
+
+    previous = None
+    for t, now in enumerate(recording.times):
+        cpu = recording.cpu_percent[t]
+        memory = recording.memory_percent[t]
+        # Like Policy.evaluate(), the first scan does not move the averages.
+        elapsed = 0 if previous is None else max(0, now - previous)
+        previous = now
+        alpha = (1 - np.exp(-elapsed / seconds))[:, None]
+        cpu_average += alpha * (cpu - cpu_average)
+        memory_average += alpha * (memory - memory_average)
+
+        cpu_now = cpu > cpu_threshold
+        memory_now = memory > memory_threshold
+        cpu_over = np.where(cpu_now, cpu_over + 1, 0)
+        memory_over = np.where(memory_now, memory_over + 1, 0)
+        by_scans = (cpu_over >= scans) | (memory_over >= scans)
+        by_average = ((cpu_average[window] > cpu_threshold)
+                      | (memory_average[window] > memory_threshold))
+        now_violated = np.where(averaged, by_average, by_scans)
+
+        now_over = cpu_now | memory_now
+        over_since = np.where(now_over & ~over, now, over_since)
+        over = now_over
+        acted = now_violated & ~violated
+        violated = now_violated
+        if acted.any():
+            rows, columns = np.nonzero(acted)
+            actions[rows, columns] += 1
+            for row, delay in zip(rows, now - over_since[rows, columns]):
+                delays[row].append(float(delay))
+
+    results = []
+    for c, combination in enumerate(combinations):
+        acted_on = np.nonzero(actions[c])[0]
+        ranked = sorted(acted_on, key=lambda u: (-actions[c, u],
+                                                 recording.users[u]))
+        results.append({
+            'cpu_threshold': combination.cpu_threshold,
+            'memory_threshold': combination.memory_threshold,
+            'scans': combination.scans,
+            'minutes': combination.minutes,
+            'actions': int(actions[c].sum()),
+            'users': len(acted_on),
+            'top_users': [(recording.users[u], int(actions[c, u]))
+                          for u in ranked[:top_users]],
+            'delay_median': float(np.median(delays[c])) if delays[c] else None,
+            'delay_max': max(delays[c]) if delays[c] else None,
+        })
+    return results
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 120:
+        return '{:.0f}s'.format(seconds)
+    if seconds < 7200:
+        return '{:.0f}m'.format(seconds / 60)
+    return '{:.1f}h'.format(seconds / 3600)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Replay the kill hogs history with other thresholds.")
+    parser.add_argument(
+        "--history_file",
+        type=str,
+        default='{}/.kill_hogs/history.bin'.format(os.environ['HOME']),
+        help="History written by kill-hogs --history_file.")
+    parser.add_argument(
+        "--since",
+        type=str,
+        default='30d',
+        help="Start of the window, as a duration ago: 90s, 30m, 1h or 2d.")
+    parser.add_argument(
+        "--until",
+        type=str,
+        default='0',
+        help="End of the window, as a duration ago.")
+    parser.add_argument(
+        "--cpu_threshold", type=float, nargs='+', default=[600],
+        help="cpu percentages to try.")
+    parser.add_argument(
+        "--memory_threshold", type=float, nargs='+', default=[10],
+        help="memory percentages to try.")
+    parser.add_argument(
+        "--scans", type=int, nargs='+', default=[1],
+        help="Numbers of consecutive scans over a threshold to try.")
+    parser.add_argument(
+        "--minutes", type=float, nargs='+', default=[0],
+        help="Windows of moving averages to try, 0 for single scans.")
+    parser.add_argument(
+        "--top", type=int, default=5,
+        help="Number of users to show per combination.")
+    parser.add_argument(
+        "--json", action='store_true', help="Print json lines.")
+    args = parser.parse_args()
+    if np is None:
+        parser.error('kill-hogs-replay needs numpy: pip install numpy')
+
+    combinations = [
+        Combination(cpu, memory, scans if not minutes else 1, minutes)
+        for cpu, memory, scans, minutes in product(
+            args.cpu_threshold, args.memory_threshold, args.scans,
+            args.minutes)]
+    # --scans does not apply to averages.
+    combinations = list(dict.fromkeys(combinations))
+
+    now = time.time()
+    store = HistoryStore(args.history_file, readonly=True)
+    start = time.perf_counter()
+    recording = load(store, now - parse_duration(args.since),
+                     now - parse_duration(args.until))
+    store.close()
+    loaded = time.perf_counter()
+    results = replay(recording, combinations, args.top)
+    logging.info('Replayed {} scans of {} users with {} combinations, '
+                 'loading took {:.2f} s, replaying {:.2f} s.'.format(
+                     len(recording), len(recording.users), len(combinations),
+                     loaded - start, time.perf_counter() - loaded))
+
+    for result in results:
+        if args.json:
+            print(json.dumps(result, sort_keys=True))
+            continue
+        rule = ('averaged over {:g} minutes'.format(result['minutes'])
+                if result['minutes'] else 'in {} scans'.format(result['scans']))
+        print('cpu {:6g}% memory {:5g}% {:24} {:5d} actions on {:4d} users, '
+              'after {} (median) {} (max): {}'.format(
+                  result['cpu_threshold'], result['memory_threshold'], rule,
+                  result['actions'], result['users'],
+                  format_seconds(result['delay_median']),
+                  format_seconds(result['delay_max']),
+                  ', '.join('{} {}'.format(user, count)
+                            for user, count in result['top_users'])))
+
+
+if __name__ == '__main__':
+    main()
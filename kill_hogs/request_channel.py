@@ -0,0 +1,222 @@
+"""
+Let users ask for a scan right away.
+
+In daemon mode kill hogs listens on a unix socket. request-enforcement
+connects to it, optionally sends a reason, and the daemon wakes up and
+scans. The kernel tells who connected (SO_PEERCRED), so every request is
+logged with the uid and pid of the requester. A user can ask at most once
+per --request_interval seconds, and all requests that come in before the
+next scan are handled by that one scan.
+
+Without a daemon, request-enforcement falls back to the flag file that the
+next run from cron with --request_only looks for. Anyone can make that file
+in /tmp, without a name and as often as they like, so while the socket is
+listening the flag file is removed and ignored.
+"""
+
+from collections import namedtuple
+from pathlib import Path
+import argparse
+import logging
+import os
+import pwd
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+REQUEST_SOCKET = '/run/kill_hogs/request.sock'
+FLAG_FILE = '/tmp/kill_hogs_flagfile'
+# pid, uid, gid of the peer of a unix socket.
+UCRED = struct.Struct('3i')
+MAX_REASON = 200
+
+Request = namedtuple('Request', ['time', 'uid', 'pid', 'username', 'reason'])
+
+
+def peer_credentials(sock: socket.socket):
+    """
+    Returns:
+        tuple: (pid, uid, gid) of the process at the other end of <sock>.
+    """
+    return UCRED.unpack(sock.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, UCRED.size))
+
+
+def username_of(uid: int):
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+class Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.request.settimeout(1)
+        pid, uid, _ = peer_credentials(self.request)
+        try:
+            data = self.request.recv(MAX_REASON)
+        except OSError:
+            data = b''
+        reason = ''.join(c for c in data.decode('utf-8', 'replace')
+                         if c.isprintable()).strip()
+        accepted = self.server.channel.submit(uid, pid, reason)
+        reply = 'ok' if accepted else 'too many requests, try again later'
+        try:
+            self.request.sendall(reply.encode() + b'\n')
+        except OSError:
+            pass
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class RequestChannel:
+    """
+    Collects requests for a scan from a unix socket at <path>.
+
+    Args:
+        path (str): where to make the socket, writable for everyone.
+        interval (float): seconds a user has to wait between requests.
+        wake (callable): called once a request was accepted, e.g.
+            Daemon.wake.
+    """
+
+    def __init__(self, path: str = REQUEST_SOCKET, interval: float = 60,
+                 wake=None):
+        self.path = path
+        self.interval = interval
+        self.wake = wake
+        # uid -> time of the last accepted request.
+        self.last_request = {}
+        self.pending = []
+        self.server = None
+        self._lock = threading.Lock()
+
+    def submit(self, uid: int, pid: int, reason: str = '', now: float = None):
+        """
+        Returns:
+            bool: whether the request of <uid> was accepted.
+        """
+        now = time.monotonic() if now is None else now
+        username = username_of(uid)
+        with self._lock:
+            last = self.last_request.get(uid)
+            if uid != 0 and last is not None and now - last < self.interval:
+                logging.info('Ignoring request of {} ({}), the previous one '
+                             'was {:.0f} seconds ago.'.format(
+                                 username, uid, now - last))
+                return False
+            self.last_request[uid] = now
+            self.pending.append(Request(time.time(), uid, pid, username, reason))
+        logging.info('Enforcement requested by {} (uid {}, pid {}){}'.format(
+            username, uid, pid, ': ' + reason if reason else '.'))
+        if self.wake is not None:
+            self.wake()
+        return True
+
+    @property
+    def listening(self):
+        return self.server is not None
+
+    def take(self):
+        """
+        Returns:
+            list: the Requests since the previous call, all handled by one
+                scan.
+        """
+        with self._lock:
+            pending, self.pending = self.pending, []
+        return pending
+
+    def start(self):
+        """
+        Listen on the socket from a thread.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = Server(self.path, Handler)
+        os.chmod(self.path, 0o666)
+        self.server.channel = self
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': .1}, daemon=True,
+                                  name='kill-hogs-requests')
+        thread.start()
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.server = None
+
+
+def scan_requested(channel: RequestChannel = None, flagfile: str = FLAG_FILE):
+    """
+    Take the requests of <channel> and the flag file.
+
+    Returns:
+        bool: whether a scan was requested. The flag file only counts when
+            <channel> is not listening, for instance when run from cron.
+    """
+    requests = channel.take() if channel is not None else []
+    if requests:
+        logging.info('Scanning as requested by {}.'.format(
+            ', '.join(sorted({request.username for request in requests}))))
+    flagged = False
+    try:
+        os.remove(flagfile)
+        flagged = True
+    except FileNotFoundError:
+        pass
+    if flagged and channel is not None and channel.listening:
+        logging.warning('Ignoring {}, requests go through {}.'.format(
+            flagfile, channel.path))
+        flagged = False
+    return flagged or bool(requests)
+
+
+def request_enforcement(reason: str = '', path: str = REQUEST_SOCKET,
+                        flagfile: str = FLAG_FILE, timeout: float = 5):
+    """
+    Ask the daemon for a scan, or leave the flag file for the next run from
+    cron when no daemon is listening.
+
+    Returns:
+        str: the answer of the daemon, or None if the flag file was used.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.sendall(reason.encode()[:MAX_REASON])
+            sock.shutdown(socket.SHUT_WR)
+            return sock.recv(256).decode().strip()
+    except OSError:
+        Path(flagfile).touch()
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ask kill hogs to deal with the processes hogging this "
+        "node now.")
+    parser.add_argument("reason", nargs='*', help="Why, for the admins.")
+    parser.add_argument("--socket", default=REQUEST_SOCKET,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    answer = request_enforcement(' '.join(args.reason), args.socket)
+    if answer is None:
+        print('Enforcement requested, it will be done within a few minutes.')
+    else:
+        print(answer)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,595 @@
+"""
+Samplers collect the per process usage kill hogs needs for one scan.
+
+A scan first calls prime(), waits for the cpu interval and then calls
+sample(), which returns a Snapshot. Without prime(), sample() only fills in
+the cumulative cpu time of every process and leaves it to the caller to
+turn that into a percentage, see accounting.py. The psutil sampler asks psutil for every
+value separately. The proc sampler reads /proc/[pid]/stat and
+/proc/[pid]/status once per process and is a lot cheaper on busy nodes.
+
+With io=True, prime() and sample() also read the io counters of every
+process in the same pass, and the snapshot gets the io rates since prime(),
+or without prime() since the previous sample(). With tree=True, sample()
+also fills in the parent, process group and session of every process, see
+proctree.py.
+
+rank() is a cheap first pass for scans with a time budget, see budget.py.
+It puts the processes in priority order, and prime() and sample() given a
+deadline stop at it, so the heaviest processes are sampled first.
+"""
+
+from array import array
+import logging
+import os
+import psutil
+import pwd
+import time
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+MIB = 1024 * 1024
+
+
+def io_rates(counters, previous, elapsed: float):
+    """
+    Returns:
+        tuple: MiB/s read, MiB/s written and syscalls per second from the
+            io <counters> now and <previous> ones <elapsed> seconds ago,
+            see parse_io(). Zeros when either is None.
+    """
+    if counters is None or previous is None or elapsed <= 0:
+        return 0, 0, 0
+    return (max(0, counters[0] - previous[0]) / MIB / elapsed,
+            max(0, counters[1] - previous[1]) / MIB / elapsed,
+            max(0, counters[2] - previous[2]) / elapsed)
+
+
+class Snapshot:
+    """
+    Per process usage of one scan, stored column wise.
+    Entry i of every column belongs to the same process.
+    """
+
+    def __init__(self):
+        self.pids = array('i')
+        # Unsigned, uids from LDAP or SSSD can be over 2^31.
+        self.uids = array('I')
+        self.cpu_percent = array('d')
+        self.memory_percent = array('d')
+        # Cumulative user + system time in seconds. The psutil sampler
+        # only fills this in when sample() is called without prime().
+        self.cpu_times = array('d')
+        # MiB per second read from and written to storage and read and
+        # write syscalls per second. Empty unless sampled with io=True.
+        self.io_read = array('d')
+        self.io_write = array('d')
+        self.io_syscalls = array('d')
+        # The cumulative counters the io rates were computed from, see
+        # add_io().
+        self.io_counters = []
+        # Parent pid, process group and session. Empty unless sampled with
+        # tree=True.
+        self.ppids = array('i')
+        self.pgids = array('i')
+        self.sids = array('i')
+        # Processes that went away before they could be sampled.
+        self.vanished = 0
+        # Processes that were not sampled because the deadline passed.
+        self.skipped = array('i')
+
+    def __len__(self):
+        return len(self.pids)
+
+    def name(self, i: int):
+        raise NotImplementedError
+
+    def username(self, i: int):
+        raise NotImplementedError
+
+    def create_time(self, i: int):
+        raise NotImplementedError
+
+    def process(self, i: int):
+        """
+        Returns:
+            psutil.Process: a handle that can be used to signal process i.
+        """
+        raise NotImplementedError
+
+    def add_io(self, counters, previous, elapsed: float):
+        """
+        Append the io rates of the process that was just added, from its
+        <counters> now and <previous> ones <elapsed> seconds ago, both
+        (read bytes, written bytes, syscalls) or None when unknown.
+        """
+        read, write, syscalls = io_rates(counters, previous, elapsed)
+        self.io_read.append(read)
+        self.io_write.append(write)
+        self.io_syscalls.append(syscalls)
+        self.io_counters.append(counters)
+
+    def processes(self, indices):
+        """
+        Return handles for the processes at <indices>, skipping the ones
+        that have gone away in the meantime.
+        """
+        procs = []
+        for i in indices:
+            try:
+                procs.append(self.process(i))
+            except (psutil.NoSuchProcess, FileNotFoundError):
+                pass
+        return procs
+
+
+class PsutilSnapshot(Snapshot):
+    """
+    Snapshot that keeps the psutil.Process objects it was made from.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.procs = []
+
+    def name(self, i: int):
+        return self.procs[i].name()
+
+    def username(self, i: int):
+        return self.procs[i].username()
+
+    def create_time(self, i: int):
+        return self.procs[i].create_time()
+
+    def process(self, i: int):
+        return self.procs[i]
+
+
+class ProcSnapshot(Snapshot):
+    """
+    Snapshot read from /proc. Everything is read up front, so only
+    process() touches the process again.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.names = []
+        self.create_times = array('d')
+        self._usernames = {}
+
+    def name(self, i: int):
+        return self.names[i]
+
+    def username(self, i: int):
+        uid = self.uids[i]
+        if uid not in self._usernames:
+            try:
+                self._usernames[uid] = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                self._usernames[uid] = str(uid)
+        return self._usernames[uid]
+
+    def create_time(self, i: int):
+        return self.create_times[i]
+
+    def process(self, i: int):
+        """
+        Returns:
+            psutil.Process: a handle to process i, made now. Raises
+                psutil.NoSuchProcess if the pid was reused since the scan,
+                that is when the start time or the owner changed.
+        """
+        pid = self.pids[i]
+        proc = psutil.Process(pid)
+        # Start times come in clock ticks.
+        if (abs(proc.create_time() - self.create_times[i]) > 2 / CLOCK_TICKS
+                or proc.uids().real != self.uids[i]):
+            logging.info('Pid {} was reused since the scan, leaving it '
+                         'alone.'.format(pid))
+            raise psutil.NoSuchProcess(pid)
+        return proc
+
+
+def priority_order(usage: dict):
+    """
+    Args:
+        usage (dict): pid -> (resident set size, cumulative cpu time).
+
+    Returns:
+        list: the pids, taking turns the largest resident set and the
+            largest cpu time of the ones left.
+    """
+    by_memory = sorted(usage, key=lambda pid: usage[pid][0], reverse=True)
+    by_cpu = sorted(usage, key=lambda pid: usage[pid][1], reverse=True)
+    order = []
+    seen = set()
+    for pair in zip(by_memory, by_cpu):
+        for pid in pair:
+            if pid not in seen:
+                seen.add(pid)
+                order.append(pid)
+    return order
+
+
+def past(deadline: float):
+    return deadline is not None and time.monotonic() > deadline
+
+
+class PsutilSampler:
+    """
+    Sample processes with psutil. Works everywhere psutil works.
+    """
+    name = 'psutil'
+
+    def __init__(self):
+        self._procs = None
+        # pid -> io counters at prime(), or at the previous sample().
+        self._io = {}
+        self._io_at = None
+
+    def rank(self, pids=None, deadline: float = None):
+        """
+        Returns:
+            list: the pids of <pids>, or of all processes, in priority
+                order, see priority_order(). Processes without memory, such
+                as kernel threads, are left out. Processes that were not
+                looked at before <deadline> come last.
+        """
+        usage = {}
+        rest = []
+        for proc in self._processes(pids):
+            if past(deadline):
+                rest.append(proc.pid)
+                continue
+            try:
+                with proc.oneshot():
+                    rss = proc.memory_info().rss
+                    times = proc.cpu_times()
+            except (psutil.NoSuchProcess, psutil.AccessDenied, FileNotFoundError):
+                continue
+            if rss:
+                usage[proc.pid] = (rss, times.user + times.system)
+        return priority_order(usage) + rest
+
+    def prime(self, pids=None, io: bool = False, deadline: float = None):
+        """
+        Args:
+            pids (list): only sample these processes. All when None.
+            io (bool): also take the io counters.
+            deadline (float): time.monotonic() at which to stop. The
+                processes not primed by then are not sampled either.
+
+        Returns:
+            list: the pids left out because of <deadline>.
+        """
+        procs = self._processes(pids)
+        counters = {}
+        skipped = []
+        for n, proc in enumerate(procs):
+            if past(deadline):
+                skipped = [proc.pid for proc in procs[n:]]
+                del procs[n:]
+                break
+            try:
+                proc.cpu_percent()
+                if io:
+                    counters[proc.pid] = self._io_counters(proc)
+            except (psutil.NoSuchProcess, FileNotFoundError):
+                pass
+        self._procs = procs
+        if io:
+            self._io, self._io_at = counters, time.monotonic()
+        return skipped
+
+    @staticmethod
+    def _io_counters(proc):
+        try:
+            counters = proc.io_counters()
+        except psutil.AccessDenied:
+            return None
+        return (counters.read_bytes, counters.write_bytes,
+                counters.read_count + counters.write_count)
+
+    def _processes(self, pids):
+        if pids is None:
+            return list(psutil.process_iter())
+        procs = []
+        for pid in pids:
+            try:
+                procs.append(psutil.Process(pid))
+            except psutil.NoSuchProcess:
+                pass
+        return procs
+
+    def sample(self, pids=None, io: bool = False, tree: bool = False,
+               deadline: float = None):
+        """
+        Args:
+            pids (list): without prime(), only sample these processes.
+            io (bool): also sample the io rates.
+            tree (bool): also sample the parent, group and session.
+            deadline (float): time.monotonic() at which to stop, the
+                pids left are in Snapshot.skipped.
+        """
+        snapshot = PsutilSnapshot()
+        primed = self._procs is not None
+        now = time.monotonic()
+        elapsed = now - self._io_at if self._io_at is not None else 0
+        previous_io, counters = self._io, {}
+        procs = self._procs if primed else self._processes(pids)
+        for n, proc in enumerate(procs):
+            if past(deadline):
+                snapshot.skipped.extend(proc.pid for proc in procs[n:])
+                break
+            try:
+                if primed:
+                    # First call of cpu_percent() without blocking interval is meaningless.
+                    # see https://psutil.readthedocs.io/en/latest/
+                    cpu_percent = proc.cpu_percent()
+                    cpu_time = 0
+                else:
+                    cpu_percent = 0
+                    times = proc.cpu_times()
+                    cpu_time = times.user + times.system
+                memory_percent = proc.memory_percent()
+                uid = proc.uids().real
+                if io:
+                    counters[proc.pid] = self._io_counters(proc)
+                if tree:
+                    ppid = proc.ppid()
+                    pgid = os.getpgid(proc.pid)
+                    sid = os.getsid(proc.pid)
+            except (psutil.NoSuchProcess, FileNotFoundError, ProcessLookupError):
+                snapshot.vanished += 1
+                continue
+            if io:
+                snapshot.add_io(counters[proc.pid], previous_io.get(proc.pid),
+                                elapsed)
+            if tree:
+                snapshot.ppids.append(ppid)
+                snapshot.pgids.append(pgid)
+                snapshot.sids.append(sid)
+            snapshot.pids.append(proc.pid)
+            snapshot.uids.append(uid)
+            snapshot.cpu_percent.append(cpu_percent)
+            snapshot.memory_percent.append(memory_percent)
+            snapshot.cpu_times.append(cpu_time)
+            snapshot.procs.append(proc)
+        self._procs = None
+        if io:
+            self._io, self._io_at = counters, now
+        return snapshot
+
+
+def parse_stat(data: bytes):
+    """
+    Parse the contents of /proc/[pid]/stat.
+
+    The command name can contain spaces and parentheses, so it is
+    everything between the first '(' and the last ')'.
+
+    Returns:
+        tuple: (name, fields) where fields[0] is the state (field 3 in proc(5)).
+    """
+    start = data.index(b'(')
+    end = data.rindex(b')')
+    name = data[start + 1:end].decode('utf-8', 'replace')
+    return name, data[end + 2:].split()
+
+
+def parse_io(data: bytes):
+    """
+    Parse the contents of /proc/[pid]/io.
+
+    Returns:
+        tuple: (bytes read from storage, bytes written to storage, read and
+            write syscalls).
+    """
+    values = {}
+    for line in data.splitlines():
+        name, _, value = line.partition(b':')
+        values[name] = int(value)
+    return (values[b'read_bytes'], values[b'write_bytes'],
+            values[b'syscr'] + values[b'syscw'])
+
+
+def parse_real_uid(data: bytes):
+    """
+    Return the real uid from the contents of /proc/[pid]/status.
+    """
+    start = data.index(b'\nUid:') + 5
+    return int(data[start:data.index(b'\n', start)].split()[0])
+
+
+class ProcSampler:
+    """
+    Sample processes by reading /proc directly.
+
+    Args:
+        procfs (str): where proc is mounted.
+    """
+    name = 'proc'
+
+    def __init__(self, procfs: str = '/proc'):
+        self.procfs = procfs
+        self._cpu_ticks = None
+        self._primed_at = None
+        self._boot_time = None
+        # pid -> io counters at prime(), or at the previous sample().
+        self._io = {}
+        self._io_at = None
+
+    def pids(self):
+        return [int(entry) for entry in os.listdir(self.procfs) if entry.isdigit()]
+
+    def _read(self, pid: int, name: str):
+        with open('{}/{}/{}'.format(self.procfs, pid, name), 'rb') as f:
+            return f.read()
+
+    def _read_io(self, pid: int):
+        """
+        Returns:
+            tuple: the io counters of <pid>, see parse_io(), or None when
+                they can not be read. Only root can read those of every
+                process.
+        """
+        try:
+            return parse_io(self._read(pid, 'io'))
+        except (PermissionError, KeyError, ValueError):
+            return None
+
+    def total_memory(self):
+        """
+        Returns:
+            int: total memory in bytes as reported by /proc/meminfo.
+        """
+        with open(self.procfs + '/meminfo', 'rb') as f:
+            for line in f:
+                if line.startswith(b'MemTotal:'):
+                    return int(line.split()[1]) * 1024
+        raise ValueError('MemTotal not found in meminfo')
+
+    def boot_time(self):
+        if self._boot_time is None:
+            with open(self.procfs + '/stat', 'rb') as f:
+                for line in f:
+                    if line.startswith(b'btime'):
+                        self._boot_time = float(line.split()[1])
+                        break
+                else:
+                    raise ValueError('btime not found in stat')
+        return self._boot_time
+
+    def rank(self, pids=None, deadline: float = None):
+        """
+        Returns:
+            list: the pids of <pids>, or of all processes, in priority
+                order, see priority_order(), from one read of their stat.
+                Processes without memory, such as kernel threads, are left
+                out. Processes that were not read before <deadline> come
+                last.
+        """
+        pids = self.pids() if pids is None else list(pids)
+        usage = {}
+        rest = []
+        for n, pid in enumerate(pids):
+            if past(deadline):
+                rest = pids[n:]
+                break
+            try:
+                fields = parse_stat(self._read(pid, 'stat'))[1]
+            except (FileNotFoundError, ProcessLookupError, ValueError):
+                continue
+            rss = int(fields[21])
+            if rss:
+                usage[pid] = (rss, int(fields[11]) + int(fields[12]))
+        return priority_order(usage) + rest
+
+    def prime(self, pids=None, io: bool = False, deadline: float = None):
+        """
+        Args:
+            pids (list): only sample these processes. All when None.
+            io (bool): also take the io counters.
+            deadline (float): time.monotonic() at which to stop. The
+                processes not primed by then are not sampled either.
+
+        Returns:
+            list: the pids left out because of <deadline>.
+        """
+        ticks = {}
+        counters = {}
+        pids = self.pids() if pids is None else list(pids)
+        skipped = []
+        for n, pid in enumerate(pids):
+            if past(deadline):
+                skipped = pids[n:]
+                break
+            try:
+                fields = parse_stat(self._read(pid, 'stat'))[1]
+                if io:
+                    counters[pid] = self._read_io(pid)
+            except (FileNotFoundError, ProcessLookupError, ValueError):
+                continue
+            ticks[pid] = int(fields[11]) + int(fields[12])
+        self._cpu_ticks = ticks
+        self._primed_at = time.monotonic()
+        if io:
+            self._io, self._io_at = counters, self._primed_at
+        return skipped
+
+    def sample(self, pids=None, io: bool = False, tree: bool = False,
+               deadline: float = None):
+        """
+        Args:
+            pids (list): without prime(), only sample these processes.
+            io (bool): also sample the io rates.
+            tree (bool): also sample the parent, group and session.
+            deadline (float): time.monotonic() at which to stop, the
+                pids left are in Snapshot.skipped.
+        """
+        snapshot = ProcSnapshot()
+        now = time.monotonic()
+        io_elapsed = now - self._io_at if self._io_at is not None else 0
+        previous_io, counters = self._io, {}
+        if self._cpu_ticks is None:
+            first = dict.fromkeys(self.pids() if pids is None else pids)
+            cpu_factor = 0
+        else:
+            first = self._cpu_ticks
+            elapsed = now - self._primed_at
+            cpu_factor = 100 / CLOCK_TICKS / elapsed if elapsed > 0 else 0
+        memory_factor = PAGE_SIZE * 100 / self.total_memory()
+        boot_time = self.boot_time()
+        for n, (pid, first_ticks) in enumerate(first.items()):
+            if past(deadline):
+                snapshot.skipped.extend(list(first)[n:])
+                break
+            try:
+                name, fields = parse_stat(self._read(pid, 'stat'))
+                uid = parse_real_uid(self._read(pid, 'status'))
+                if io:
+                    counters[pid] = self._read_io(pid)
+            except (FileNotFoundError, ProcessLookupError, ValueError):
+                snapshot.vanished += 1
+                continue
+            if io:
+                snapshot.add_io(counters[pid], previous_io.get(pid), io_elapsed)
+            if tree:
+                snapshot.ppids.append(int(fields[1]))
+                snapshot.pgids.append(int(fields[2]))
+                snapshot.sids.append(int(fields[3]))
+            ticks = int(fields[11]) + int(fields[12])
+            snapshot.pids.append(pid)
+            snapshot.uids.append(uid)
+            if first_ticks is None:
+                snapshot.cpu_percent.append(0)
+            else:
+                snapshot.cpu_percent.append(max(0, ticks - first_ticks) * cpu_factor)
+            snapshot.cpu_times.append(ticks / CLOCK_TICKS)
+            snapshot.memory_percent.append(int(fields[21]) * memory_factor)
+            snapshot.names.append(name)
+            snapshot.create_times.append(
+                boot_time + int(fields[19]) / CLOCK_TICKS)
+        self._cpu_ticks = None
+        if io:
+            self._io, self._io_at = counters, now
+        return snapshot
+
+
+SAMPLERS = {
+    'psutil': PsutilSampler,
+    'proc': ProcSampler,
+}
+
+
+def get_sampler(name: str = 'psutil', procfs: str = '/proc'):
+    """
+    Return the sampler called <name>. Falls back to psutil when /proc can
+    not be read.
+    """
+    if name == 'proc':
+        if os.path.exists(procfs + '/self/stat'):
+            return ProcSampler(procfs)
+        logging.warning('{} not available, falling back to psutil.'.format(procfs))
+        return PsutilSampler()
+    return SAMPLERS[name]()
@@ -0,0 +1,123 @@
+"""
+Find the terminals of users by reading utmp, and write messages to them.
+
+This replaces running `w -s -h` and `write` for every offender. The utmp
+file is parsed once and only parsed again when it changes.
+"""
+
+from collections import defaultdict
+import errno
+import logging
+import os
+import re
+import socket
+import struct
+import time
+
+UTMP_PATH = '/var/run/utmp'
+USER_PROCESS = 7
+
+# struct utmp of glibc on Linux, 384 bytes, the same on 32 and 64 bits.
+UTMP = struct.Struct('<hxxi32s4s32s256shhi2i4i20x')
+
+TTY_PATTERN = re.compile(r'^(pts/[0-9]+|tty[A-Za-z0-9]+)$')
+
+
+def parse_utmp(data: bytes):
+    """
+    Returns:
+        dict: user -> list of ttys the user is logged in on.
+    """
+    terminals = defaultdict(list)
+    for offset in range(0, len(data) - UTMP.size + 1, UTMP.size):
+        entry = UTMP.unpack_from(data, offset)
+        if entry[0] != USER_PROCESS:
+            continue
+        line = entry[2].split(b'\0', 1)[0].decode('utf-8', 'replace')
+        user = entry[4].split(b'\0', 1)[0].decode('utf-8', 'replace')
+        if line and line not in terminals[user]:
+            terminals[user].append(line)
+    return dict(terminals)
+
+
+def pack_utmp_entry(user: str, line: str, ut_type: int = USER_PROCESS,
+                    pid: int = 0, host: str = '', login_time: int = 0):
+    """
+    Build a utmp record. Used to make test fixtures.
+    """
+    return UTMP.pack(ut_type, pid, line.encode(), line[-4:].encode(),
+                     user.encode(), host.encode(), 0, 0, 0, login_time, 0,
+                     0, 0, 0, 0)
+
+
+class TerminalIndex:
+    """
+    user -> ttys, read from utmp and only read again when utmp changes.
+
+    Args:
+        path (str): the utmp file.
+    """
+
+    def __init__(self, path: str = UTMP_PATH):
+        self.path = path
+        self._mtime = None
+        self._terminals = {}
+        self.parses = 0
+
+    def refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._mtime, self._terminals = None, {}
+            return
+        if mtime != self._mtime:
+            with open(self.path, 'rb') as f:
+                self._terminals = parse_utmp(f.read())
+            self._mtime = mtime
+            self.parses += 1
+
+    def terminals(self, user: str):
+        """
+        Returns:
+            list: the ttys <user> is logged in on. Users are matched exactly.
+        """
+        self.refresh()
+        return list(self._terminals.get(user, []))
+
+
+def format_message(message: str, sender: str = 'root'):
+    """
+    Format <message> the way write(1) does.
+    """
+    header = 'Message from {}@{} at {} ...'.format(
+        sender, socket.gethostname(), time.strftime('%H:%M'))
+    body = '\r\n'.join([''] + [header] + message.splitlines() + ['EOF', ''])
+    return ('\r\n' + body).encode('utf-8', 'replace')
+
+
+def write_to_tty(tty: str, message: str, dev: str = '/dev'):
+    """
+    Write <message> to a terminal without blocking.
+
+    Returns:
+        bool: whether the message was written.
+    """
+    if not TTY_PATTERN.match(tty):
+        logging.warning('Not writing to unexpected terminal {}'.format(tty))
+        return False
+    try:
+        fd = os.open(os.path.join(dev, tty),
+                     os.O_WRONLY | os.O_NOCTTY | os.O_NONBLOCK)
+    except OSError as e:
+        logging.info('Unable to open terminal {}: {}'.format(tty, e))
+        return False
+    try:
+        os.write(fd, format_message(message))
+        return True
+    except OSError as e:
+        if e.errno not in (errno.EAGAIN, errno.EIO):
+            raise
+        logging.info('Unable to write to terminal {}: {}'.format(tty, e))
+        return False
+    finally:
+        os.close(fd)
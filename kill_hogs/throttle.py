@@ -0,0 +1,413 @@
+"""
+Cap hogs instead of killing them.
+
+The throttle action writes cpu.max, memory.high and io.max to the cgroup v2
+slice of a user, or moves the processes of the user into a cgroup of their
+own and limits that. The pause action stops and continues the processes of
+a user with SIGSTOP and SIGCONT, so they only run part of the time. It needs
+a thread and is only available in daemon mode. The paused processes are
+continued when kill hogs exits, and kept in a state file so the next start
+continues them should kill hogs have died while they were stopped.
+
+Once the usage of a user has been below the release thresholds for a while,
+the limits are lifted and paused processes keep running. The limits come
+from the throttle section of kill_hogs.yml:
+
+    throttle:
+      target: slice
+      cpu_percent: 100
+      memory_percent: 5
+      io_max: "8:0 rbps=10485760 wbps=10485760"
+      release_cpu_percent: 50
+      release_memory_percent: 2
+      release_after: 5
+      duty: 50
+"""
+
+import atexit
+import json
+import logging
+import os
+import psutil
+import threading
+
+CPU_PERIOD = 100000
+
+
+class Throttled:
+    """
+    A user whose processes are limited.
+    """
+    __slots__ = ['kind', 'uid', 'path', 'since', 'below_since']
+
+    def __init__(self, kind: str, uid: int, path: str, since: float,
+                 below_since: float = None):
+        self.kind = kind
+        self.uid = uid
+        self.path = path
+        self.since = since
+        self.below_since = below_since
+
+
+def write(path: str, name: str, value: str):
+    """
+    Write <value> to the cgroup file <name> in <path>.
+
+    Returns:
+        bool: whether that worked.
+    """
+    try:
+        with open(os.path.join(path, name), 'w') as f:
+            f.write(value)
+        return True
+    except OSError as e:
+        logging.warning('Unable to write {} to {}/{}: {}'.format(
+            value.strip(), path, name, e))
+        return False
+
+
+class DutyCycler(threading.Thread):
+    """
+    Stop the paused processes for <duty> of every <period> seconds.
+
+    Args:
+        state_file (str): where to keep the pids of the paused processes, or
+            None to only keep them in memory.
+    """
+
+    def __init__(self, duty: float = .5, period: float = 1,
+                 state_file: str = None):
+        super().__init__(daemon=True, name='kill-hogs-duty-cycler')
+        self.duty = duty
+        self.period = period
+        self.state_file = state_file
+        # username -> psutil.Process objects
+        self.paused = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        # The [pid, create time] pairs in the state file.
+        self._saved = []
+
+    def pause(self, username: str, procs):
+        with self._lock:
+            self.paused[username] = list(procs)
+        self.save()
+
+    def resume(self, username: str):
+        with self._lock:
+            procs = self.paused.pop(username, [])
+        signal_all(procs, 'resume')
+        self.save()
+
+    def save(self):
+        """
+        Write the paused processes to the state file, or remove it when
+        there are none.
+        """
+        if self.state_file is None:
+            return
+        with self._lock:
+            procs = [proc for procs in self.paused.values()
+                     for proc in procs]
+        state = []
+        for proc in procs:
+            try:
+                state.append([proc.pid, proc.create_time()])
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        if state == self._saved:
+            return
+        try:
+            if state:
+                tmp = self.state_file + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(state, f)
+                os.replace(tmp, self.state_file)
+            elif os.path.exists(self.state_file):
+                os.remove(self.state_file)
+            self._saved = state
+        except OSError as e:
+            logging.warning('Unable to save the paused processes to {}: '
+                            '{}'.format(self.state_file, e))
+
+    def resume_stale(self):
+        """
+        Continue the processes an earlier run left in the state file, in case
+        it died while they were stopped. Processes whose pid was reused since
+        are left alone.
+
+        Returns:
+            int: the number of processes continued.
+        """
+        if self.state_file is None:
+            return 0
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except ValueError as e:
+            logging.warning('Ignoring broken pause state file {}: {}'.format(
+                self.state_file, e))
+            state = []
+        procs = []
+        for pid, create_time in state:
+            try:
+                proc = psutil.Process(pid)
+                if abs(proc.create_time() - create_time) < 1:
+                    procs.append(proc)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        signal_all(procs, 'resume')
+        if procs:
+            logging.info('Continued {} processes paused by an earlier '
+                         'run.'.format(len(procs)))
+        try:
+            os.remove(self.state_file)
+        except OSError:
+            pass
+        return len(procs)
+
+    def run(self):
+        while not self._done.is_set():
+            with self._lock:
+                procs = [proc for procs in self.paused.values() for proc in procs]
+            if not procs:
+                self._done.wait(self.period)
+                continue
+            signal_all(procs, 'suspend')
+            self._done.wait(self.duty * self.period)
+            signal_all(procs, 'resume')
+            self._done.wait((1 - self.duty) * self.period)
+
+    def stop(self):
+        """
+        Stop cycling and let all paused processes continue.
+        """
+        self._done.set()
+        if self.is_alive():
+            self.join()
+        for username in list(self.paused):
+            self.resume(username)
+
+
+def signal_all(procs, method: str):
+    for proc in procs:
+        try:
+            getattr(proc, method)()
+        except (psutil.NoSuchProcess, psutil.AccessDenied, FileNotFoundError):
+            pass
+
+
+class Throttler:
+    """
+    Args:
+        root (str): where cgroup2 is mounted.
+        state_file (str): where to keep the throttled users between runs,
+            or None to only keep them in memory.
+        total_memory (int): bytes of memory, defaults to psutil's total.
+    """
+
+    def __init__(self, root: str = '/sys/fs/cgroup', state_file: str = None,
+                 total_memory: int = None):
+        self.root = root
+        self.state_file = state_file
+        self.total_memory = total_memory
+        self.cycler = None
+        # username -> Throttled
+        self.throttled = {}
+        self._dirty = False
+        self.configure({})
+        if state_file is not None:
+            self.load()
+
+    def configure(self, config: dict):
+        """
+        Take the limits from the throttle section of <config>.
+        """
+        throttle = config.get('throttle') or {}
+        self.target = throttle.get('target', 'slice')
+        if self.target not in ('slice', 'cgroup'):
+            raise ValueError('Unknown throttle target {}'.format(self.target))
+        self.group = throttle.get('group', 'kill_hogs.slice')
+        self.cpu_percent = float(throttle.get('cpu_percent', 100))
+        self.memory_percent = float(throttle.get('memory_percent', 0))
+        self.io_max = [line.strip() for line in
+                       throttle.get('io_max', '').splitlines() if line.strip()]
+        self.release_cpu_percent = float(throttle.get('release_cpu_percent', 50))
+        self.release_memory_percent = float(
+            throttle.get('release_memory_percent', 2))
+        self.release_after = float(throttle.get('release_after', 5)) * 60
+        self.duty = float(throttle.get('duty', 50)) / 100
+        if self.cycler is not None:
+            self.cycler.duty = self.duty
+
+    def available(self):
+        return os.path.exists(os.path.join(self.root, 'cgroup.controllers'))
+
+    def start_cycler(self, period: float = 1, state_file: str = None):
+        """
+        Make the pause action available. Needs a long running process.
+        Processes an earlier run left paused in <state_file> are continued
+        first, and the paused processes are continued at exit.
+        """
+        self.cycler = DutyCycler(self.duty, period, state_file)
+        self.cycler.resume_stale()
+        self.cycler.start()
+        atexit.register(self.close)
+
+    def apply(self, action: str, username: str, uid: int, procs, now: float):
+        """
+        Returns:
+            bool: whether the processes of <username> could be limited with
+                <action>, pause or throttle.
+        """
+        if action == 'pause':
+            return self.pause(username, uid, procs, now)
+        return self.throttle(username, uid, procs, now)
+
+    def pause(self, username: str, uid: int, procs, now: float):
+        if self.cycler is None:
+            return False
+        self.cycler.pause(username, procs)
+        if username not in self.throttled:
+            self.throttled[username] = Throttled('pause', uid, None, now)
+        return True
+
+    def throttle(self, username: str, uid: int, procs, now: float):
+        if not self.available():
+            return False
+        if self.target == 'slice':
+            path = os.path.join(self.root, 'user.slice',
+                                'user-{}.slice'.format(uid))
+            if not os.path.isdir(path):
+                return False
+        else:
+            group = os.path.join(self.root, self.group)
+            path = os.path.join(group, 'user-{}'.format(uid))
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(group, exist_ok=True)
+                    write(group, 'cgroup.subtree_control', '+cpu +memory +io')
+                    os.mkdir(path)
+                except OSError as e:
+                    logging.warning('Unable to make cgroup {}: {}'.format(path, e))
+                    return False
+            for proc in procs:
+                # The kernel takes one pid per write.
+                try:
+                    with open(os.path.join(path, 'cgroup.procs'), 'w') as f:
+                        f.write(str(proc.pid))
+                except OSError:
+                    pass
+        if not self.write_limits(path):
+            return False
+        if username not in self.throttled:
+            self.throttled[username] = Throttled('throttle', uid, path, now)
+            self._dirty = True
+        return True
+
+    def write_limits(self, path: str):
+        ok = write(path, 'cpu.max', '{} {}'.format(
+            int(self.cpu_percent * CPU_PERIOD / 100), CPU_PERIOD))
+        if self.memory_percent:
+            total_memory = self.total_memory or psutil.virtual_memory().total
+            ok &= write(path, 'memory.high',
+                        str(int(total_memory * self.memory_percent / 100)))
+        for line in self.io_max:
+            ok &= write(path, 'io.max', line)
+        return ok
+
+    def release(self, username: str):
+        """
+        Lift the limits of <username>.
+        """
+        throttled = self.throttled.pop(username)
+        self._dirty = True
+        if throttled.kind == 'pause':
+            if self.cycler is not None:
+                self.cycler.resume(username)
+            return
+        write(throttled.path, 'cpu.max', 'max {}'.format(CPU_PERIOD))
+        write(throttled.path, 'memory.high', 'max')
+        for line in self.io_max:
+            write(throttled.path, 'io.max',
+                  line.split()[0] + ' rbps=max wbps=max riops=max wiops=max')
+        if not throttled.path.endswith('.slice'):
+            try:
+                # Only works once all its processes are gone.
+                os.rmdir(throttled.path)
+            except OSError:
+                pass
+
+    def update(self, users: dict, now: float):
+        """
+        Lift the limits of the users whose usage in <users>, as returned by
+        collect_users(), has been below the release thresholds for
+        release_after seconds.
+
+        Returns:
+            list: the users that were released.
+        """
+        released = []
+        for username, throttled in list(self.throttled.items()):
+            data = users.get(username)
+            below = data is None or (
+                data['cpu_percent'] < self.release_cpu_percent
+                and data['memory_percent'] < self.release_memory_percent)
+            if not below:
+                throttled.below_since = None
+            elif throttled.below_since is None:
+                throttled.below_since = now
+            elif now - throttled.below_since >= self.release_after:
+                self.release(username)
+                released.append(username)
+                continue
+            if throttled.kind == 'throttle':
+                self._dirty = True
+        return released
+
+    def close(self):
+        """
+        Let all paused processes continue. Cgroup limits stay until usage
+        drops, also when kill hogs is restarted.
+        """
+        if self.cycler is not None:
+            self.cycler.stop()
+        for username, throttled in list(self.throttled.items()):
+            if throttled.kind == 'pause':
+                del self.throttled[username]
+
+    def load(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logging.warning('Ignoring broken throttle state file {}: {}'.format(
+                self.state_file, e))
+            return
+        self.throttled = {
+            username: Throttled('throttle', uid, path, since, below_since)
+            for username, (uid, path, since, below_since) in state.items()
+        }
+
+    def save(self):
+        if self.state_file is None or not self._dirty:
+            return
+        state = {
+            username: [throttled.uid, throttled.path, throttled.since,
+                       throttled.below_since]
+            for username, throttled in self.throttled.items()
+            if throttled.kind == 'throttle'
+        }
+        tmp = self.state_file + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_file)
+            self._dirty = False
+        except OSError as e:
+            logging.warning('Unable to save throttle state to {}: {}'.format(
+                self.state_file, e))
@@ -0,0 +1,132 @@
+"""
+The usage per user that collect_users() adds up from a scan.
+
+Every user gets a UserUsage with the totals, which can be read like the dict
+it used to be: users['p1']['cpu_percent']. Which processes belong to which
+user is kept in one array with an entry per process of the scan, instead of
+a list per user. The list of process indices of a user is only built for
+the users something is done about, in one pass for all of them.
+"""
+
+from array import array
+import heapq
+
+
+class UserUsage:
+    """
+    The totals of one user in a scan.
+    """
+    __slots__ = ['number', 'owners', 'cpu_percent', 'memory_percent',
+                 'gpu_walltime', 'gpu_memory', 'gpu_utilization', 'io_read',
+                 'io_write', 'io_syscalls', '_processes']
+
+    def __init__(self, number: int, owners):
+        self.number = number
+        self.owners = owners
+        self.cpu_percent = 0
+        self.memory_percent = 0
+        self.gpu_walltime = 0
+        self.gpu_memory = 0
+        self.gpu_utilization = 0
+        self.io_read = 0
+        self.io_write = 0
+        self.io_syscalls = 0
+        self._processes = None
+
+    @property
+    def processes(self):
+        """
+        Indices in the scan of the counted processes of this user.
+        """
+        if self._processes is None:
+            number = self.number
+            self._processes = [i for i, owner in enumerate(self.owners)
+                               if owner == number]
+        return self._processes
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key: str, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key: str):
+        return key in self.__slots__ or key == 'processes'
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
+
+class Users(dict):
+    """
+    username -> UserUsage for a scan of <size> processes.
+    """
+
+    def __init__(self, size: int):
+        super().__init__()
+        # User number per process of the scan, -1 when not counted.
+        self.owners = array('i', [-1]) * size
+        self.names = []
+
+    def add(self, username: str):
+        """
+        Returns:
+            UserUsage: of <username>, new or the one it already has.
+        """
+        usage = self.get(username)
+        if usage is None:
+            usage = UserUsage(len(self.names), self.owners)
+            self.names.append(username)
+            self[username] = usage
+        return usage
+
+    def materialize(self, usernames):
+        """
+        Build the process lists of <usernames> in one pass over the scan.
+        """
+        wanted = {}
+        for username in usernames:
+            usage = self.get(username)
+            if usage is not None and usage._processes is None:
+                usage._processes = []
+                wanted[usage.number] = usage._processes
+        if not wanted:
+            return
+        for i, owner in enumerate(self.owners):
+            processes = wanted.get(owner)
+            if processes is not None:
+                processes.append(i)
+
+    def counted(self):
+        """
+        Yield (username, index) for every counted process.
+        """
+        names = self.names
+        for i, owner in enumerate(self.owners):
+            if owner >= 0:
+                yield names[owner], i
+
+
+def counted_processes(users: dict):
+    """
+    Yield (username, index) for every counted process in <users>, a Users
+    or a plain dict of usage with process lists.
+    """
+    if isinstance(users, Users):
+        return users.counted()
+    return ((username, i) for username, data in users.items()
+            for i in data['processes'])
+
+
+def top_processes(indices, snapshot, k: int):
+    """
+    Returns:
+        list: the <k> of <indices> using the most cpu, then memory, in
+            <snapshot>.
+    """
+    return heapq.nlargest(
+        k, indices,
+        key=lambda i: (snapshot.cpu_percent[i], snapshot.memory_percent[i]))
@@ -21,5 +21,3 @@ def run_hogs_when_flagged():
     """
     pass
 
-import ipdb; ipdb.set_trace()
-
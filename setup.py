@@ -21,6 +21,7 @@ setup(
     url="http://packages.python.org/kill_hogs",
     packages=['kill_hogs', 'unittests'],
     python_requires='>=3.6',
+    extras_require={'replay': ['numpy>=1.17.0']},
     data_files=[('{}/.kill_hogs/'.format(os.environ['HOME']),
                  ['kill_hogs/kill_hogs.yml'])],
     long_description=read('README.md'),
@@ -33,6 +34,9 @@ setup(
     entry_points={
         'console_scripts': [
             'kill-hogs=kill_hogs.kill_hogs:main',
-            'request-enforcement=kill_hogs.kill_hogs:request_enforcement'
+            'request-enforcement=kill_hogs.request_channel:main',
+            'kill-hogs-history=kill_hogs.history:main',
+            'kill-hogs-replay=kill_hogs.replay:main',
+            'kill-hogs-controller=kill_hogs.fleet:main'
         ],
     })
@@ -0,0 +1,164 @@
+"""
+What the tests share: made up snapshots, procfs and cgroup trees, the usage
+of users as collect_users() returns it, and scans of kill_hogs() over a made
+up snapshot.
+"""
+
+from kill_hogs import kill_hogs
+from kill_hogs.gpu import FakeGpuSampler
+from kill_hogs.samplers import ProcSnapshot
+from unittest import mock
+import contextlib
+import os
+
+CONFIG = {'user_pattern': '^p[0-9]+', 'software_whitelist': [],
+          'terminal_warning': 'stop it'}
+# Root processes are never killed as group members, so when the tests run as
+# root the processes are started as nobody.
+USER = 'nobody' if os.getuid() == 0 else None
+
+
+def make_snapshot(processes):
+    """
+    Args:
+        processes (list): (pid, cpu seconds, create time) tuples.
+    """
+    snapshot = ProcSnapshot()
+    for pid, cpu_time, create_time in processes:
+        snapshot.pids.append(pid)
+        snapshot.uids.append(1000)
+        snapshot.cpu_percent.append(0)
+        snapshot.memory_percent.append(0)
+        snapshot.cpu_times.append(cpu_time)
+        snapshot.names.append('python')
+        snapshot.create_times.append(create_time)
+    return snapshot
+
+
+def usage(cpu_percent=0, memory_percent=0, processes=(0, ), **totals):
+    """
+    The usage of one user, with 0 for what is not in <totals>.
+    """
+    user = {'cpu_percent': cpu_percent, 'memory_percent': memory_percent,
+            'gpu_walltime': 0, 'gpu_memory': 0, 'gpu_utilization': 0,
+            'io_read': 0, 'io_write': 0, 'io_syscalls': 0,
+            'processes': list(processes)}
+    user.update(totals)
+    return user
+
+
+def write_proc(procfs, pid, name='python', uid=1000, ticks=0, rss_pages=0,
+               starttime=0):
+    """
+    Write a minimal /proc/[pid]/stat and status to <procfs>.
+    """
+    path = os.path.join(procfs, str(pid))
+    os.makedirs(path, exist_ok=True)
+    fields = ['S', '1', str(pid), str(pid), '0', '-1', '4194304', '0', '0',
+              '0', '0', str(ticks), '0', '0', '0', '20', '0', '1', '0',
+              str(starttime), '1000000', str(rss_pages)] + ['0'] * 30
+    with open(os.path.join(path, 'stat'), 'w') as f:
+        f.write('{} ({}) {}\n'.format(pid, name, ' '.join(fields)))
+    with open(os.path.join(path, 'status'), 'w') as f:
+        f.write('Name:\t{}\nUmask:\t0022\nState:\tS (sleeping)\n'
+                'Uid:\t{uid}\t{uid}\t{uid}\t{uid}\n'
+                'Gid:\t100\t100\t100\t100\n'.format(name, uid=uid))
+
+
+def write_io(procfs, pid, read_bytes=0, write_bytes=0, syscr=0, syscw=0):
+    with open(os.path.join(procfs, str(pid), 'io'), 'w') as f:
+        f.write('rchar: {}\nwchar: {}\nsyscr: {}\nsyscw: {}\n'
+                'read_bytes: {}\nwrite_bytes: {}\n'
+                'cancelled_write_bytes: 0\n'.format(
+                    read_bytes, write_bytes, syscr, syscw, read_bytes,
+                    write_bytes))
+
+
+def write_procfs(procfs, total_kb=1000000, btime=1600000000):
+    with open(os.path.join(procfs, 'meminfo'), 'w') as f:
+        f.write('MemTotal:       {} kB\nMemFree:        1000 kB\n'.format(total_kb))
+    with open(os.path.join(procfs, 'stat'), 'w') as f:
+        f.write('cpu  1 2 3 4\nbtime {}\n'.format(btime))
+
+
+def write_slice(root, uid, usage_usec=0, memory=0, scopes=None, io=None):
+    """
+    Write a user slice to a fake cgroupfs at <root>.
+
+    Args:
+        scopes (dict): name of a sub cgroup -> list of pids in it.
+        io (list): (rbytes, wbytes) per device for io.stat, none if None.
+    """
+    path = os.path.join(root, 'user.slice', 'user-{}.slice'.format(uid))
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'cpu.stat'), 'w') as f:
+        f.write('usage_usec {}\nuser_usec {}\nsystem_usec 0\n'.format(
+            usage_usec, usage_usec))
+    with open(os.path.join(path, 'memory.current'), 'w') as f:
+        f.write('{}\n'.format(memory))
+    if io is not None:
+        with open(os.path.join(path, 'io.stat'), 'w') as f:
+            for minor, (rbytes, wbytes) in enumerate(io):
+                f.write('8:{} rbytes={} wbytes={} rios=1 wios=1 dbytes=0 '
+                        'dios=0\n'.format(minor, rbytes, wbytes))
+    for scope, pids in (scopes or {}).items():
+        os.makedirs(os.path.join(path, scope), exist_ok=True)
+        with open(os.path.join(path, scope, 'cgroup.procs'), 'w') as f:
+            f.write(''.join('{}\n'.format(pid) for pid in pids))
+
+
+def user_p1(snapshot, i):
+    return 'p1'
+
+
+def user_by_uid(snapshot, i):
+    return 'p{}'.format(snapshot.uids[i])
+
+
+def index_handle(snapshot, i):
+    return i
+
+
+def pid_handle(snapshot, i):
+    return snapshot.pids[i]
+
+
+@contextlib.contextmanager
+def fake_processes(username=user_p1, process=index_handle):
+    """
+    Let the processes of made up snapshots have a username and a process
+    handle without looking them up.
+
+    Args:
+        username: function (snapshot, i) -> the username of process i.
+        process: function (snapshot, i) -> what is killed for process i.
+    """
+    with mock.patch.object(ProcSnapshot, 'username', username), \
+            mock.patch.object(ProcSnapshot, 'process', process):
+        yield
+
+
+def scan(snapshot=None, config=CONFIG, username=user_p1,
+         process=index_handle, **kwargs):
+    """
+    Run kill_hogs() once over <snapshot>, within fake_processes(), with
+    terminate() replaced. Without a gpu rule, a threshold of 10 % of memory
+    and 600 % of cpu and no waiting, unless given in <kwargs>.
+
+    Args:
+        snapshot: what the sampler returns, when no sampler is given.
+
+    Returns:
+        tuple: the scan.ScanProfile and the mocked terminate().
+    """
+    if snapshot is not None:
+        kwargs['sampler'] = mock.Mock()
+        kwargs['sampler'].sample.return_value = snapshot
+    for key, value in (('memory_threshold', 10), ('cpu_threshold', 600),
+                       ('interval', 0), ('notifier', mock.Mock()),
+                       ('gpu_sampler', FakeGpuSampler())):
+        kwargs.setdefault(key, value)
+    with fake_processes(username, process), \
+            mock.patch('kill_hogs.kill_hogs.terminate') as terminate:
+        profile = kill_hogs.kill_hogs(config=config, **kwargs)
+    return profile, terminate
@@ -0,0 +1,127 @@
+from kill_hogs.accounting import CpuAccountant
+from kill_hogs.policy import Policy
+from kill_hogs.samplers import MIB, ProcSampler
+from unittest import mock
+from unittests.helpers import (
+    make_snapshot, pid_handle, scan, write_io, write_proc, write_procfs)
+import json
+import os
+import tempfile
+import unittest
+
+
+class CpuAccountantTestCase(unittest.TestCase):
+    def test_first_scan_uses_lifetime_average(self):
+        accountant = CpuAccountant()
+        snapshot = make_snapshot([(10, 50, 900)])
+        accountant.update_processes(snapshot, now=1000)
+        self.assertAlmostEqual(snapshot.cpu_percent[0], 50)
+
+    def test_usage_since_previous_scan(self):
+        accountant = CpuAccountant()
+        accountant.update_processes(make_snapshot([(10, 50, 900)]), now=1000)
+        snapshot = make_snapshot([(10, 65, 900), (11, 1, 1009)])
+        accountant.update_processes(snapshot, now=1010)
+        self.assertAlmostEqual(snapshot.cpu_percent[0], 150)
+        self.assertAlmostEqual(snapshot.cpu_percent[1], 100)
+
+    def test_reused_pid_is_a_new_process(self):
+        accountant = CpuAccountant()
+        accountant.update_processes(make_snapshot([(10, 500, 0)]), now=1000)
+        snapshot = make_snapshot([(10, 1, 995)])
+        accountant.update_processes(snapshot, now=1005)
+        self.assertAlmostEqual(snapshot.cpu_percent[0], 10)
+
+    def test_exited_processes_are_forgotten(self):
+        accountant = CpuAccountant()
+        accountant.update_processes(make_snapshot([(10, 1, 0), (11, 1, 0)]), now=10)
+        accountant.update_processes(make_snapshot([(10, 1, 0)]), now=20)
+        self.assertEqual(list(accountant.processes), [(10, 0)])
+
+    def test_state_survives_restarts(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            state_file = os.path.join(tmp, 'state.json')
+            accountant = CpuAccountant(state_file=state_file)
+            accountant.update_processes(make_snapshot([(10, 50, 900)]), now=1000)
+            accountant.save()
+
+            accountant = CpuAccountant(state_file=state_file)
+            snapshot = make_snapshot([(10, 60, 900)])
+            accountant.update_processes(snapshot, now=1010)
+            self.assertAlmostEqual(snapshot.cpu_percent[0], 100)
+
+    def test_state_file_with_averages(self):
+        # Written when the per user averages were kept here.
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump({'windows': [60], 'updated_at': 1000,
+                       'processes': [[10, 900, 50, 1000]],
+                       'users': {'p1': [1000, [100]]}}, f)
+            f.flush()
+            accountant = CpuAccountant(state_file=f.name)
+        self.assertEqual(accountant.processes, {(10, 900): (50, 1000, None)})
+
+    def test_io_rates_survive_restarts(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            state_file = os.path.join(tmp, 'state.json')
+            for now, counters in ((1000, (0, 0, 0)),
+                                  (1010, (10 * MIB, 20 * MIB, 500))):
+                # A new sampler every run, which has nothing to compare with.
+                snapshot = make_snapshot([(10, 0, 900)])
+                snapshot.add_io(counters, None, 0)
+                accountant = CpuAccountant(state_file=state_file)
+                accountant.update_processes(snapshot, now=now)
+                accountant.save()
+        self.assertEqual((snapshot.io_read[0], snapshot.io_write[0],
+                          snapshot.io_syscalls[0]), (1, 2, 50))
+
+    def test_broken_state_file_is_ignored(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            f.write('{not json')
+            f.flush()
+            with self.assertLogs(level='WARNING'):
+                accountant = CpuAccountant(state_file=f.name)
+        self.assertEqual(accountant.processes, {})
+
+
+class IncrementalKillHogsTestCase(unittest.TestCase):
+    @mock.patch('time.sleep')
+    def test_no_sleep_and_window_is_used(self, sleep):
+        sampler = mock.Mock()
+        policy = Policy()
+        for now, cpu_time in ((1000, 0), (1010, 100)):
+            sampler.sample.return_value = make_snapshot([(10, cpu_time, 0)])
+            with mock.patch('time.time', return_value=now):
+                _, terminate = scan(
+                    sampler=sampler, policy=policy, interval=.3,
+                    cpu_accountant=CpuAccountant(), cpu_window=60)
+        self.assertFalse(sleep.called)
+        self.assertFalse(sampler.prime.called)
+        # The policy keeps the one moving average.
+        self.assertEqual(policy.rules[1].minutes, 1)
+        # 1000 % over the last 10 seconds, but not yet in the 60 s average.
+        self.assertGreater(policy.users['p1'].averages[1], 0)
+        self.assertLess(policy.users['p1'].averages[1], 600)
+        self.assertFalse(terminate.called)
+
+    def test_io_threshold_from_cron(self):
+        # Every run from cron has a new sampler and only the state file to
+        # compare with.
+        with tempfile.TemporaryDirectory() as tmp:
+            procfs = os.path.join(tmp, 'proc')
+            os.makedirs(procfs)
+            write_procfs(procfs)
+            write_proc(procfs, 10, uid=1001)
+            state_file = os.path.join(tmp, 'state.json')
+            for now, read_bytes in ((1000, 0), (1010, 500 * MIB)):
+                write_io(procfs, 10, read_bytes=read_bytes)
+                with mock.patch('time.time', return_value=now):
+                    _, terminate = scan(
+                        process=pid_handle, io_read_threshold=20,
+                        sampler=ProcSampler(procfs),
+                        cpu_accountant=CpuAccountant(state_file=state_file))
+        # 50 MiB/s between the runs.
+        self.assertEqual(terminate.call_args[0][0], [10])
+
+
+if __name__ == '__main__':
+    unittest.main()
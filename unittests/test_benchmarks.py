@@ -0,0 +1,59 @@
+from benchmarks import bench_memory, bench_scan, synthetic
+from collections import Counter
+import tempfile
+import unittest
+
+
+class SyntheticTestCase(unittest.TestCase):
+    def test_generate(self):
+        table = synthetic.generate(2000, 50, seed=1)
+        self.assertEqual(len(table), 2000)
+        self.assertEqual(len({entry.pid for entry in table}), 2000)
+        self.assertEqual(table, synthetic.generate(2000, 50, seed=1))
+        owners = Counter(entry.uid for entry in table)
+        self.assertIn(0, owners)
+        self.assertLessEqual(len(owners), 51)
+        # Some users own a lot more processes than others.
+        self.assertGreater(max(owners.values()), 5 * min(owners.values()))
+
+
+class BenchScanTestCase(unittest.TestCase):
+    def test_small_run(self):
+        results = bench_scan.run([(500, 5)], ['psutil', 'proc'], repeat=1)
+        self.assertEqual(sorted(results), ['proc 500x5', 'psutil 500x5'])
+        for metrics in results.values():
+            self.assertGreater(metrics['ms_per_1k_processes'], 0)
+            self.assertGreater(metrics['peak_bytes_per_process'], 0)
+        # Both samplers see the same usage.
+        psutil, proc = results['psutil 500x5'], results['proc 500x5']
+        self.assertGreater(psutil['killed'], 0)
+        self.assertEqual((proc['offenders'], proc['killed']),
+                         (psutil['offenders'], psutil['killed']))
+
+    def test_compare(self):
+        baseline = {'psutil 1x1': {'ms_per_1k_processes': 10,
+                                   'cpu_ms_per_1k_processes': 10,
+                                   'peak_bytes_per_process': 100}}
+        results = {'psutil 1x1': {'ms_per_1k_processes': 19,
+                                  'cpu_ms_per_1k_processes': 25,
+                                  'peak_bytes_per_process': 130},
+                   'proc 1x1': {}}
+        regressions = bench_scan.compare(results, baseline)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith(
+            'psutil 1x1 cpu_ms_per_1k_processes'))
+
+
+class BenchMemoryTestCase(unittest.TestCase):
+    def test_pss_only_of_candidates(self):
+        table = synthetic.generate(500, 5)
+        with tempfile.TemporaryDirectory() as procfs:
+            synthetic.write_procfs(procfs, table, shared=.5)
+            result = bench_memory.bench(procfs, 10, repeat=1)
+        self.assertEqual(result['processes'], 500)
+        self.assertGreater(result['candidates'], 0)
+        self.assertLess(result['candidates'], 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+from kill_hogs import budget, samplers
+from kill_hogs.budget import ScanBudget
+from kill_hogs.proc_events import PROC_EVENT_FORK, ProcessTable
+from unittest import mock
+from unittests.helpers import (
+    make_snapshot, pid_handle, scan, user_by_uid, write_proc, write_procfs)
+import tempfile
+import time
+import unittest
+
+class ScanBudgetTestCase(unittest.TestCase):
+    def test_deadlines(self):
+        clock = mock.Mock(return_value=100.0)
+        limit = ScanBudget(2, clock)
+        self.assertEqual(limit.deadline(.5), 101)
+        self.assertEqual(limit.remaining(), 2)
+        self.assertIsNone(limit.report())
+        clock.return_value = 103.0
+        self.assertTrue(limit.expired())
+        self.assertEqual(limit.remaining(), 0)
+        limit.skip(40)
+        limit.skip_user('p1')
+        self.assertEqual(limit.report(), 'Scan budget of 2 s used up, '
+                         'skipped: 40 processes; users p1')
+
+    def test_lock_memory(self):
+        libc = mock.Mock()
+        # The kernel does not know MCL_ONFAULT.
+        libc.mlockall.side_effect = [-1, 0]
+        with mock.patch('ctypes.CDLL', return_value=libc):
+            self.assertTrue(budget.lock_memory())
+        self.assertEqual([call[0][0] for call in libc.mlockall.call_args_list],
+                         [7, 3])
+        libc.mlockall.side_effect = None
+        libc.mlockall.return_value = -1
+        with mock.patch('ctypes.CDLL', return_value=libc), \
+                self.assertLogs(level='WARNING'):
+            self.assertFalse(budget.lock_memory())
+
+
+class RankTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.procfs = self.tmp.name
+        write_procfs(self.procfs)
+        # pid, cpu ticks, resident pages
+        for pid, ticks, rss in [(10, 5, 100), (11, 900, 10), (12, 0, 5000),
+                                (13, 50, 50), (14, 10000, 0)]:
+            write_proc(self.procfs, pid, ticks=ticks, rss_pages=rss)
+        self.sampler = samplers.ProcSampler(self.procfs)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_priority_order(self):
+        self.assertEqual(samplers.priority_order(
+            {1: (10, 0), 2: (0, 10), 3: (5, 5), 4: (1, 1)}), [1, 2, 3, 4])
+
+    def test_rank(self):
+        # The largest rss and cpu time take turns, the kernel thread without
+        # memory is left out.
+        self.assertEqual(self.sampler.rank(), [12, 11, 10, 13])
+        self.assertEqual(self.sampler.rank([10, 11]), [10, 11])
+
+    def test_deadline(self):
+        past = time.monotonic() - 1
+        self.assertEqual(self.sampler.rank([13, 12], deadline=past), [13, 12])
+        self.assertEqual(self.sampler.prime([12, 11, 10], deadline=past),
+                         [12, 11, 10])
+        snapshot = self.sampler.sample()
+        self.assertEqual((len(snapshot), list(snapshot.skipped)), (0, []))
+        self.sampler.prime([12, 11, 10])
+        snapshot = self.sampler.sample(deadline=past)
+        self.assertEqual((len(snapshot), list(snapshot.skipped)),
+                         (0, [12, 11, 10]))
+
+
+class BudgetedScanTestCase(unittest.TestCase):
+    def test_heaviest_user_first(self):
+        snapshot = make_snapshot([(10, 0, 0), (11, 0, 0), (12, 0, 0)])
+        snapshot.memory_percent[0] = 30
+        snapshot.uids[1] = 1001
+        snapshot.memory_percent[1] = 50
+        snapshot.skipped.extend(range(20, 25))
+        sampler = mock.Mock()
+        sampler.rank.return_value = [11, 10, 12]
+        sampler.prime.return_value = []
+        sampler.sample.return_value = snapshot
+        with mock.patch.object(ScanBudget, 'expired',
+                               side_effect=[False, True]), \
+                self.assertLogs(level='WARNING') as logs:
+            profile, terminate = scan(
+                username=user_by_uid, process=pid_handle, sampler=sampler,
+                budget=10)
+        self.assertEqual(sampler.prime.call_args[0][0], [11, 10, 12])
+        self.assertIsNotNone(sampler.sample.call_args[1]['deadline'])
+        self.assertEqual(terminate.call_args[0][0], [11])
+        self.assertLessEqual(terminate.call_args[1]['timeout'], 10)
+        self.assertEqual(profile.counts['skipped'], 5)
+        self.assertEqual(profile.counts['skipped_users'], 1)
+        self.assertIn('skipped: 5 processes; users p1000', logs.output[-1])
+
+    def scan_until(self, table, reached):
+        """
+        Scan with <table>, running out of time after <reached> processes.
+        """
+        sampler = mock.Mock()
+        sampler.rank.side_effect = lambda pids, deadline: sorted(
+            range(1000, 1300) if pids is None else pids, reverse=True)
+        sampler.prime.return_value = []
+
+        def sample(pids, **kwargs):
+            snapshot = make_snapshot([(pid, 0, 0) for pid in pids[:reached]])
+            snapshot.skipped.extend(pids[reached:])
+            return snapshot
+        sampler.sample.side_effect = sample
+        with self.assertLogs(level='WARNING'):
+            scan(sampler=sampler, budget=10, process_table=table)
+        return sampler
+
+    def test_process_table_keeps_unvisited_processes(self):
+        table = ProcessTable()
+        # A full enumeration that ran out of time still rebuilds the table.
+        sampler = self.scan_until(table, 100)
+        self.assertIsNone(sampler.rank.call_args[0][0])
+        self.assertEqual((table.stale, len(table)), (False, 300))
+        # Only known processes from then on, and the ones not reached are
+        # not taken for exited.
+        table.handle((PROC_EVENT_FORK, 1000, 1300, 1300))
+        sampler = self.scan_until(table, 50)
+        self.assertEqual(len(sampler.rank.call_args[0][0]), 301)
+        self.assertEqual((table.stale, len(table)), (False, 301))
+
+
+if __name__ == '__main__':
+    unittest.main()
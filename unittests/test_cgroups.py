@@ -0,0 +1,183 @@
+from kill_hogs import cgroups
+from kill_hogs import kill_hogs
+from kill_hogs.samplers import ProcSampler, ProcSnapshot, CLOCK_TICKS, PAGE_SIZE
+from unittest import mock
+from unittests.helpers import write_proc, write_procfs, write_slice
+import os
+import tempfile
+import unittest
+
+GiB = 1024 ** 3
+
+
+class UserSliceAccountingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        open(os.path.join(self.root, 'cgroup.controllers'), 'w').close()
+        os.makedirs(os.path.join(self.root, 'user.slice', 'user.slice-junk'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @mock.patch('time.monotonic')
+    def test_sample(self, monotonic):
+        write_slice(self.root, 1001, usage_usec=0, memory=GiB)
+        write_slice(self.root, 1002, usage_usec=5000000, memory=0)
+        accounting = cgroups.UserSliceAccounting(self.root, total_memory=4 * GiB)
+        monotonic.return_value = 10.0
+        accounting.prime()
+        write_slice(self.root, 1001, usage_usec=3000000, memory=GiB)
+        write_slice(self.root, 1003, usage_usec=9000000, memory=GiB)
+        monotonic.return_value = 12.0
+        usage = accounting.sample()
+
+        self.assertEqual(sorted(usage), [1001, 1002])
+        self.assertAlmostEqual(usage[1001].cpu_percent, 150)
+        self.assertAlmostEqual(usage[1001].memory_percent, 25)
+        self.assertAlmostEqual(usage[1002].cpu_percent, 0)
+        self.assertIsNone(usage[1001].io_read)
+
+    @mock.patch('time.monotonic')
+    def test_io(self, monotonic):
+        write_slice(self.root, 1001, io=[(0, 0), (0, 0)])
+        write_slice(self.root, 1002)
+        accounting = cgroups.UserSliceAccounting(self.root, total_memory=GiB)
+        monotonic.return_value = 10.0
+        accounting.prime(io=True)
+        write_slice(self.root, 1001, io=[(4 * 2**20, 0), (2 * 2**20, 2**20)])
+        monotonic.return_value = 12.0
+        usage = accounting.sample()
+        self.assertAlmostEqual(usage[1001].io_read, 3)
+        self.assertAlmostEqual(usage[1001].io_write, .5)
+        # Without io.stat the rates are not known.
+        self.assertIsNone(usage[1002].io_read)
+
+    @mock.patch('time.monotonic')
+    def test_over(self, monotonic):
+        write_slice(self.root, 0, memory=GiB)
+        write_slice(self.root, 1001, memory=GiB // 2, io=[(0, 0)])
+        write_slice(self.root, 1002, io=[(0, 0)])
+        write_slice(self.root, 1003, io=[(0, 0)])
+        write_slice(self.root, 1004)
+        accounting = cgroups.UserSliceAccounting(self.root, total_memory=GiB)
+
+        def over(thresholds, io=False):
+            monotonic.return_value = 10.0
+            accounting.prime(io=io)
+            write_slice(self.root, 1002, io=[(0, 20 * 2**20)])
+            monotonic.return_value = 11.0
+            uids = accounting.over(thresholds)
+            write_slice(self.root, 1002, io=[(0, 0)])
+            return sorted(uids)
+
+        thresholds = {'memory_percent': 10, 'cpu_percent': 100}
+        self.assertEqual(over(thresholds), [1001])
+        # 1004 has no io.stat, so it might be over.
+        thresholds.update(io_read=None, io_write=10)
+        self.assertEqual(over(thresholds, io=True), [1001, 1002, 1004])
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(over(dict(thresholds, io_syscalls=100), io=True),
+                             [1001, 1002, 1003, 1004])
+
+    def test_pids_include_sub_cgroups(self):
+        write_slice(self.root, 1001, scopes={
+            'session-3.scope': [10, 11],
+            'user@1001.service/app.slice': [12],
+        })
+        write_slice(self.root, 1002, scopes={'session-4.scope': [20]})
+        accounting = cgroups.UserSliceAccounting(self.root)
+        self.assertEqual(sorted(accounting.pids([1001, 4242])), [10, 11, 12])
+
+    def test_get_accounting(self):
+        self.assertIsNone(cgroups.get_accounting('processes', self.root))
+        self.assertIsInstance(
+            cgroups.get_accounting('cgroup', self.root),
+            cgroups.UserSliceAccounting)
+        with self.assertLogs(level='WARNING'):
+            self.assertIsNone(
+                cgroups.get_accounting('cgroup', self.root + '/missing'))
+
+
+class CgroupKillHogsTestCase(unittest.TestCase):
+    config = {
+        'user_pattern': '^p[0-9]+',
+        'software_whitelist': ['git'],
+        'terminal_warning': 'stop it',
+    }
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, 'cgroup')
+        self.procfs = os.path.join(self.tmp.name, 'proc')
+        os.makedirs(self.root)
+        os.makedirs(self.procfs)
+        open(os.path.join(self.root, 'cgroup.controllers'), 'w').close()
+        write_procfs(self.procfs, total_kb=4 * 1024 * 1024)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @mock.patch('kill_hogs.kill_hogs.procs_using_gpu', lambda: [])
+    @mock.patch('kill_hogs.kill_hogs.send_message_to_terminals')
+    @mock.patch('kill_hogs.kill_hogs.terminate')
+    def test_only_processes_of_hogs_are_sampled(self, terminate, _):
+        # A quarter of memory in the slice of the hog, nothing for the other.
+        write_slice(self.root, 1001, memory=GiB, scopes={'s.scope': [10]})
+        write_slice(self.root, 1002, scopes={'s.scope': [20]})
+        write_proc(self.procfs, 10, uid=1001, rss_pages=GiB // PAGE_SIZE)
+        write_proc(self.procfs, 20, uid=1002, ticks=CLOCK_TICKS)
+
+        sampler = ProcSampler(self.procfs)
+        # The pids only exist in the fake procfs.
+        with mock.patch.object(sampler, 'prime', wraps=sampler.prime) as prime, \
+                mock.patch.object(ProcSnapshot, 'process',
+                                  lambda self, i: self.pids[i]), \
+                mock.patch('kill_hogs.samplers.pwd.getpwuid') as getpwuid:
+            getpwuid.return_value.pw_name = 'p1001'
+            kill_hogs.kill_hogs(
+                config=self.config, memory_threshold=10, cpu_threshold=600,
+                interval=0, sampler=sampler,
+                accounting=cgroups.UserSliceAccounting(self.root, 4 * GiB))
+        prime.assert_called_once_with([10], io=False, deadline=None)
+        self.assertEqual(terminate.call_args[0][0], [10])
+
+    @mock.patch('kill_hogs.kill_hogs.procs_using_gpu', lambda: [])
+    @mock.patch('kill_hogs.kill_hogs.terminate')
+    def test_no_processes_sampled_when_nobody_is_over(self, terminate):
+        write_slice(self.root, 1001, memory=0, scopes={'s.scope': [10]})
+        sampler = mock.Mock()
+        kill_hogs.kill_hogs(
+            config=self.config, memory_threshold=10, cpu_threshold=600,
+            interval=0, sampler=sampler,
+            accounting=cgroups.UserSliceAccounting(self.root, GiB))
+        self.assertFalse(sampler.prime.called)
+        self.assertFalse(terminate.called)
+
+    @mock.patch('kill_hogs.kill_hogs.procs_using_gpu', lambda: [])
+    @mock.patch('kill_hogs.kill_hogs.terminate')
+    def test_io_hogs_are_sampled(self, terminate):
+        write_slice(self.root, 1001, scopes={'s.scope': [10]}, io=[(0, 0)])
+        write_slice(self.root, 1002, scopes={'s.scope': [20]}, io=[(0, 0)])
+        accounting = cgroups.UserSliceAccounting(self.root, GiB)
+        prime = accounting.prime
+
+        def prime_and_write(**kwargs):
+            prime(**kwargs)
+            write_slice(self.root, 1001, io=[(2**30, 0)])
+
+        write_proc(self.procfs, 10, uid=1001)
+        write_proc(self.procfs, 20, uid=1002)
+        sampler = ProcSampler(self.procfs)
+        with mock.patch.object(accounting, 'prime', prime_and_write), \
+                mock.patch.object(sampler, 'prime', wraps=sampler.prime) as \
+                sampler_prime:
+            kill_hogs.kill_hogs(
+                config=self.config, memory_threshold=10, cpu_threshold=600,
+                io_read_threshold=100, interval=.1, sampler=sampler,
+                accounting=accounting)
+        sampler_prime.assert_called_once_with([10], io=True, deadline=None)
+
+
+if __name__ == '__main__':
+    unittest.main()
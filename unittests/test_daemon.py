@@ -0,0 +1,70 @@
+from kill_hogs.daemon import Daemon
+import os
+import signal
+import unittest
+
+
+class DaemonTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loads = 0
+        self.scanned = []
+
+    def load_config(self):
+        self.loads += 1
+        return {'version': self.loads}
+
+    def scan(self, config):
+        self.scanned.append(config['version'])
+
+    def test_config_is_loaded_once(self):
+        daemon = Daemon(self.scan, self.load_config, period=0)
+        daemon.run(max_cycles=3)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.scanned, [1, 1, 1])
+
+    def test_reload_on_sighup(self):
+        daemon = Daemon(self.scan, self.load_config, period=0)
+        old_handlers = {
+            s: signal.getsignal(s)
+            for s in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT)
+        }
+        try:
+            daemon.install_signal_handlers()
+            daemon.run(max_cycles=1)
+            os.kill(os.getpid(), signal.SIGHUP)
+            daemon.run(max_cycles=2)
+        finally:
+            for s, handler in old_handlers.items():
+                signal.signal(s, handler)
+        self.assertEqual(self.scanned, [1, 2])
+
+    def test_broken_config_keeps_old_one(self):
+        daemon = Daemon(self.scan, self.load_config, period=0)
+        daemon.run(max_cycles=1)
+        daemon.load_config = lambda: {}['missing']
+        daemon.request_reload()
+        daemon.run(max_cycles=2)
+        self.assertEqual(self.scanned, [1, 1])
+
+    def test_stop(self):
+        def scan(config):
+            self.scan(config)
+            daemon.stop()
+
+        daemon = Daemon(scan, self.load_config, period=60)
+        daemon.run()
+        self.assertEqual(self.scanned, [1])
+
+    def test_failing_scan_does_not_stop_daemon(self):
+        def scan(config):
+            self.scan(config)
+            raise RuntimeError('boom')
+
+        daemon = Daemon(scan, self.load_config, period=0)
+        with self.assertLogs(level='ERROR'):
+            daemon.run(max_cycles=2)
+        self.assertEqual(self.scanned, [1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
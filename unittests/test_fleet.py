@@ -0,0 +1,146 @@
+from kill_hogs import fleet
+from kill_hogs.fleet import Controller, FleetAgent, make_server
+from kill_hogs.policy import Policy
+from unittest import mock
+from unittests.helpers import make_snapshot, scan, usage
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+def local_policy(cpu_threshold=600):
+    policy = Policy()
+    policy.configure({}, 10, cpu_threshold, 0)
+    return policy
+
+
+class FleetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.address = 'unix:' + os.path.join(self.tmp.name, 'controller.sock')
+        self.controller = Controller(local_policy(), period=0)
+        self.start()
+        self.agents = []
+
+    def start(self):
+        self.server = make_server(self.address, self.controller)
+        thread = threading.Thread(target=self.server.serve_forever, args=(.05,),
+                                  daemon=True)
+        thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def tearDown(self):
+        for agent in self.agents:
+            agent.close()
+        self.stop()
+        self.tmp.cleanup()
+
+    def agent(self, node, address=None):
+        agent = FleetAgent(address or self.address, node, timeout=2,
+                           fallback=local_policy())
+        self.agents.append(agent)
+        return agent
+
+    def test_usage_adds_up_over_nodes(self):
+        self.controller.period = 10
+        agents = [self.agent('node{}'.format(i)) for i in range(3)]
+        # 250 % on every node, 750 % in total.
+        for agent in agents[:2]:
+            self.assertEqual(agent.evaluate(
+                {'p1': usage(250), 'p2': usage(10)}, 0), {})
+        self.controller.evaluated_at = -10
+        decisions = agents[2].evaluate({'p1': usage(250), 'p2': usage(10)}, 0)
+        self.assertEqual(list(decisions), ['p1'])
+        action, reasons = decisions['p1']
+        self.assertEqual(action, 'kill')
+        self.assertIn('cpu', reasons[0].describe())
+        # The others get the decision of that evaluation with their next scan.
+        for agent in agents[:2]:
+            self.assertEqual(list(agent.evaluate({'p1': usage(250)}, 1)), ['p1'])
+            self.assertEqual(agent.evaluate({'p1': usage(250)}, 2), {})
+
+    def test_decisions_only_for_users_on_the_node(self):
+        self.agent('node0').evaluate({'p1': usage(400)}, 0)
+        self.assertEqual(self.agent('node1').evaluate(
+            {'p1': usage(400), 'p2': usage(5)}, 0), {'p1': ('kill', mock.ANY)})
+        self.assertEqual(self.agent('node2').evaluate({'p2': usage(5)}, 0), {})
+
+    def test_floor(self):
+        agent = self.agent('node0')
+        self.assertEqual(agent.lowest_threshold('cpu_percent', 600), 0)
+        agent.evaluate({}, 0)
+        self.assertEqual(agent.lowest_threshold('cpu_percent', 600), 600)
+        self.agent('node1').evaluate({}, 0)
+        agent.evaluate({}, 0)
+        self.assertEqual(agent.lowest_threshold('cpu_percent', 600), 300)
+
+    def test_stale_nodes_are_forgotten(self):
+        self.controller.stale_after = 60
+        self.controller.report('node0', {'p1': usage(400)}, now=0)
+        self.assertEqual(self.controller.report(
+            'node1', {'p1': usage(400)}, now=100), {})
+        self.assertEqual(list(self.controller.nodes), ['node1'])
+
+    def test_tcp(self):
+        server = make_server('127.0.0.1:0', self.controller)
+        threading.Thread(target=server.serve_forever, args=(.05,),
+                         daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        host, port = server.server_address
+        agent = self.agent('node0', '{}:{}'.format(host, port))
+        self.assertEqual(list(agent.evaluate({'p1': usage(700)}, 0)), ['p1'])
+
+    def test_reconnect_and_fallback(self):
+        agent = self.agent('node0')
+        agent.evaluate({}, 0)
+        self.stop()
+        # As when the controller exits.
+        agent._sock.shutdown(socket.SHUT_RDWR)
+        # Locally only over 600 % is too much.
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(agent.evaluate({'p1': usage(400)}, 0), {})
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(list(agent.evaluate({'p1': usage(700)}, 0)), ['p1'])
+        self.controller.policy = local_policy(300)
+        self.start()
+        self.assertEqual(list(agent.evaluate({'p1': usage(400)}, 0)), ['p1'])
+
+    def test_gpu_thresholds_of_the_controller(self):
+        config_file = os.path.join(self.tmp.name, 'kill_hogs.yml')
+        with open(config_file, 'w') as f:
+            f.write("user_pattern: '^p[0-9]+'\n")
+        argv = ['kill-hogs-controller', '--config_file', config_file,
+                '--listen', self.address + '.main',
+                '--gpu_memory_threshold', '4000', '--gpu_util_threshold', '50']
+        with mock.patch('sys.argv', argv), \
+                mock.patch('kill_hogs.fleet.make_server') as make_server, \
+                self.assertLogs(level='INFO'):
+            fleet.main()
+        self.controller = make_server.call_args[0][1]
+        self.assertTrue(self.controller.policy.uses_gpu())
+        self.controller.period = 0
+        # 3000 MiB of gpu memory on each of two nodes.
+        self.stop()
+        self.start()
+        self.agent('node0').evaluate({'p1': usage(gpu_memory=3000)}, 0)
+        decisions = self.agent('node1').evaluate(
+            {'p1': usage(gpu_memory=3000)}, 0)
+        self.assertEqual(list(decisions), ['p1'])
+        self.assertIn('gpu_memory', decisions['p1'][1][0].describe())
+
+    def test_kill_hogs_with_agent(self):
+        # Two agents on one machine, each with a user at 400 % of cpu.
+        self.agent('node0').evaluate({'p1': usage(400)}, 0)
+        snapshot = make_snapshot([(10, 0, 0)])
+        snapshot.cpu_percent[0] = 400
+        _, terminate = scan(snapshot, policy=self.agent('node1'))
+        terminate.assert_called_once_with([0], process_tree=None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+from collections import namedtuple
+from kill_hogs import gpu
+from kill_hogs.gpu import (
+    FakeGpuSampler, GpuUsage, NvidiaSmiSampler, NvmlSampler, get_gpu_sampler,
+    parse_compute_apps)
+from unittest import mock
+from unittests.helpers import CONFIG, make_snapshot, scan, user_by_uid
+import subprocess
+import time
+import unittest
+
+Proc = namedtuple('Proc', ['pid', 'usedGpuMemory'])
+Sample = namedtuple('Sample', ['pid', 'timeStamp', 'smUtil', 'memUtil'])
+
+
+class FakeNvml:
+    """
+    The part of pynvml the nvml sampler uses, with two gpus.
+    """
+
+    class NVMLError(Exception):
+        pass
+
+    def __init__(self):
+        self.processes = {0: [Proc(10, 2 * gpu.MiB), Proc(11, None)],
+                          1: [Proc(10, 1 * gpu.MiB)]}
+        self.samples = {0: [Sample(10, 100, 30, 0), Sample(10, 200, 60, 0),
+                            Sample(11, 150, 20, 0)],
+                        1: []}
+        self.asked_since = []
+
+    def nvmlInit(self):
+        pass
+
+    def nvmlDeviceGetCount(self):
+        return 2
+
+    def nvmlDeviceGetHandleByIndex(self, i):
+        return i
+
+    def nvmlDeviceGetComputeRunningProcesses(self, handle):
+        return self.processes[handle]
+
+    def nvmlDeviceGetProcessUtilization(self, handle, since):
+        self.asked_since.append((handle, since))
+        samples = [s for s in self.samples[handle] if s.timeStamp > since]
+        if not samples:
+            raise self.NVMLError('Not Found')
+        return samples
+
+
+class NvmlSamplerTestCase(unittest.TestCase):
+    def test_sample(self):
+        nvml = FakeNvml()
+        with mock.patch.object(gpu, 'pynvml', nvml):
+            sampler = NvmlSampler()
+            usage = sampler.sample()
+            # Memory adds up over gpus, the latest utilisation sample counts.
+            self.assertEqual(usage, {10: GpuUsage(3, 60), 11: GpuUsage(0, 20)})
+            usage = sampler.sample()
+        self.assertEqual(usage, {10: GpuUsage(3, 0), 11: GpuUsage(0, 0)})
+        self.assertEqual(nvml.asked_since[-2:], [(0, 200), (1, 0)])
+
+    def test_without_pynvml(self):
+        with mock.patch.object(gpu, 'pynvml', None):
+            with self.assertRaises(RuntimeError):
+                NvmlSampler()
+            self.assertIsInstance(get_gpu_sampler('auto'), NvidiaSmiSampler)
+            with self.assertLogs(level='WARNING'):
+                self.assertIsInstance(get_gpu_sampler('nvml'), NvidiaSmiSampler)
+
+
+class NvidiaSmiTestCase(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(
+            parse_compute_apps('1234, 500\n1234, 100\n99, [N/A]\n42\n\n'),
+            {1234: GpuUsage(600, 0), 99: GpuUsage(0, 0), 42: GpuUsage(0, 0)})
+
+    def test_no_nvidia_smi(self):
+        with mock.patch('subprocess.run', side_effect=FileNotFoundError):
+            self.assertEqual(NvidiaSmiSampler().sample(), {})
+        failed = subprocess.CompletedProcess([], 9, b'', b'No devices')
+        with mock.patch('subprocess.run', return_value=failed):
+            self.assertEqual(NvidiaSmiSampler().sample(), {})
+
+
+class KillHogsGpuTestCase(unittest.TestCase):
+    def scan(self, gpu_sampler, config=CONFIG, **thresholds):
+        # Idle on the cpu, but both use a gpu, the second since just now.
+        snapshot = make_snapshot([(10, 0, 0), (11, 0, time.time())])
+        snapshot.uids[1] = 1001
+        _, terminate = scan(snapshot, config, username=user_by_uid,
+                            gpu_max_walltime=0, gpu_sampler=gpu_sampler,
+                            **thresholds)
+        return terminate.call_args[0][0] if terminate.called else []
+
+    def test_gpu_thresholds(self):
+        gpu_sampler = FakeGpuSampler({10: GpuUsage(8000, 90),
+                                      11: GpuUsage(1000, 10)})
+        self.assertEqual(self.scan(gpu_sampler, gpu_memory_threshold=4000), [0])
+        self.assertEqual(self.scan(gpu_sampler, gpu_util_threshold=5), [0, 1])
+
+    def test_walltime_rule_without_threshold(self):
+        gpu_sampler = FakeGpuSampler({10: GpuUsage(100, 1),
+                                      11: GpuUsage(100, 1)})
+        config = dict(CONFIG, policy={
+            'rules': [{'metric': 'gpu', 'threshold': 60}]})
+        self.assertEqual(self.scan(gpu_sampler, config), [0])
+
+    def test_gpus_are_only_asked_when_needed(self):
+        gpu_sampler = mock.Mock()
+        self.scan(gpu_sampler)
+        self.assertFalse(gpu_sampler.sample.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+from kill_hogs.history import (
+    HistoryStore, parse_duration, summarize_processes, summarize_users)
+from unittest import mock
+from unittests.helpers import make_snapshot, scan, usage
+import os
+import tempfile
+import time
+import unittest
+
+
+class HistoryStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'history.bin')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_survives_restarts(self):
+        store = HistoryStore(self.path, capacity=10)
+        store.append(100, [('p1', 0, 50, 1, 0)])
+        store.close()
+        store = HistoryStore(self.path, capacity=1000)
+        self.assertEqual(store.capacity, 10)
+        store.append(200, [('p2', 0, 60, 2, 3)])
+        self.assertEqual(
+            [(r.time, r.user, r.cpu_percent) for r in store.records()],
+            [(100, 'p1', 50), (200, 'p2', 60)])
+
+    def test_ring_keeps_the_newest_records(self):
+        store = HistoryStore(self.path, capacity=5)
+        size = os.path.getsize(self.path)
+        for now in range(8):
+            store.append(now, [('p1', 0, now, 0, 0)])
+        self.assertEqual(len(store), 5)
+        self.assertEqual([r.time for r in store.records()], [3, 4, 5, 6, 7])
+        self.assertEqual([r.time for r in store.records(since=4, until=7)],
+                         [4, 5, 6])
+        self.assertEqual(os.path.getsize(self.path), size)
+
+    def test_readonly(self):
+        HistoryStore(self.path).append(1, [('p1', 0, 1, 1, 0)])
+        store = HistoryStore(self.path, readonly=True)
+        self.assertEqual(len(list(store.records())), 1)
+        with self.assertRaises(TypeError):
+            store.append(2, [('p1', 0, 1, 1, 0)])
+
+    def test_not_a_history_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 100)
+        with self.assertRaises(ValueError):
+            HistoryStore(self.path)
+
+    def test_record_scan(self):
+        store = HistoryStore(self.path, top_processes=1)
+        snapshot = make_snapshot([(10, 0, 0), (11, 0, 0), (12, 0, 0)])
+        snapshot.cpu_percent[1] = 300
+        store.record(100, {'p1': usage(100, 5, [0]),
+                           'p2': usage(350, 1, [1, 2])}, snapshot)
+        records = list(store.records())
+        self.assertEqual([(r.user, r.pid, r.cpu_percent) for r in records],
+                         [('', 0, 450), ('p1', 0, 100), ('p2', 0, 350),
+                          ('p2', 11, 300)])
+
+    def test_append_is_cheap(self):
+        store = HistoryStore(self.path, capacity=100000, top_processes=5)
+        users = {'p{}'.format(u): usage(u, u / 100) for u in range(200)}
+        start = time.perf_counter()
+        for now in range(100):
+            store.record(now, users)
+        self.assertLess((time.perf_counter() - start) / 100, .001)
+
+
+class SummarizeTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = HistoryStore(os.path.join(tmp.name, 'history'))
+        snapshot = make_snapshot([(10, 0, 0), (20, 0, 0)])
+        snapshot.cpu_percent[0] = 400
+        self.store.top_processes = 2
+        self.store.record(1, {'p1': usage(400, 10, [0]),
+                              'p2': usage(100, 20, [1])}, snapshot)
+        self.store.record(2, {'p2': usage(500, 20, [1])}, snapshot)
+        self.store.record(3, {}, snapshot)
+        self.store.record(4, {'p3': usage(0, 1, gpu_walltime=90)})
+
+    def test_users(self):
+        rows = summarize_users(self.store.records(), top=2)
+        self.assertEqual([row['user'] for row in rows], ['p2', 'p1'])
+        # Scans where a user was not counted count as no usage.
+        self.assertEqual(rows[0]['cpu_mean'], 150)
+        self.assertEqual(rows[0]['cpu_max'], 500)
+        self.assertEqual(rows[0]['scans'], 2)
+        self.assertEqual(rows[1]['cpu_mean'], 100)
+        self.assertEqual(
+            summarize_users(self.store.records(), 'gpu', top=1)[0]['user'], 'p3')
+        self.assertEqual(
+            [row['user'] for row in summarize_users(self.store.records(since=2))],
+            ['p2', 'p3'])
+
+    def test_processes(self):
+        rows = summarize_processes(self.store.records())
+        self.assertEqual([(row['pid'], row['scans']) for row in rows],
+                         [(10, 1), (20, 2)])
+        self.assertEqual(rows[0]['cpu_max'], 400)
+
+    def test_parse_duration(self):
+        self.assertEqual(parse_duration('90'), 90)
+        self.assertEqual(parse_duration('30m'), 1800)
+        self.assertEqual(parse_duration('2d'), 172800)
+        with self.assertRaises(ValueError):
+            parse_duration('1 hour')
+
+
+class KillHogsHistoryTestCase(unittest.TestCase):
+    def test_every_scan_is_recorded(self):
+        snapshot = make_snapshot([(10, 0, 0)])
+        snapshot.cpu_percent[0] = 50
+        history = mock.Mock()
+        profile, _ = scan(snapshot, history=history)
+        now, users, recorded = history.record.call_args[0]
+        self.assertEqual(users['p1']['cpu_percent'], 50)
+        self.assertIs(recorded, snapshot)
+        self.assertIn('history', profile.timings)
+
+
+if __name__ == '__main__':
+    unittest.main()
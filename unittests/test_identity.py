@@ -0,0 +1,82 @@
+from kill_hogs.identity import IdentityCache, TTLCache
+from unittest import mock
+import os
+import tempfile
+import unittest
+
+
+class TTLCacheTestCase(unittest.TestCase):
+    def test_hits_misses_and_expiry(self):
+        now = [0]
+        cache = TTLCache(10, clock=lambda: now[0])
+        compute = mock.Mock(return_value='p123456')
+        self.assertEqual(cache.get(1, compute), 'p123456')
+        self.assertEqual(cache.get(1, compute), 'p123456')
+        self.assertEqual(compute.call_count, 1)
+        now[0] = 11
+        cache.get(1, compute)
+        self.assertEqual(compute.call_count, 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_expire(self):
+        now = [0]
+        cache = TTLCache(10, clock=lambda: now[0])
+        cache.get('a', lambda: 1)
+        now[0] = 5
+        cache.get('b', lambda: 2)
+        now[0] = 12
+        cache.expire()
+        self.assertEqual([entry[0] for entry in cache.dump()], ['b'])
+
+
+class IdentityCacheTestCase(unittest.TestCase):
+    def test_username_looked_up_once_per_uid(self):
+        identity = IdentityCache()
+        lookup = mock.Mock(return_value='p123456')
+        for _ in range(100):
+            identity.username(1001, lookup)
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual(identity.stats()['usernames'],
+                         {'hits': 99, 'misses': 1, 'size': 1})
+
+    def test_email_looked_up_once_per_user(self):
+        identity = IdentityCache()
+        finger = mock.Mock(return_value=None)
+        identity.email('p123456', finger)
+        identity.email('p123456', finger)
+        finger.assert_called_once_with('p123456')
+
+    def test_is_restricted(self):
+        identity = IdentityCache()
+        pattern = '^((s|p|f)[0-9]{5,7}|umcg-[a-z]{3,10})'
+        self.assertTrue(identity.is_restricted('p857496', pattern))
+        self.assertTrue(identity.is_restricted('p857496', pattern))
+        self.assertFalse(identity.is_restricted('root', pattern))
+        # A reloaded config with another pattern is not served from cache.
+        self.assertFalse(identity.is_restricted('p857496', '^s'))
+        self.assertEqual(identity.stats()['restricted']['hits'], 1)
+
+    def test_cache_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_file = os.path.join(tmp, 'identity.json')
+            identity = IdentityCache(cache_file=cache_file)
+            identity.username(1001, lambda: 'p123456')
+            identity.email('p123456', lambda username: 'p@example.org')
+            identity.save()
+
+            identity = IdentityCache(cache_file=cache_file)
+            fail = mock.Mock(side_effect=AssertionError)
+            self.assertEqual(identity.username(1001, fail), 'p123456')
+            self.assertEqual(identity.email('p123456', fail), 'p@example.org')
+
+    def test_broken_cache_file_is_ignored(self):
+        with tempfile.NamedTemporaryFile('w') as f:
+            f.write('[]')
+            f.flush()
+            with self.assertLogs(level='WARNING'):
+                identity = IdentityCache(cache_file=f.name)
+        self.assertEqual(identity.username(1, lambda: 'x'), 'x')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 from unittest import mock
 from kill_hogs import kill_hogs
+from kill_hogs.terminals import TerminalIndex
 import mailtest
 import random
 import time
@@ -45,7 +46,8 @@ class PostToSlackTestcase(unittest.TestCase):
                 data=b'{"channel": "#kill-hogs", '
                 b'"username": "kill-hogs", "text": "Hello world", '
                 b'"icon_emoji": ":scales:"}',
-                headers={'Content-Type': 'application/json'}),
+                headers={'Content-Type': 'application/json'},
+                timeout=10),
             mock_get.call_args_list)
 
 
@@ -102,18 +104,14 @@ mail_body_request_only: |
                 self.stderr = stderr
                 self.returncode = 0
 
-        if args[0] == 'w -s -h':
-            with open('unittests/terminalsdump', 'r+b') as f:
-                data = f.read()
-
-        elif args[0] == 'finger p458749 -l -m':
+        if args[0] == 'finger p458749 -l -m':
             with open('unittests/fingerdump', 'r+b') as f:
                 data = f.read()
 
         elif 'finger' in args[0]:
             data = b'finger: mysteryguest: no such user.'
 
-        elif args[0].startswith('nvidia-smi'):
+        elif args[0][0] == 'nvidia-smi':
             data = b'123456\n123456\n'
 
         else:
@@ -178,18 +176,32 @@ mail_body_request_only: |
         """
         pass
 
-    @mock.patch('subprocess.run', side_effect=mocked_subprocess_run)
-    def test_find_terminals(self, mock_run):
-        terminals = kill_hogs.find_terminals_of_user('p945314')
-        self.assertEqual(terminals, ['pts/1', 'pts/49'])
+    utmp = TerminalIndex('unittests/utmpdump')
 
-    @mock.patch('subprocess.run', side_effect=mocked_subprocess_run)
-    def test_send_message_to_terminals(self, mock_run):
-        kill_hogs.send_message_to_terminals('p945314', 'hello, user')
-        self.assertEqual(mock_run.call_count, 3)
-        self.assertIn(
-            mock.call('echo "hello, user" | write p945314 pts/49', shell=True),
-            mock_run.call_args_list)
+    def test_find_terminals(self):
+        terminals = kill_hogs.find_terminals_of_user('p945314', self.utmp)
+        self.assertEqual(terminals, ['pts/1', 'pts/49'])
+        # No substring matches.
+        self.assertEqual(
+            kill_hogs.find_terminals_of_user('p9453141', self.utmp), ['pts/140'])
+        self.assertEqual(kill_hogs.find_terminals_of_user('p94531', self.utmp), [])
+
+    @mock.patch('kill_hogs.kill_hogs.write_to_tty')
+    def test_send_message_to_terminals(self, mock_write):
+        kill_hogs.send_message_to_terminals('p945314', 'hello, user', self.utmp)
+        self.assertEqual(mock_write.call_count, 2)
+        self.assertIn(mock.call('pts/49', 'hello, user'), mock_write.call_args_list)
+
+    @mock.patch('kill_hogs.kill_hogs.write_to_tty')
+    def test_failed_terminals_are_returned(self, mock_write):
+        mock_write.side_effect = [True, OSError('broken'), True]
+        with self.assertLogs(level='WARNING'):
+            failed = kill_hogs.send_message_to_terminals(
+                'p945314', 'hello, user', self.utmp)
+        self.assertEqual(failed, ['pts/49'])
+        self.assertEqual(kill_hogs.send_message_to_terminals(
+            'p945314', 'hello, user', terminals=failed), [])
+        self.assertEqual(mock_write.call_args, mock.call('pts/49', 'hello, user'))
 
     @mock.patch('subprocess.run', side_effect=mocked_subprocess_run)
     @mock.patch('kill_hogs.kill_hogs.terminate', side_effect=mocked_terminate)
@@ -211,6 +223,25 @@ mail_body_request_only: |
             gpu_max_walltime=60)
         self.assertTrue(mock_terminate.called)
 
+    @mock.patch('subprocess.run', side_effect=mocked_subprocess_run)
+    @mock.patch('kill_hogs.kill_hogs.terminate', side_effect=mocked_terminate)
+    @mock.patch('psutil.process_iter', side_effect=mocked_psutil_process_iter)
+    def test_scan_profile(self, mock_run, mock_terminate, mock_process_iter):
+        profile = kill_hogs.kill_hogs(
+            config=self.config_dict, memory_threshold=10, cpu_threshold=9.5,
+            gpu_max_walltime=60, interval=0)
+        self.assertEqual(profile.counts['scanned'], 13)
+        # The mocked root process has uid 1, so it is only unrestricted.
+        self.assertEqual(profile.counts['whitelisted'], 1)
+        self.assertEqual(profile.counts['unrestricted'], 2)
+        self.assertEqual(profile.counts['counted'], 10)
+        self.assertEqual(profile.counts['offenders'], 10)
+        for phase in ('prime', 'gpu', 'sleep', 'sample', 'aggregate',
+                      'usernames', 'report', 'terminate', 'notify', 'total'):
+            self.assertIn(phase, profile.timings)
+        self.assertLessEqual(profile.timings['usernames'],
+                             profile.timings['aggregate'])
+
     def test_is_restricted(self):
         self.assertTrue(kill_hogs.is_restricted('p857496'))
         self.assertTrue(kill_hogs.is_restricted('s4579985'))
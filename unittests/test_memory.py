@@ -0,0 +1,113 @@
+from benchmarks import synthetic
+from kill_hogs.memory import (
+    SharedMemoryAccounting, get_memory_accounting, parse_smaps_rollup)
+from kill_hogs.usage import Users
+from unittest import mock
+from unittests.helpers import make_snapshot, scan, user_by_uid
+import os
+import tempfile
+import unittest
+
+# 1 GiB
+TOTAL_KB = 1024 * 1024
+
+
+def write_smaps_rollup(procfs, pid, rss_kb, pss_kb):
+    os.makedirs(os.path.join(procfs, str(pid)), exist_ok=True)
+    with open(os.path.join(procfs, str(pid), 'smaps_rollup'), 'w') as f:
+        f.write(synthetic.SMAPS_ROLLUP.format(
+            rss=rss_kb, pss=pss_kb, shared=rss_kb - pss_kb,
+            private_clean=1, private_dirty=pss_kb - 1))
+
+
+class ParseTestCase(unittest.TestCase):
+    def test_parse_smaps_rollup(self):
+        data = (b'00400000-7fff0000 ---p 00000000 00:00 0    [rollup]\n'
+                b'Rss:                1504 kB\n'
+                b'Pss:                 517 kB\n'
+                b'Pss_Anon:            264 kB\n'
+                b'Private_Clean:        12 kB\n'
+                b'Private_Dirty:       260 kB\n'
+                b'SwapPss:               5 kB\n')
+        self.assertEqual(parse_smaps_rollup(data), 517 * 1024)
+        self.assertEqual(parse_smaps_rollup(
+            data, (b'Private_Clean:', b'Private_Dirty:')), 272 * 1024)
+        with self.assertRaises(ValueError):
+            parse_smaps_rollup(b'Rss: 1 kB\n')
+
+    def test_this_process(self):
+        if not os.path.exists('/proc/self/smaps_rollup'):
+            self.skipTest('No smaps_rollup')
+        accounting = get_memory_accounting('pss')
+        self.assertGreater(accounting.read(os.getpid()), 0)
+        self.assertIsNone(get_memory_accounting('rss'))
+
+
+class SharedMemoryAccountingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.procfs = self.tmp.name
+        with open(os.path.join(self.procfs, 'meminfo'), 'w') as f:
+            f.write('MemTotal:       {} kB\n'.format(TOTAL_KB))
+        # p1000 runs 4 workers that share most of their 200 MiB rss, p1001
+        # one process with 100 MiB of its own.
+        self.snapshot = make_snapshot([(10 + i, 0, 0) for i in range(6)])
+        for i in range(4):
+            self.snapshot.memory_percent[i] = 200 / 1024 * 100
+            write_smaps_rollup(self.procfs, 10 + i, 200 * 1024, 50 * 1024)
+        self.snapshot.uids[4] = 1001
+        self.snapshot.memory_percent[4] = 100 / 1024 * 100
+        write_smaps_rollup(self.procfs, 14, 100 * 1024, 100 * 1024)
+        # Vanished before its smaps_rollup was read.
+        self.snapshot.memory_percent[5] = 1
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def users(self):
+        users = Users(len(self.snapshot))
+        for i in range(len(self.snapshot)):
+            user = users.add('p{}'.format(self.snapshot.uids[i]))
+            user.memory_percent += self.snapshot.memory_percent[i]
+            users.owners[i] = user.number
+        return users
+
+    def test_only_users_over_the_threshold_are_read(self):
+        users = self.users()
+        accounting = SharedMemoryAccounting('pss', self.procfs)
+        with mock.patch.object(accounting, 'read', wraps=accounting.read) as read:
+            self.assertEqual(accounting.refine(users, self.snapshot, 10), 4)
+        self.assertEqual(sorted(call[0][0] for call in read.call_args_list),
+                         [10, 11, 12, 13, 15])
+        self.assertAlmostEqual(users['p1000']['memory_percent'],
+                               4 * 50 / 1024 * 100 + 1)
+        self.assertAlmostEqual(self.snapshot.memory_percent[0], 50 / 1024 * 100)
+        self.assertEqual(self.snapshot.memory_percent[5], 1)
+        # Below the threshold by rss, so not read at all.
+        self.assertAlmostEqual(users['p1001']['memory_percent'], 100 / 1024 * 100)
+        self.assertEqual(accounting.refine(users, self.snapshot, 100), 0)
+
+    def test_uss(self):
+        users = self.users()
+        SharedMemoryAccounting('uss', self.procfs).refine(users, self.snapshot, 0)
+        self.assertAlmostEqual(users['p1001']['memory_percent'],
+                               100 / 1024 * 100)
+
+    def scan(self, accounting):
+        return scan(self.snapshot, username=user_by_uid, memory_threshold=30,
+                    memory_accounting=accounting)
+
+    def test_rss_kills_for_shared_pages(self):
+        with self.assertLogs(level='INFO'):
+            _, terminate = self.scan(None)
+        self.assertEqual(sorted(terminate.call_args[0][0]), [0, 1, 2, 3, 5])
+
+    def test_pss_does_not(self):
+        profile, terminate = self.scan(
+            SharedMemoryAccounting('pss', self.procfs))
+        terminate.assert_not_called()
+        self.assertEqual(profile.counts['pss'], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
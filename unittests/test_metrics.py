@@ -0,0 +1,120 @@
+from kill_hogs.metrics import Metrics, serve
+from kill_hogs.policy import Rule
+from kill_hogs.profiler import ScanProfile
+from unittests.helpers import make_snapshot, scan, usage
+import os
+import tempfile
+import unittest
+import urllib.request
+
+
+def samples(text):
+    """
+    Returns:
+        dict: 'name{labels}' -> value of the samples in <text>.
+    """
+    result = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            result[name] = float(value)
+    return result
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_top_users(self):
+        metrics = Metrics(top=2)
+        metrics.update_users({'p1': usage(300, 1), 'p2': usage(200, 50),
+                              'p3': usage(100, 2), 'p4': usage(50, 3)})
+        text = samples(metrics.render())
+        self.assertEqual(text['kill_hogs_users'], 4)
+        cpu = {key for key in text if key.startswith('kill_hogs_user_cpu')}
+        self.assertEqual(cpu, {'kill_hogs_user_cpu_percent{user="p1"}',
+                               'kill_hogs_user_cpu_percent{user="p2"}'})
+        self.assertEqual(text['kill_hogs_user_memory_percent{user="p4"}'], 3)
+        # Users that fall out of the top lose their gauges.
+        metrics.update_users({'p3': usage(100, 2)})
+        text = samples(metrics.render())
+        self.assertNotIn('kill_hogs_user_cpu_percent{user="p1"}', text)
+        self.assertEqual(text['kill_hogs_user_cpu_percent{user="p3"}'], 100)
+        self.assertNotIn('kill_hogs_user_gpu_memory_mib{user="p3"}', text)
+
+    def test_actions_and_scans(self):
+        metrics = Metrics(max_users=1)
+        rule = Rule('cpu', 600)
+        metrics.action('p1', 'kill', [rule])
+        metrics.action('p1', 'kill', [rule])
+        metrics.action('p2', 'warn', [rule])
+        profile = ScanProfile()
+        profile.add_time('sample', .2)
+        profile.add_time('total', .3)
+        profile.count('scanned', 10)
+        metrics.scan_done(profile)
+        text = samples(metrics.render())
+        self.assertEqual(text['kill_hogs_actions_total{user="p1",action="kill",'
+                              'reason="cpu_percent"}'], 2)
+        self.assertEqual(text['kill_hogs_actions_total{user="_other",'
+                              'action="warn",reason="cpu_percent"}'], 1)
+        self.assertEqual(text['kill_hogs_scan_processes{state="scanned"}'], 10)
+        self.assertEqual(text['kill_hogs_scan_duration_seconds_bucket{le="0.25"}'], 0)
+        self.assertEqual(text['kill_hogs_scan_duration_seconds_bucket{le="0.5"}'], 1)
+        self.assertEqual(text['kill_hogs_scan_duration_seconds_count'], 1)
+        self.assertEqual(
+            text['kill_hogs_scan_phase_seconds_sum{phase="sample"}'], .2)
+
+    def test_textfile(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'kill_hogs.prom')
+            metrics = Metrics()
+            metrics.action('p"1', 'kill', [Rule('memory', 10)])
+            metrics.scan_done(ScanProfile())
+            metrics.write_textfile(path)
+            self.assertEqual(os.listdir(tmp), ['kill_hogs.prom'])
+            # The next run from cron counts on.
+            metrics = Metrics()
+            metrics.load_textfile(path)
+            metrics.action('p"1', 'kill', [Rule('memory', 10)])
+            text = samples(metrics.render())
+        self.assertEqual(text['kill_hogs_actions_total{user="p\\"1",'
+                              'action="kill",reason="memory_percent"}'], 2)
+        self.assertEqual(text['kill_hogs_scans_total'], 1)
+
+    def test_http(self):
+        metrics = Metrics()
+        metrics.update_users({'p1': usage(300)})
+        server = serve(metrics, '127.0.0.1:0')
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://127.0.0.1:{}/metrics'.format(server.server_address[1])
+        with urllib.request.urlopen(url) as response:
+            self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+            text = samples(response.read().decode())
+        self.assertEqual(text['kill_hogs_user_cpu_percent{user="p1"}'], 300)
+
+    def scan(self, metrics, **kwargs):
+        snapshot = make_snapshot([(10, 0, 0)])
+        snapshot.cpu_percent[0] = 700
+        profile, _ = scan(snapshot, metrics=metrics, **kwargs)
+        return profile
+
+    def test_kill_hogs(self):
+        metrics = Metrics()
+        self.scan(metrics)
+        text = samples(metrics.render())
+        self.assertEqual(text['kill_hogs_user_cpu_percent{user="p1"}'], 700)
+        self.assertEqual(text['kill_hogs_actions_total{user="p1",action="kill",'
+                              'reason="cpu_percent"}'], 1)
+        self.assertEqual(text['kill_hogs_scans_total'], 1)
+
+    def test_dry_run_is_not_counted(self):
+        metrics = Metrics()
+        profile = self.scan(metrics, dummy=True)
+        text = samples(metrics.render())
+        self.assertFalse([name for name in text
+                          if name.startswith('kill_hogs_actions_total')])
+        self.assertEqual(profile.counts['offenders'], 1)
+        self.assertNotIn('kill', profile.counts)
+
+
+if __name__ == '__main__':
+    unittest.main()
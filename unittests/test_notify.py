@@ -0,0 +1,128 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from kill_hogs import kill_hogs
+from kill_hogs.notify import Notifier, retry
+from unittest import mock
+from unittests.helpers import fake_processes, make_snapshot
+import mailtest
+import threading
+import unittest
+
+
+class SlackStandIn(BaseHTTPRequestHandler):
+    """
+    Answers posts with the next status in <statuses> and records them.
+    """
+    statuses = []
+    posts = []
+
+    def do_POST(self):
+        self.posts.append(self.rfile.read(int(self.headers['Content-Length'])))
+        status = self.statuses.pop(0) if self.statuses else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class NotifierTestCase(unittest.TestCase):
+    def setUp(self):
+        SlackStandIn.statuses = []
+        SlackStandIn.posts = []
+        self.server = HTTPServer(('127.0.0.1', 0), SlackStandIn)
+        self.url = 'http://127.0.0.1:{}/hook'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def notifier(self, **kwargs):
+        return Notifier(kwargs.pop('write_terminals',
+                                   mock.Mock(return_value=[])),
+                        kill_hogs.post_to_slack, mail_port=1025,
+                        retry_delay=0, **kwargs)
+
+    def test_everything_is_delivered(self):
+        terminals = mock.Mock(return_value=[])
+        notifier = self.notifier(write_terminals=terminals)
+        for user in ('p1', 'p2', 'p3'):
+            notifier.terminal(user, 'stop it')
+            notifier.slack('{} was killed'.format(user), self.url)
+            notifier.mail('root@cluster', '{}@example.org'.format(user), 'bye')
+        with mailtest.Server() as mt:
+            delivered = notifier.flush()
+            self.assertEqual(len(mt.emails), 3)
+        self.assertEqual(delivered, {'terminals': 3, 'slack': 3, 'mail': 3})
+        self.assertEqual(len(SlackStandIn.posts), 3)
+        self.assertEqual(terminals.call_count, 3)
+        self.assertEqual(len(notifier), 0)
+
+    def test_slack_server_errors_are_retried(self):
+        SlackStandIn.statuses = [502, 503]
+        notifier = self.notifier(retries=2)
+        notifier.slack('hello', self.url)
+        self.assertEqual(notifier.flush()['slack'], 1)
+        self.assertEqual(len(SlackStandIn.posts), 3)
+
+    def test_retries_are_bounded(self):
+        SlackStandIn.statuses = [500] * 10
+        notifier = self.notifier(retries=1)
+        notifier.slack('hello', self.url)
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(notifier.flush()['slack'], 0)
+        self.assertEqual(len(SlackStandIn.posts), 2)
+
+    def test_only_failed_terminals_are_retried(self):
+        terminals = mock.Mock(side_effect=[['pts/2'], ['pts/2'], []])
+        notifier = self.notifier(write_terminals=terminals, retries=2)
+        notifier.terminal('p1', 'stop it')
+        self.assertEqual(notifier.flush()['terminals'], 1)
+        self.assertEqual(terminals.call_args_list, [
+            mock.call('p1', 'stop it'),
+            mock.call('p1', 'stop it', terminals=['pts/2']),
+            mock.call('p1', 'stop it', terminals=['pts/2'])])
+
+    def test_unreachable_mail_server(self):
+        notifier = Notifier(mail_port=1, retries=1, retry_delay=0)
+        notifier.mail('root@cluster', 'p1@example.org', 'bye')
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(notifier.flush()['mail'], 0)
+
+    def test_retry(self):
+        func = mock.Mock(side_effect=[IOError, IOError, 'done'])
+        self.assertEqual(retry(func, 2, delay=0), 'done')
+        func = mock.Mock(side_effect=IOError)
+        with self.assertRaises(IOError):
+            retry(func, 2, delay=0)
+        self.assertEqual(func.call_count, 3)
+
+
+class KillFirstTestCase(unittest.TestCase):
+    config = {'user_pattern': '^p[0-9]+', 'software_whitelist': [],
+              'terminal_warning': 'stop it', 'slack_url': 'http://localhost'}
+
+    def test_processes_are_killed_before_notifying(self):
+        snapshot = make_snapshot([(10, 0, 0)])
+        snapshot.cpu_percent[0] = 1000
+        sampler = mock.Mock()
+        sampler.sample.return_value = snapshot
+        events = []
+        notifier = mock.Mock()
+        notifier.flush.side_effect = lambda: events.append('flush')
+        with mock.patch('kill_hogs.kill_hogs.terminate',
+                        lambda procs, **kwargs: events.append('terminate')), \
+                fake_processes():
+            kill_hogs.kill_hogs(config=self.config, memory_threshold=10,
+                                cpu_threshold=600, interval=0, slack=True,
+                                sampler=sampler, notifier=notifier)
+        self.assertEqual(events, ['terminate', 'flush'])
+        notifier.terminal.assert_called_once_with('p1', 'stop it')
+
+
+if __name__ == '__main__':
+    unittest.main()
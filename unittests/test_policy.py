@@ -0,0 +1,188 @@
+from kill_hogs.policy import Policy, Rule
+from unittest import mock
+from unittests.helpers import make_snapshot, scan, usage
+import os
+import tempfile
+import yaml
+import unittest
+
+POLICY = """
+policy:
+  actions: [warn, renice, kill]
+  strike_interval: 1
+  forgive_after: 10
+  rules:
+    - metric: cpu_percent
+      threshold: 300
+      scans: 3
+    - metric: cpu
+      threshold: 200
+      minutes: 10
+    - metric: memory_percent
+      threshold: 10
+      actions: [kill]
+"""
+
+
+class PolicyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = yaml.load(POLICY, Loader=yaml.BaseLoader)
+        self.policy = Policy()
+        self.policy.configure(self.config, 10, 600, 0)
+
+    def evaluate(self, now, **users):
+        return {username: action for username, (action, rules)
+                in self.policy.evaluate(users, now).items()}
+
+    def test_without_rules_users_are_killed_right_away(self):
+        policy = Policy()
+        policy.configure({}, memory_threshold=10, cpu_threshold=600,
+                         gpu_max_walltime=60)
+        decisions = policy.evaluate(
+            {'p1': usage(700), 'p2': usage(100), 'p3': usage(0, 11)}, 0)
+        self.assertEqual(sorted(decisions), ['p1', 'p3'])
+        self.assertEqual(decisions['p1'][0], 'kill')
+        self.assertFalse(policy.stateful)
+        # Nothing to remember.
+        policy.evaluate({}, 5)
+        self.assertEqual(policy.users, {})
+
+    def test_consecutive_scans(self):
+        self.assertEqual(self.evaluate(0, p1=usage(400)), {})
+        self.assertEqual(self.evaluate(5, p1=usage(400)), {})
+        # A scan below the threshold starts the count over.
+        self.assertEqual(self.evaluate(10, p1=usage(100)), {})
+        self.assertEqual(self.evaluate(15, p1=usage(400)), {})
+        self.assertEqual(self.evaluate(20, p1=usage(400)), {})
+        self.assertEqual(self.evaluate(25, p1=usage(400)), {'p1': 'warn'})
+
+    def test_moving_average(self):
+        self.policy.configure(
+            {'policy': {'rules': [{'metric': 'cpu_percent', 'threshold': '200',
+                                   'minutes': '10', 'actions': ['kill']}]}},
+            10, 600, 0)
+        self.evaluate(0)
+        # A minute long spike does not lift the 10 minute average over 200.
+        for now in range(60, 180, 60):
+            self.assertEqual(self.evaluate(now, p1=usage(1000)), {})
+        for now in range(180, 600, 60):
+            self.evaluate(now)
+        decisions = {}
+        for now in range(600, 2400, 60):
+            decisions = self.evaluate(now, p1=usage(300))
+            if decisions:
+                break
+        self.assertEqual(decisions, {'p1': 'kill'})
+        self.assertGreater(now, 1000)
+
+    def test_escalation(self):
+        actions = []
+        for now in range(0, 300, 5):
+            actions.append(self.evaluate(now, p1=usage(400)).get('p1'))
+        # The first strike after 3 scans, then one strike per minute.
+        self.assertEqual(actions[:3], [None, None, 'warn'])
+        self.assertEqual(actions[3:14], [None] * 11)
+        self.assertEqual(actions[14], 'renice')
+        self.assertEqual(actions[15:26], ['renice'] * 11)
+        self.assertEqual(actions[26:], ['kill'] * (len(actions) - 26))
+
+    def test_memory_is_killed_right_away(self):
+        self.assertEqual(self.evaluate(0, p1=usage(0, 20)), {'p1': 'kill'})
+
+    def test_forgive(self):
+        for now in range(0, 15, 5):
+            self.evaluate(now, p1=usage(400))
+        self.assertEqual(self.policy.users['p1'].strikes, 1)
+        self.evaluate(300)
+        self.assertEqual(self.policy.users['p1'].strikes, 1)
+        self.evaluate(700)
+        self.assertEqual(self.policy.users['p1'].strikes, 0)
+        for now in range(800, 815, 5):
+            decisions = self.evaluate(now, p1=usage(400))
+        self.assertEqual(decisions, {'p1': 'warn'})
+
+    def test_reload(self):
+        for now in range(0, 15, 5):
+            self.evaluate(now, p1=usage(400))
+        self.policy.configure(self.config, 10, 600, 0)
+        self.assertIn('p1', self.policy.users)
+        self.config['policy']['rules'][0]['threshold'] = '350'
+        self.policy.configure(self.config, 10, 600, 0)
+        self.assertEqual(self.policy.users, {})
+
+    def test_state_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'policy.json')
+            policy = Policy(path)
+            policy.configure(self.config, 10, 600, 0)
+            for now in range(0, 15, 5):
+                policy.evaluate({'p1': usage(400)}, now)
+            policy.save()
+
+            policy = Policy(path)
+            policy.configure(self.config, 10, 600, 0)
+            self.assertEqual(policy.users['p1'].strikes, 1)
+            self.assertEqual(list(policy.users['p1'].over), [3, 3, 0])
+            decisions = policy.evaluate({'p1': usage(400)}, 75)
+            self.assertEqual(decisions['p1'][0], 'renice')
+
+    def test_lowest_threshold(self):
+        self.assertEqual(self.policy.lowest_threshold('cpu_percent', 600), 200)
+        self.assertEqual(self.policy.lowest_threshold('gpu_walltime', 60), 60)
+
+    def test_uses_io(self):
+        self.assertFalse(self.policy.uses_io())
+        policy = Policy()
+        policy.configure({}, 10, 600, 0, io_write_threshold=100)
+        self.assertTrue(policy.uses_io())
+        decisions = policy.evaluate({'p1': usage(io_write=150)}, 0)
+        self.assertEqual([rule.describe() for rule in decisions['p1'][1]],
+                         ['io_write > 100'])
+
+    def test_unknown_action(self):
+        with self.assertRaises(ValueError):
+            Rule('cpu_percent', 100, actions=['shoot'])
+
+
+class KillHogsPolicyTestCase(unittest.TestCase):
+    config = {'user_pattern': '^p[0-9]+', 'software_whitelist': [],
+              'terminal_warning': 'killed',
+              'policy': {'actions': ['warn', 'renice', 'kill'],
+                         'rules': [{'metric': 'cpu_percent',
+                                    'threshold': '100'}]}}
+
+    def test_actions(self):
+        policy = Policy()
+        notifier = mock.Mock()
+        for expected in ['warn', 'renice', 'kill']:
+            snapshot = make_snapshot([(10, 0, 0)])
+            snapshot.cpu_percent[0] = 200
+            with mock.patch('kill_hogs.kill_hogs.renice') as renice:
+                profile, terminate = scan(snapshot, self.config,
+                                          notifier=notifier, policy=policy)
+            self.assertEqual(profile.counts[expected], 1)
+            self.assertEqual(renice.called, expected == 'renice')
+            self.assertEqual(terminate.called, expected == 'kill')
+        self.assertEqual(
+            [call[0][1] for call in notifier.terminal.call_args_list],
+            [policy.warning, policy.warning, 'killed'])
+
+
+    def test_io_hog(self):
+        # An rsync waiting on the disk most of the time.
+        snapshot = make_snapshot([(10, 0, 0), (11, 0, 0)])
+        for column in (snapshot.io_read, snapshot.io_syscalls):
+            column.extend([0, 0])
+        snapshot.io_write.extend([300, 0])
+        sampler = mock.Mock()
+        sampler.sample.return_value = snapshot
+        with self.assertLogs(level='INFO') as logs:
+            _, terminate = scan(sampler=sampler, io_write_threshold=200)
+        sampler.prime.assert_called_once_with(None, io=True, deadline=None)
+        self.assertIn('300.0 MiB/s written', logs.output[0])
+        # The idle process is not counted.
+        self.assertEqual(terminate.call_args[0][0], [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+from kill_hogs.daemon import Daemon
+from kill_hogs.pressure import (
+    AdaptiveScheduler, PressureMonitor, PressureTrigger, parse_pressure,
+    parse_thresholds)
+from unittest import mock
+import os
+import select
+import tempfile
+import threading
+import unittest
+
+LINE = '{} avg10={:.2f} avg60=0.00 avg300=0.00 total=0\n'
+
+
+def write_pressure(root, resource, some=0., full=0.):
+    with open(os.path.join(root, resource), 'w') as f:
+        f.write(LINE.format('some', some) + LINE.format('full', full))
+
+
+class ParseTestCase(unittest.TestCase):
+    def test_parse_pressure(self):
+        pressure = parse_pressure(
+            'some avg10=1.50 avg60=0.25 avg300=0.00 total=1234\n'
+            'full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n')
+        self.assertEqual(pressure['some'],
+                         {'avg10': 1.5, 'avg60': .25, 'avg300': 0, 'total': 1234})
+        self.assertEqual(pressure['full']['avg10'], 0)
+
+    def test_parse_thresholds(self):
+        self.assertEqual(parse_thresholds('cpu=40, memory.full=5'),
+                         {('cpu', 'some'): 40, ('memory', 'full'): 5})
+        with self.assertRaises(ValueError):
+            parse_thresholds('disk=5')
+
+
+class PressureTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        for resource in ('cpu', 'memory', 'io'):
+            write_pressure(self.root, resource)
+        self.monitor = PressureMonitor(self.root, parse_thresholds(
+            'cpu=40,memory=10,memory.full=5,io=40'))
+
+    def tearDown(self):
+        self.monitor.close()
+        self.tmp.cleanup()
+
+    def test_monitor(self):
+        self.assertTrue(self.monitor.available())
+        self.assertEqual(self.monitor.over(self.monitor.sample()), [])
+        # The open files are read again on every sample.
+        write_pressure(self.root, 'memory', some=20, full=6)
+        pressure = self.monitor.sample()
+        self.assertEqual(pressure[('memory', 'some')], 20)
+        self.assertEqual(self.monitor.over(pressure),
+                         [('memory', 'some'), ('memory', 'full')])
+
+    def test_scan_only_when_needed(self):
+        scheduler = AdaptiveScheduler(self.monitor, period=5, fast_period=1,
+                                      max_idle=60)
+        self.assertTrue(scheduler.due(0))
+        scheduler.scanned(0)
+        self.assertFalse(scheduler.due(5))
+        self.assertEqual(scheduler.interval(), 5)
+        self.assertTrue(scheduler.due(60))
+        scheduler.scanned(60)
+        write_pressure(self.root, 'cpu', some=80)
+        self.assertTrue(scheduler.due(61))
+        self.assertEqual(scheduler.interval(), 1)
+
+    def test_unreadable_pressure_scans(self):
+        scheduler = AdaptiveScheduler(self.monitor, max_idle=60)
+        scheduler.scanned(0)
+        self.monitor.root = os.path.join(self.root, 'missing')
+        self.monitor.close()
+        with self.assertLogs(level='WARNING'):
+            self.assertTrue(scheduler.due(1))
+
+    def test_trigger_wakes(self):
+        read, write = os.pipe()
+        self.addCleanup(os.close, write)
+        trigger = mock.Mock()
+        trigger.fileno.return_value = read
+        trigger.close.side_effect = lambda: os.close(read)
+        scheduler = AdaptiveScheduler(self.monitor, max_idle=60,
+                                      triggers=[trigger])
+        self.addCleanup(scheduler.close)
+        scheduler._poll = mock.Mock()
+        scheduler._poll.poll.return_value = [(3, select.POLLPRI)]
+        scheduler.scanned(0)
+        with self.assertLogs(level='INFO'):
+            scheduler.wait(10, threading.Event())
+        self.assertTrue(scheduler.due(1))
+        scheduler.scanned(1)
+        self.assertFalse(scheduler.due(2))
+
+    def test_daemon(self):
+        scanned = []
+        scheduler = AdaptiveScheduler(self.monitor, period=0, fast_period=0,
+                                      max_idle=60)
+        daemon = Daemon(scanned.append, lambda: {}, scheduler=scheduler)
+        daemon.run(max_cycles=3)
+        self.assertEqual((len(scanned), daemon.skipped), (1, 2))
+        write_pressure(self.root, 'io', some=50)
+        daemon.run(max_cycles=5)
+        self.assertEqual((len(scanned), daemon.skipped), (3, 2))
+
+    def test_real_trigger(self):
+        if not os.path.exists('/proc/pressure/memory'):
+            self.skipTest('No pressure stall information')
+        try:
+            trigger = PressureTrigger('memory.some=150000/2000000')
+        except OSError as e:
+            self.skipTest('Unable to set a trigger: {}'.format(e))
+        self.addCleanup(trigger.close)
+        scheduler = AdaptiveScheduler(self.monitor, triggers=[trigger])
+        # Nothing stalls here, so this times out.
+        scheduler.wait(.1, threading.Event())
+        self.assertFalse(scheduler.triggered)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+from kill_hogs import kill_hogs
+from kill_hogs import proc_events
+from kill_hogs.proc_events import (
+    PROC_EVENT_EXEC, PROC_EVENT_EXIT, PROC_EVENT_FORK, PROC_EVENT_UID,
+    ProcessTable, pack_event, parse_events)
+from unittest import mock
+from unittests.helpers import make_snapshot
+import unittest
+
+
+class ProcessTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.table = ProcessTable()
+        self.table.update_from_scan(None, [1, 100])
+
+    def test_stale_until_first_scan(self):
+        self.assertIsNone(ProcessTable().pids())
+        self.assertEqual(sorted(self.table.pids()), [1, 100])
+
+    def test_fork_exec_exit(self):
+        for event in [
+            (PROC_EVENT_FORK, 100, 101, 101),
+            (PROC_EVENT_EXEC, 101, 101),
+            (PROC_EVENT_FORK, 100, 102, 102),
+            (PROC_EVENT_EXIT, 100, 100),
+        ]:
+            self.table.handle(event)
+        self.assertEqual(sorted(self.table.pids()), [1, 101, 102])
+
+    def test_threads_are_ignored(self):
+        self.table.handle((PROC_EVENT_FORK, 100, 105, 100))
+        self.table.handle((PROC_EVENT_EXIT, 105, 100))
+        self.assertEqual(sorted(self.table.pids()), [1, 100])
+
+    def test_short_lived_processes(self):
+        # A shell loop starting and reaping thousands of processes.
+        for pid in range(1000, 6000):
+            self.table.handle((PROC_EVENT_FORK, 100, pid, pid))
+            self.table.handle((PROC_EVENT_EXEC, pid, pid))
+            if pid % 1000:
+                self.table.handle((PROC_EVENT_EXIT, pid, pid))
+        self.assertEqual(sorted(self.table.pids()),
+                         [1, 100, 1000, 2000, 3000, 4000, 5000])
+
+    def test_lost_events_force_a_full_scan(self):
+        self.table.lost_events()
+        self.assertIsNone(self.table.pids())
+        self.table.update_from_scan(None, [1, 100, 200])
+        self.assertEqual(sorted(self.table.pids()), [1, 100, 200])
+
+    def test_processes_missing_from_scan_are_dropped(self):
+        self.table.update_from_scan([1, 100], [1])
+        self.assertEqual(self.table.pids(), [1])
+
+
+class ParseEventsTestCase(unittest.TestCase):
+    def test_parse(self):
+        data = b''.join([
+            pack_event(PROC_EVENT_FORK, 100, 101, 101),
+            pack_event(PROC_EVENT_UID, 101, 101, 1000, 1000),
+            pack_event(PROC_EVENT_EXEC, 101, 101),
+            pack_event(PROC_EVENT_EXIT, 101, 101),
+        ])
+        self.assertEqual(parse_events(data), [
+            (PROC_EVENT_FORK, 100, 101, 101),
+            (PROC_EVENT_EXEC, 101, 101),
+            (PROC_EVENT_EXIT, 101, 101),
+        ])
+
+    def test_start_listener_falls_back(self):
+        with mock.patch('socket.socket', side_effect=PermissionError('no')), \
+                self.assertLogs(level='WARNING'):
+            self.assertIsNone(proc_events.start_listener(ProcessTable()))
+
+
+class KillHogsProcessTableTestCase(unittest.TestCase):
+    config = {'user_pattern': '^p[0-9]+', 'software_whitelist': []}
+
+    @mock.patch('kill_hogs.kill_hogs.procs_using_gpu', lambda: [])
+    def test_only_known_processes_are_sampled(self):
+        table = ProcessTable()
+        sampler = mock.Mock()
+        sampler.sample.return_value = make_snapshot([(1, 0, 0), (100, 0, 0)])
+        kill_hogs.kill_hogs(config=self.config, memory_threshold=10,
+                            cpu_threshold=600, interval=0, sampler=sampler,
+                            process_table=table)
+        sampler.prime.assert_called_once_with(None, io=False, deadline=None)
+
+        table.handle((PROC_EVENT_FORK, 100, 101, 101))
+        sampler.sample.return_value = make_snapshot(
+            [(1, 0, 0), (100, 0, 0), (101, 0, 0)])
+        kill_hogs.kill_hogs(config=self.config, memory_threshold=10,
+                            cpu_threshold=600, interval=0, sampler=sampler,
+                            process_table=table)
+        self.assertEqual(sorted(sampler.prime.call_args[0][0]), [1, 100, 101])
+
+
+if __name__ == '__main__':
+    unittest.main()
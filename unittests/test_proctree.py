@@ -0,0 +1,223 @@
+from kill_hogs import kill_hogs, samplers
+from kill_hogs.proctree import ProcessTree
+from kill_hogs.samplers import ProcSnapshot
+from unittest import mock
+from unittests.helpers import (
+    pid_handle, scan, user_by_uid, write_proc, write_procfs)
+import random
+import tempfile
+import unittest
+
+# pid, ppid, session, process group, uid, name, cpu %
+LOGIN_NODE = [
+    (1, 0, 1, 1, 0, 'systemd', 0),
+    (100, 1, 100, 100, 0, 'sshd', 0),
+    (200, 100, 200, 200, 1000, 'bash', 0),
+    # while true; do python work.py; done
+    (201, 200, 200, 201, 1000, 'bash', 0),
+    (202, 201, 200, 201, 1000, 'python', 300),
+    (203, 201, 200, 201, 1000, 'python', 300),
+    (204, 200, 200, 204, 0, 'sudo', 0),
+    (205, 204, 200, 204, 1000, 'less', 0),
+    (300, 1, 300, 300, 1000, 'tmux', 0),
+    (301, 300, 301, 301, 1000, 'bash', 0),
+    (302, 301, 301, 302, 1000, 'vim', 0),
+    (400, 1, 400, 400, 1001, 'bash', 0),
+]
+
+
+def tree_snapshot(processes):
+    snapshot = ProcSnapshot()
+    for pid, ppid, sid, pgid, uid, name, cpu in processes:
+        snapshot.pids.append(pid)
+        snapshot.ppids.append(ppid)
+        snapshot.sids.append(sid)
+        snapshot.pgids.append(pgid)
+        snapshot.uids.append(uid)
+        snapshot.names.append(name)
+        snapshot.cpu_percent.append(cpu)
+        snapshot.memory_percent.append(0)
+        snapshot.cpu_times.append(0)
+        snapshot.create_times.append(0)
+    return snapshot
+
+
+def random_tree(size: int, rng: random.Random):
+    """
+    <size> processes of 10 users below pid 1, each the child of a random
+    earlier process. Every 50th process starts a session.
+    """
+    processes = [(1, 0, 1, 1, 0, 'systemd', 0)]
+    sids = {1: 1}
+    for pid in range(2, size + 1):
+        ppid = rng.randrange(1, pid)
+        sid = pid if pid % 50 == 0 else sids[ppid]
+        sids[pid] = sid
+        processes.append((pid, ppid, sid, sid, 1000 + pid % 10, 'python',
+                          rng.random()))
+    return processes
+
+
+class ProcessTreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = tree_snapshot(LOGIN_NODE)
+        self.tree = ProcessTree()
+        self.tree.update(self.snapshot)
+
+    def indices(self, *pids):
+        return [self.tree.index[pid] for pid in pids]
+
+    def pids(self, indices):
+        return sorted(self.snapshot.pids[i] for i in indices)
+
+    def test_idle_parents_are_in_the_tree(self):
+        workers = self.indices(202, 203)
+        self.assertEqual(self.pids([self.tree.root(i) for i in workers]),
+                         [201, 201])
+        # Not the login shell, not the tmux session of the same user, not
+        # the process started through sudo.
+        self.assertEqual(self.pids(self.tree.expand(workers)),
+                         [201, 202, 203])
+        self.assertEqual(self.pids(self.tree.expand(self.indices(302))),
+                         [302])
+
+    def test_interactive_shell_is_left_alone(self):
+        # A busy job and an idle one in the shell of a tmux pane.
+        self.snapshot = tree_snapshot(LOGIN_NODE + [
+            (303, 301, 301, 303, 1000, 'python', 700),
+            (304, 301, 301, 304, 1000, 'make', 0),
+            (305, 304, 301, 304, 1000, 'cc', 0),
+        ])
+        self.tree.update(self.snapshot)
+        self.assertEqual(self.pids(self.tree.expand(self.indices(303))),
+                         [303])
+        self.assertEqual(self.pids(self.tree.expand(self.indices(305))),
+                         [304, 305])
+
+    def test_rollup(self):
+        workers = self.indices(202, 203)
+        self.assertEqual(self.tree.rollup(workers), {201: (3, 600, 0)})
+        self.assertEqual(self.tree.rollup(workers, by='session'),
+                         {200: (5, 600, 0)})
+        self.assertEqual(self.tree.rollup(workers, by='group'),
+                         {201: (3, 600, 0)})
+        with self.assertRaises(ValueError):
+            self.tree.rollup(workers, by='user')
+
+    def test_update_only_moves_what_changed(self):
+        self.assertEqual(self.tree.changed, len(LOGIN_NODE))
+        self.tree.update(self.snapshot)
+        self.assertEqual(self.tree.changed, 0)
+        # The shell loop exits, its worker is reparented to pid 1.
+        processes = [p for p in LOGIN_NODE if p[0] not in (201, 203)]
+        processes[3] = (202, 1, 200, 201, 1000, 'python', 300)
+        self.tree.update(tree_snapshot(processes))
+        self.assertEqual(self.tree.changed, 3)
+        self.assertNotIn(201, self.tree.children)
+        self.assertIn(202, self.tree.children[1])
+        self.assertEqual(len(self.tree), len(processes))
+
+    def test_descendants_of_killed_processes(self):
+        def handle(self, i):
+            proc = mock.Mock(pid=self.pids[i])
+            proc.uids.return_value.real = self.uids[i]
+            proc.children.return_value = []
+            return proc
+        with mock.patch.object(ProcSnapshot, 'process', handle):
+            launcher = self.snapshot.process(self.tree.index[201])
+            found = kill_hogs.descendants([launcher], self.tree)
+        # Not the login shell, nor what runs through sudo next to it.
+        self.assertEqual(sorted(proc.pid for proc in found), [202, 203])
+
+    def test_snapshot_without_tree(self):
+        snapshot = ProcSnapshot()
+        snapshot.pids.append(1)
+        with self.assertRaises(ValueError):
+            ProcessTree().update(snapshot)
+
+
+class LargeTreeTestCase(unittest.TestCase):
+    def assertSameIndex(self, tree, processes):
+        fresh = ProcessTree()
+        fresh.update(tree_snapshot(processes))
+        self.assertEqual(tree.parents, fresh.parents)
+        self.assertEqual(tree.children, fresh.children)
+
+    def test_incremental_updates(self):
+        rng = random.Random(1)
+        processes = random_tree(20000, rng)
+        tree = ProcessTree()
+        tree.update(tree_snapshot(processes))
+        self.assertEqual(tree.changed, 20000)
+        for _ in range(3):
+            # 1 % exits, 1 % is reparented and 1 % is new.
+            gone = set(rng.sample([p[0] for p in processes[1:]], 200))
+            processes = [p for p in processes if p[0] not in gone]
+            pids = [p[0] for p in processes]
+            for k in rng.sample(range(1, len(processes)), 200):
+                processes[k] = (processes[k][0], 1) + processes[k][2:]
+            new = max(pids) + 1
+            for pid in range(new, new + 200):
+                processes.append((pid, rng.choice(pids), pid, pid, 1000,
+                                  'python', 0))
+            tree.update(tree_snapshot(processes))
+            self.assertLessEqual(tree.changed, 600)
+            self.assertSameIndex(tree, processes)
+
+    def test_trees_cover_every_process_once(self):
+        processes = random_tree(20000, random.Random(2))
+        snapshot = tree_snapshot(processes)
+        tree = ProcessTree()
+        tree.update(snapshot)
+        user = [i for i in range(len(snapshot)) if snapshot.uids[i] == 1003]
+        trees = tree.trees(user)
+        covered = [i for indices in trees.values() for i in indices]
+        self.assertEqual(len(covered), len(set(covered)))
+        self.assertTrue(set(user) <= set(covered))
+        for root, indices in trees.items():
+            self.assertTrue(all(snapshot.uids[i] == 1003 for i in indices))
+            self.assertEqual(tree.root(root), root)
+
+    def test_deep_chain(self):
+        # A fork bomb of one user, without sessions in between.
+        processes = [(1, 0, 1, 1, 0, 'systemd', 0)]
+        processes += [(pid, pid - 1 if pid > 2 else 1, 2, 2, 1000, 'sh', 1)
+                      for pid in range(2, 15002)]
+        snapshot = tree_snapshot(processes)
+        tree = ProcessTree()
+        tree.update(snapshot)
+        leaf = tree.index[15001]
+        self.assertEqual(snapshot.pids[tree.root(leaf)], 2)
+        self.assertEqual(len(tree.expand([leaf])), 15000)
+        self.assertEqual(tree.rollup([leaf]), {2: (15000, 15000, 0)})
+
+
+class SampleTreeTestCase(unittest.TestCase):
+    def test_proc_sampler(self):
+        with tempfile.TemporaryDirectory() as procfs:
+            write_procfs(procfs)
+            write_proc(procfs, 10)
+            sampler = samplers.ProcSampler(procfs)
+            snapshot = sampler.sample([10], tree=True)
+            self.assertEqual(len(sampler.sample([10]).ppids), 0)
+        # See write_proc.
+        self.assertEqual((snapshot.ppids[0], snapshot.pgids[0],
+                          snapshot.sids[0]), (1, 10, 10))
+
+
+class KillTreeTestCase(unittest.TestCase):
+    def test_launcher_is_killed_too(self):
+        sampler = mock.Mock()
+        sampler.sample.return_value = tree_snapshot(LOGIN_NODE)
+        with self.assertLogs(level='INFO') as logs:
+            _, terminate = scan(
+                username=user_by_uid, process=pid_handle, sampler=sampler,
+                cpu_threshold=500, process_tree=ProcessTree())
+        self.assertTrue(sampler.sample.call_args[1]['tree'])
+        self.assertEqual(sorted(terminate.call_args[0][0]), [201, 202, 203])
+        self.assertIn('p1000 tree of pid 201 bash: 3 processes memory 0.00% '
+                      'cpu 600.00%', logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+from kill_hogs.profiler import ScanProfile, write_profile
+import json
+import os
+import tempfile
+import time
+import unittest
+
+
+class ScanProfileTestCase(unittest.TestCase):
+    def test_phases_add_up(self):
+        profile = ScanProfile()
+        for _ in range(2):
+            with profile.phase('sleep'):
+                time.sleep(.01)
+        with profile.phase('sample'):
+            pass
+        self.assertGreaterEqual(profile.timings['sleep'], .02)
+        self.assertEqual(list(profile.timings), ['sleep', 'sample'])
+
+    def test_phase_is_recorded_on_error(self):
+        profile = ScanProfile()
+        with self.assertRaises(ValueError):
+            with profile.phase('gpu'):
+                raise ValueError
+        self.assertIn('gpu', profile.timings)
+
+    def test_json_lines(self):
+        profile = ScanProfile()
+        profile.count('scanned', 10)
+        profile.count('vanished')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'profile.jsonl')
+            write_profile(profile, path)
+            write_profile(profile, path)
+            with open(path) as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['counts'], {'scanned': 10, 'vanished': 1})
+        self.assertEqual(len(lines[0]['load']), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+from kill_hogs.history import HistoryStore, SCAN
+from kill_hogs.replay import Combination, Recording, load, np, replay
+import os
+import tempfile
+import time
+import unittest
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class ReplayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = HistoryStore(os.path.join(self.tmp.name, 'history.bin'),
+                                  capacity=1000)
+        # 2 minute scans. p1 uses 800 % cpu from the 3rd to the 6th scan,
+        # p2 has a single spike and later uses 20 % memory for good.
+        for scan in range(10):
+            now = 1000 + 120 * scan
+            p1 = 800 if 2 <= scan <= 5 else 100
+            p2 = 900 if scan == 1 else 0
+            memory = 20 if scan >= 7 else 1
+            self.store.append(now, [(SCAN, 0, p1 + p2, memory, 0),
+                                    ('p1', 0, p1, 0, 0),
+                                    ('p2', 0, p2, memory, 0),
+                                    ('p2', 42, p2, memory, 0)])
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_load(self):
+        recording = load(self.store, since=1100)
+        self.assertEqual(len(recording), 9)
+        self.assertEqual(recording.users, ['p1', 'p2'])
+        self.assertEqual(recording.cpu_percent.shape, (9, 2))
+        self.assertEqual(recording.cpu_percent[0].tolist(), [100, 900])
+        self.assertEqual(recording.memory_percent[-1].tolist(), [0, 20])
+        # The views of the file are released.
+        self.store.close()
+        self.store = HistoryStore(self.store.path, readonly=True)
+
+    def test_scans_without_their_scan_record_are_dropped(self):
+        # The ring overwrote the scan record of the oldest scan, not its
+        # user records.
+        store = HistoryStore(os.path.join(self.tmp.name, 'small.bin'),
+                             capacity=4)
+        store.append(1, [(SCAN, 0, 1, 0, 0), ('p1', 0, 1, 0, 0),
+                         ('p2', 0, 1, 0, 0)])
+        store.append(2, [(SCAN, 0, 1, 0, 0), ('p1', 0, 1, 0, 0)])
+        recording = load(store)
+        store.close()
+        self.assertEqual(recording.times.tolist(), [2])
+        self.assertEqual(recording.users, ['p1'])
+
+    def test_combinations(self):
+        recording = load(self.store)
+        results = replay(recording, [
+            Combination(600, 10, 1, 0),
+            Combination(600, 10, 3, 0),
+            Combination(600, 10, 5, 0),
+            Combination(600, 10, 1, 4),
+            Combination(1000, 50, 1, 0),
+        ])
+        once, three, five, averaged, never = results
+        self.assertEqual((once['actions'], once['users']), (3, 2))
+        self.assertEqual(once['top_users'], [('p2', 2), ('p1', 1)])
+        self.assertEqual((once['delay_median'], once['delay_max']), (0, 0))
+        # The spike of p2 is ignored, p1 and the memory of p2 act after
+        # 2 more scans.
+        self.assertEqual(three['actions'], 2)
+        self.assertEqual(three['delay_max'], 240)
+        self.assertEqual(five['actions'], 0)
+        self.assertIsNone(five['delay_median'])
+        # The 4 minute average of p1 passes 600 % in its 3rd scan over it,
+        # that of p2 passes 10 % memory in its 2nd.
+        self.assertEqual(averaged['top_users'], [('p1', 1), ('p2', 1)])
+        self.assertEqual(averaged['delay_max'], 240)
+        self.assertEqual(never['actions'], 0)
+
+    def test_month_of_scans(self):
+        # A month of 2 minute scans of 100 users and 48 combinations.
+        scans, users = 30 * 24 * 30, 100
+        rng = np.random.default_rng(1)
+        times = 1000 + 120 * np.arange(scans, dtype=float)
+        cpu = rng.gamma(1, 100, (scans, users)).astype(np.float32)
+        memory = rng.gamma(1, 2, (scans, users)).astype(np.float32)
+        recording = Recording(times, ['p{}'.format(u) for u in range(users)],
+                              cpu, memory)
+        combinations = [Combination(c, m, s, 0) for c in (400, 600, 800, 1000)
+                        for m in (10, 20) for s in (1, 2, 3, 5)]
+        combinations += [Combination(c, m, 1, w) for c in (400, 600, 800)
+                         for m in (10, 20) for w in (10, 30, 60)]
+        start = time.perf_counter()
+        results = replay(recording, combinations)
+        self.assertLess(time.perf_counter() - start, 30)
+        self.assertEqual(len(results), 50)
+        actions = [result['actions'] for result in results[:32]]
+        # Stricter rules act less.
+        self.assertGreater(actions[0], actions[3])
+        self.assertGreater(actions[0], actions[-4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+from kill_hogs.daemon import Daemon
+from kill_hogs.request_channel import (
+    RequestChannel, request_enforcement, scan_requested)
+from unittests.helpers import USER
+import os
+import pwd
+import tempfile
+import threading
+import unittest
+
+
+class RequestChannelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chmod(self.tmp.name, 0o755)
+        self.path = os.path.join(self.tmp.name, 'run', 'request.sock')
+        self.channel = RequestChannel(self.path, interval=60)
+        self.channel.start()
+
+    def tearDown(self):
+        self.channel.close()
+        self.tmp.cleanup()
+
+    def test_request(self):
+        with self.assertLogs(level='INFO') as logs:
+            self.assertEqual(request_enforcement('please\x07', self.path), 'ok')
+        self.assertIn('pid {}'.format(os.getpid()), logs.output[0])
+        [request] = self.channel.take()
+        self.assertEqual((request.uid, request.pid, request.reason),
+                         (os.getuid(), os.getpid(), 'please'))
+        self.assertEqual(self.channel.take(), [])
+
+    def test_requester_is_known(self):
+        # The uid comes from the kernel, not from what the client says.
+        if os.getuid() != 0:
+            self.skipTest('Needs root to ask as another user')
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.setuid(pwd.getpwnam(USER).pw_uid)
+                if request_enforcement('my job is stuck', self.path) == 'ok':
+                    status = 0
+            finally:
+                os._exit(status)
+        with self.assertLogs(level='INFO'):
+            _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        [request] = self.channel.take()
+        self.assertEqual(request.pid, pid)
+        self.assertEqual(request.uid, pwd.getpwnam(USER).pw_uid)
+        self.assertEqual(request.username, USER)
+        self.assertEqual(request.reason, 'my job is stuck')
+
+    def test_rate_limit(self):
+        with self.assertLogs(level='INFO'):
+            self.assertTrue(self.channel.submit(1000, 10, now=0))
+            self.assertFalse(self.channel.submit(1000, 11, now=30))
+            self.assertTrue(self.channel.submit(1001, 12, now=30))
+            self.assertTrue(self.channel.submit(1000, 13, now=61))
+            # Root is never limited.
+            self.assertTrue(self.channel.submit(0, 14, now=61))
+            self.assertTrue(self.channel.submit(0, 15, now=62))
+        self.assertEqual([request.pid for request in self.channel.take()],
+                         [10, 12, 13, 14, 15])
+
+    def test_requests_are_coalesced(self):
+        scanning = threading.Event()
+        requested = threading.Event()
+        scans = []
+
+        def scan(config):
+            scans.append(self.channel.take())
+            scanning.set()
+            requested.wait(5)
+
+        daemon = Daemon(scan, lambda: {}, period=60)
+        self.channel.wake = daemon.wake
+        thread = threading.Thread(target=daemon.run, args=(2, ))
+        thread.start()
+        scanning.wait(5)
+        with self.assertLogs(level='INFO'):
+            for uid in range(1000, 1005):
+                self.channel.submit(uid, uid)
+        requested.set()
+        # Without the wake up this would take a minute.
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([len(requests) for requests in scans], [0, 5])
+
+    def test_flagfile_without_daemon(self):
+        flagfile = os.path.join(self.tmp.name, 'flag')
+        self.assertIsNone(request_enforcement(
+            path=os.path.join(self.tmp.name, 'missing.sock'), flagfile=flagfile))
+        self.assertTrue(os.path.exists(flagfile))
+
+    def test_flagfile_is_ignored_while_listening(self):
+        flagfile = os.path.join(self.tmp.name, 'flag')
+        open(flagfile, 'w').close()
+        with self.assertLogs(level='WARNING'):
+            self.assertFalse(scan_requested(self.channel, flagfile))
+        self.assertFalse(os.path.exists(flagfile))
+        request_enforcement('please', self.path)
+        self.assertTrue(scan_requested(self.channel, flagfile))
+        # From cron, or when the socket could not be made.
+        self.channel.close()
+        open(flagfile, 'w').close()
+        self.assertTrue(scan_requested(self.channel, flagfile))
+        open(flagfile, 'w').close()
+        self.assertTrue(scan_requested(None, flagfile))
+        self.assertFalse(scan_requested(None, flagfile))
+
+
+if __name__ == '__main__':
+    unittest.main()
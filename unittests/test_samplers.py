@@ -0,0 +1,144 @@
+from kill_hogs import samplers
+from unittest import mock
+from unittests.helpers import write_io, write_proc, write_procfs
+import os
+import tempfile
+import unittest
+
+
+class ParseTestCase(unittest.TestCase):
+    def test_parse_stat_with_odd_name(self):
+        name, fields = samplers.parse_stat(b'42 (a) b (c)) S 1 42 42 0')
+        self.assertEqual(name, 'a) b (c)')
+        self.assertEqual(fields[:2], [b'S', b'1'])
+
+    def test_parse_real_uid(self):
+        self.assertEqual(
+            samplers.parse_real_uid(
+                b'Name:\tbash\nUid:\t1001\t0\t0\t0\nGid:\t1\t1\t1\t1\n'),
+            1001)
+
+    def test_parse_io(self):
+        self.assertEqual(
+            samplers.parse_io(b'rchar: 9\nwchar: 8\nsyscr: 3\nsyscw: 4\n'
+                              b'read_bytes: 4096\nwrite_bytes: 0\n'
+                              b'cancelled_write_bytes: 0\n'),
+            (4096, 0, 7))
+
+
+class ProcSamplerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.procfs = self.tmp.name
+        write_procfs(self.procfs)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @mock.patch('time.monotonic')
+    def test_sample(self, monotonic):
+        write_proc(self.procfs, 10, name='hog', uid=1001, ticks=0,
+                   rss_pages=1000, starttime=500)
+        write_proc(self.procfs, 11, name='idle', uid=1002, ticks=50)
+        sampler = samplers.ProcSampler(self.procfs)
+        monotonic.return_value = 100.0
+        sampler.prime()
+        # 2 seconds of cpu in one second of wall time.
+        write_proc(self.procfs, 10, name='hog', uid=1001,
+                   ticks=2 * samplers.CLOCK_TICKS, rss_pages=1000,
+                   starttime=500)
+        # Appears after prime(), so it has no cpu reference.
+        write_proc(self.procfs, 12, uid=1003)
+        monotonic.return_value = 101.0
+        snapshot = sampler.sample()
+
+        self.assertEqual(len(snapshot), 2)
+        i = list(snapshot.pids).index(10)
+        self.assertEqual(snapshot.uids[i], 1001)
+        self.assertEqual(snapshot.name(i), 'hog')
+        self.assertAlmostEqual(snapshot.cpu_percent[i], 200)
+        self.assertAlmostEqual(
+            snapshot.memory_percent[i],
+            1000 * samplers.PAGE_SIZE * 100 / 1024000000)
+        self.assertAlmostEqual(snapshot.create_time(i),
+                               1600000000 + 500 / samplers.CLOCK_TICKS)
+        j = list(snapshot.pids).index(11)
+        self.assertEqual(snapshot.cpu_percent[j], 0)
+
+    @mock.patch('time.monotonic')
+    def test_io_rates(self, monotonic):
+        write_proc(self.procfs, 10, uid=1001)
+        write_io(self.procfs, 10, write_bytes=1 << 30, syscw=10)
+        write_proc(self.procfs, 11, uid=1002)
+        open(os.path.join(self.procfs, '11', 'io'), 'w').close()
+        sampler = samplers.ProcSampler(self.procfs)
+        monotonic.return_value = 100.0
+        sampler.prime(io=True)
+        write_io(self.procfs, 10, write_bytes=(1 << 30) + 200 * samplers.MIB,
+                 syscw=1010)
+        monotonic.return_value = 102.0
+        snapshot = sampler.sample(io=True)
+        i = list(snapshot.pids).index(10)
+        self.assertAlmostEqual(snapshot.io_write[i], 100)
+        self.assertEqual(snapshot.io_read[i], 0)
+        self.assertAlmostEqual(snapshot.io_syscalls[i], 500)
+        # Its io can not be read, but the process is still sampled.
+        j = list(snapshot.pids).index(11)
+        self.assertEqual(snapshot.io_write[j], 0)
+
+        # Without prime(), the rates are since the previous sample().
+        write_io(self.procfs, 10, write_bytes=(1 << 30) + 210 * samplers.MIB,
+                 syscw=1010)
+        monotonic.return_value = 112.0
+        snapshot = sampler.sample(io=True)
+        self.assertAlmostEqual(snapshot.io_write[i], 1)
+        self.assertEqual(len(sampler.sample().io_write), 0)
+
+    def test_large_uids(self):
+        write_proc(self.procfs, 10, uid=3000000000)
+        sampler = samplers.ProcSampler(self.procfs)
+        sampler.prime()
+        self.assertEqual(list(sampler.sample().uids), [3000000000])
+
+    def test_vanished_process_is_skipped(self):
+        write_proc(self.procfs, 10)
+        write_proc(self.procfs, 11)
+        sampler = samplers.ProcSampler(self.procfs)
+        sampler.prime()
+        os.unlink(os.path.join(self.procfs, '11', 'stat'))
+        self.assertEqual(list(sampler.sample().pids), [10])
+
+    def test_get_sampler_falls_back_to_psutil(self):
+        with self.assertLogs(level='WARNING'):
+            sampler = samplers.get_sampler('proc', procfs=self.procfs)
+        self.assertIsInstance(sampler, samplers.PsutilSampler)
+
+
+class LiveSamplerTestCase(unittest.TestCase):
+    @unittest.skipUnless(os.path.exists('/proc/self/stat'), 'needs /proc')
+    def test_backends_agree_on_pids(self):
+        for sampler in (samplers.ProcSampler(), samplers.PsutilSampler()):
+            sampler.prime()
+            snapshot = sampler.sample()
+            self.assertIn(os.getpid(), snapshot.pids)
+            i = list(snapshot.pids).index(os.getpid())
+            self.assertEqual(snapshot.uids[i], os.getuid())
+            self.assertEqual(snapshot.process(i).pid, os.getpid())
+
+    @unittest.skipUnless(os.path.exists('/proc/self/stat'), 'needs /proc')
+    def test_reused_pid_is_left_alone(self):
+        snapshot = samplers.ProcSampler().sample([os.getpid()])
+        self.assertEqual([proc.pid for proc in snapshot.processes([0])],
+                         [os.getpid()])
+        # Another process started under the same pid after the scan.
+        snapshot.create_times[0] -= 60
+        with self.assertLogs(level='INFO'):
+            self.assertEqual(snapshot.processes([0]), [])
+        snapshot.create_times[0] += 60
+        snapshot.uids[0] += 1
+        with self.assertLogs(level='INFO'):
+            self.assertEqual(snapshot.processes([0]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
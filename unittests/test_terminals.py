@@ -0,0 +1,72 @@
+from kill_hogs import terminals
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class ParseUtmpTestCase(unittest.TestCase):
+    def setUp(self):
+        with open('unittests/utmpdump', 'rb') as f:
+            self.terminals = terminals.parse_utmp(f.read())
+
+    def test_only_user_processes(self):
+        self.assertNotIn('LOGIN', self.terminals)
+        self.assertNotIn('reboot', self.terminals)
+        self.assertNotIn('', self.terminals)
+
+    def test_all_terminals_of_a_user(self):
+        self.assertEqual(self.terminals['p819174'], ['pts/31', 'pts/32'])
+        self.assertEqual(self.terminals['umcg-huey'], ['pts/72', 'pts/96'])
+
+
+class TerminalIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'utmp')
+        shutil.copy('unittests/utmpdump', self.path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_parsed_once_until_changed(self):
+        index = terminals.TerminalIndex(self.path)
+        for user in ('p945314', 's7982319', 'p819174'):
+            index.terminals(user)
+        self.assertEqual(index.parses, 1)
+
+        with open(self.path, 'ab') as f:
+            f.write(terminals.pack_utmp_entry('p945314', 'pts/200'))
+        os.utime(self.path, ns=(0, 0))
+        self.assertEqual(index.terminals('p945314'), ['pts/1', 'pts/49', 'pts/200'])
+        self.assertEqual(index.parses, 2)
+
+    def test_missing_utmp(self):
+        index = terminals.TerminalIndex(self.path + '.missing')
+        self.assertEqual(index.terminals('p945314'), [])
+
+
+class WriteToTtyTestCase(unittest.TestCase):
+    def test_write(self):
+        master, slave = os.openpty()
+        try:
+            tty = os.ttyname(slave)[len('/dev/'):]
+            self.assertTrue(terminals.write_to_tty(tty, 'please stop\nthanks'))
+            output = os.read(master, 4096)
+        finally:
+            os.close(master)
+            os.close(slave)
+        self.assertIn(b'Message from root@', output)
+        self.assertIn(b'please stop', output)
+        self.assertIn(b'thanks', output)
+
+    def test_refuses_odd_paths(self):
+        with self.assertLogs(level='WARNING'):
+            self.assertFalse(terminals.write_to_tty('../etc/passwd', 'x'))
+
+    def test_missing_terminal(self):
+        self.assertFalse(terminals.write_to_tty('pts/99999', 'x'))
+
+
+if __name__ == '__main__':
+    unittest.main()
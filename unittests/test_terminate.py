@@ -0,0 +1,131 @@
+from kill_hogs import kill_hogs
+from unittests.helpers import USER
+import os
+import psutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+# A login shell with job control: every job in a process group of its own,
+# the first before the hog, the last after it.
+LOGIN_SHELL = '''
+import os, subprocess, sys, time
+user = sys.argv[2] or None
+def job(command):
+    return subprocess.Popen(command, shell=True, user=user,
+                            preexec_fn=os.setpgrp).pid
+jobs = [job('sleep 60')]
+time.sleep(.3)
+jobs.append(job(sys.argv[1]))
+time.sleep(.3)
+jobs.append(job('sleep 60'))
+print(*jobs, flush=True)
+time.sleep(60)
+'''
+
+
+def is_dead(pid):
+    try:
+        return psutil.Process(pid).status() == psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return True
+
+
+class TerminateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.popens = []
+
+    def tearDown(self):
+        for popen in self.popens:
+            popen.kill()
+            popen.wait()
+
+    def start(self, command):
+        popen = subprocess.Popen(
+            command, shell=True, start_new_session=True, user=USER)
+        self.popens.append(popen)
+        return psutil.Process(popen.pid)
+
+    def test_one_grace_period_for_all(self):
+        procs = [self.start('sleep 60') for _ in range(3)]
+        # Ignores SIGTERM, so the grace period is used in full.
+        procs.append(self.start('trap "" TERM; sleep 60; sleep 60'))
+        time.sleep(.2)
+        start = time.monotonic()
+        timings = kill_hogs.terminate(procs, timeout=1)
+        self.assertLess(time.monotonic() - start, 1.9)
+        self.assertGreaterEqual(timings['wait'], .9)
+        self.assertEqual(sorted(timings), ['kill', 'terminate', 'wait'])
+        time.sleep(.1)
+        for proc in procs:
+            self.assertTrue(is_dead(proc.pid))
+
+    def test_children_in_the_session_are_killed(self):
+        parent = self.start('trap "" TERM; sleep 60 & sleep 60 & wait')
+        time.sleep(.2)
+        children = parent.children()
+        self.assertEqual(len(children), 2)
+        kill_hogs.terminate([parent], timeout=.5)
+        time.sleep(.1)
+        for proc in [parent] + children:
+            self.assertTrue(is_dead(proc.pid))
+
+    def test_login_shell_survives(self):
+        # A shell with a job from before and a hog started later, all in the
+        # session of the shell.
+        shell = self.start(
+            'sleep 60 & sleep .3; '
+            'sh -c \'trap "" TERM; sleep 60 & sleep 60 & wait\' & wait')
+        time.sleep(.6)
+        hog, before = sorted(shell.children(), key=lambda proc: proc.name())
+        self.addCleanup(before.kill)
+        children = hog.children()
+        self.assertEqual(len(children), 2)
+        kill_hogs.terminate([hog], timeout=.5)
+        time.sleep(.1)
+        for proc in [hog] + children:
+            self.assertTrue(is_dead(proc.pid))
+        self.assertFalse(is_dead(shell.pid))
+        self.assertFalse(is_dead(before.pid))
+
+    def test_only_the_descendants_in_the_session_are_terminated(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        os.chmod(tmp.name, 0o777)
+        flag = os.path.join(tmp.name, 'terminated')
+        # The child of the hog notes that it got SIGTERM.
+        hog = ('sh -c \'trap "touch {}; exit" TERM; '
+               'while :; do sleep .05; done\' & wait'.format(flag))
+        popen = subprocess.Popen(
+            [sys.executable, '-c', LOGIN_SHELL, hog, USER or ''],
+            stdout=subprocess.PIPE, start_new_session=True)
+        self.popens.append(popen)
+        before, hog, later = [psutil.Process(int(pid)) for pid in
+                              popen.stdout.readline().split()]
+        self.addCleanup(popen.stdout.close)
+        for proc in (before, later):
+            self.addCleanup(os.killpg, proc.pid, signal.SIGKILL)
+        children = hog.children()
+        self.assertEqual(len(children), 1)
+        kill_hogs.terminate([hog], timeout=1)
+        time.sleep(.1)
+        for proc in [hog] + children:
+            self.assertTrue(is_dead(proc.pid))
+        self.assertTrue(os.path.exists(flag))
+        for proc in (popen, before, later):
+            self.assertFalse(is_dead(proc.pid))
+
+    def test_vanished_processes(self):
+        proc = self.start('true')
+        self.popens[0].wait()
+        kill_hogs.terminate([proc], timeout=.1)
+
+    def test_own_group_is_never_a_target(self):
+        self.assertEqual(kill_hogs.process_groups([psutil.Process()]), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+from kill_hogs.policy import Policy
+from kill_hogs.throttle import DutyCycler, Throttler
+from unittest import mock
+from unittests.helpers import USER, make_snapshot, scan, usage, write_slice
+import os
+import psutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+GB = 1024 ** 3
+
+
+def read(path, name):
+    with open(os.path.join(path, name)) as f:
+        return f.read()
+
+
+class ThrottlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        open(os.path.join(self.root, 'cgroup.controllers'), 'w').close()
+        write_slice(self.root, 1001, 0, 0)
+        self.slice = os.path.join(self.root, 'user.slice', 'user-1001.slice')
+        self.throttler = Throttler(self.root, total_memory=10 * GB)
+        self.throttler.configure({'throttle': {
+            'cpu_percent': '150', 'memory_percent': '10',
+            'io_max': '8:0 rbps=1048576 wbps=1048576',
+            'release_cpu_percent': '50', 'release_after': '1'}})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_throttle_slice(self):
+        self.assertTrue(self.throttler.throttle('p1', 1001, [], now=0))
+        self.assertEqual(read(self.slice, 'cpu.max'), '150000 100000')
+        self.assertEqual(read(self.slice, 'memory.high'), str(GB))
+        self.assertEqual(read(self.slice, 'io.max'),
+                         '8:0 rbps=1048576 wbps=1048576')
+
+    def test_no_slice_or_no_cgroup2(self):
+        self.assertFalse(self.throttler.throttle('p2', 1002, [], now=0))
+        os.remove(os.path.join(self.root, 'cgroup.controllers'))
+        self.assertFalse(self.throttler.throttle('p1', 1001, [], now=0))
+
+    def test_dedicated_cgroup(self):
+        self.throttler.target = 'cgroup'
+        procs = [mock.Mock(pid=10), mock.Mock(pid=11)]
+        self.assertTrue(self.throttler.throttle('p1', 1001, procs, now=0))
+        group = os.path.join(self.root, 'kill_hogs.slice')
+        path = os.path.join(group, 'user-1001')
+        self.assertEqual(read(group, 'cgroup.subtree_control'),
+                         '+cpu +memory +io')
+        # A real cgroup.procs takes every pid, this file keeps the last one.
+        self.assertEqual(read(path, 'cgroup.procs'), '11')
+        self.assertEqual(read(path, 'cpu.max'), '150000 100000')
+
+    def test_release_once_usage_drops(self):
+        self.throttler.throttle('p1', 1001, [], now=0)
+        self.assertEqual(self.throttler.update({'p1': usage(140)}, 10), [])
+        self.assertEqual(self.throttler.update({'p1': usage(20)}, 20), [])
+        # Going up again starts the count over.
+        self.assertEqual(self.throttler.update({'p1': usage(140)}, 50), [])
+        self.assertEqual(self.throttler.update({'p1': usage(20)}, 60), [])
+        self.assertEqual(self.throttler.update({}, 100), [])
+        self.assertEqual(self.throttler.update({}, 120), ['p1'])
+        self.assertEqual(read(self.slice, 'cpu.max'), 'max 100000')
+        self.assertEqual(read(self.slice, 'memory.high'), 'max')
+        self.assertEqual(read(self.slice, 'io.max'),
+                         '8:0 rbps=max wbps=max riops=max wiops=max')
+        self.assertEqual(self.throttler.throttled, {})
+
+    def test_state_file(self):
+        state_file = os.path.join(self.root, 'throttle.json')
+        throttler = Throttler(self.root, state_file, total_memory=GB)
+        throttler.throttle('p1', 1001, [], now=0)
+        throttler.save()
+        throttler = Throttler(self.root, state_file)
+        self.assertEqual(throttler.throttled['p1'].path, self.slice)
+        throttler.update({}, 100)
+        self.assertEqual(throttler.update({}, 500), ['p1'])
+        self.assertEqual(read(self.slice, 'cpu.max'), 'max 100000')
+
+    def test_pause_needs_a_daemon(self):
+        self.assertFalse(self.throttler.pause('p1', 1001, [], now=0))
+
+
+class DutyCyclerTestCase(unittest.TestCase):
+    def test_pause_and_resume(self):
+        popen = subprocess.Popen(['sleep', '60'], user=USER)
+        self.addCleanup(popen.wait)
+        self.addCleanup(popen.kill)
+        proc = psutil.Process(popen.pid)
+        cycler = DutyCycler(duty=.5, period=.2)
+        cycler.start()
+        cycler.pause('p1', [proc])
+        statuses = set()
+        for _ in range(40):
+            statuses.add(proc.status())
+            time.sleep(.01)
+        cycler.stop()
+        self.assertIn(psutil.STATUS_STOPPED, statuses)
+        self.assertIn(psutil.STATUS_SLEEPING, statuses)
+        time.sleep(.05)
+        self.assertNotEqual(proc.status(), psutil.STATUS_STOPPED)
+
+    def test_stopped_processes_are_continued_after_a_crash(self):
+        popen = subprocess.Popen(['sleep', '60'], user=USER)
+        self.addCleanup(popen.wait)
+        self.addCleanup(popen.kill)
+        proc = psutil.Process(popen.pid)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        state_file = os.path.join(tmp.name, 'pause_state.json')
+        cycler = DutyCycler(state_file=state_file)
+        cycler.pause('p1', [proc])
+        self.assertTrue(os.path.exists(state_file))
+        # Killed while the process was stopped.
+        proc.suspend()
+        restarted = DutyCycler(state_file=state_file)
+        with self.assertLogs(level='INFO'):
+            self.assertEqual(restarted.resume_stale(), 1)
+        time.sleep(.05)
+        self.assertNotEqual(proc.status(), psutil.STATUS_STOPPED)
+        self.assertFalse(os.path.exists(state_file))
+        # Not a process that got the pid later on.
+        with open(state_file, 'w') as f:
+            f.write('[[{}, {}]]'.format(proc.pid, proc.create_time() - 60))
+        proc.suspend()
+        self.assertEqual(restarted.resume_stale(), 0)
+        time.sleep(.05)
+        self.assertEqual(proc.status(), psutil.STATUS_STOPPED)
+        proc.resume()
+
+    def test_state_file_is_removed_once_nothing_is_paused(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        state_file = os.path.join(tmp.name, 'pause_state.json')
+        cycler = DutyCycler(state_file=state_file)
+        cycler.pause('p1', [psutil.Process()])
+        self.assertTrue(os.path.exists(state_file))
+        with mock.patch('kill_hogs.throttle.signal_all'):
+            cycler.resume('p1')
+        self.assertFalse(os.path.exists(state_file))
+
+
+class KillHogsThrottleTestCase(unittest.TestCase):
+    config = {'user_pattern': '^p[0-9]+', 'software_whitelist': [],
+              'policy': {'actions': ['throttle'],
+                         'rules': [{'metric': 'cpu_percent',
+                                    'threshold': '100'}]}}
+
+    def scan(self, throttler):
+        snapshot = make_snapshot([(10, 0, 0)])
+        snapshot.cpu_percent[0] = 200
+        with mock.patch('kill_hogs.kill_hogs.renice') as renice:
+            _, terminate = scan(snapshot, self.config, policy=Policy(),
+                                throttler=throttler)
+        self.assertFalse(terminate.called)
+        return renice
+
+    def test_throttle(self):
+        throttler = mock.Mock()
+        throttler.update.return_value = []
+        throttler.apply.return_value = True
+        renice = self.scan(throttler)
+        self.assertFalse(renice.called)
+        action, username, uid, procs, now = throttler.apply.call_args[0]
+        self.assertEqual((action, username, uid, procs), ('throttle', 'p1', 1000, [0]))
+
+    def test_renice_without_throttler(self):
+        with self.assertLogs(level='WARNING'):
+            renice = self.scan(None)
+        renice.assert_called_once_with([0])
+
+
+if __name__ == '__main__':
+    unittest.main()
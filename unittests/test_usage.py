@@ -0,0 +1,85 @@
+from kill_hogs import kill_hogs
+from kill_hogs.identity import IdentityCache
+from kill_hogs.profiler import ScanProfile
+from kill_hogs.samplers import ProcSnapshot
+from kill_hogs.usage import Users, counted_processes, top_processes
+from unittest import mock
+from unittests.helpers import make_snapshot, scan
+import unittest
+
+CONFIG = {'user_pattern': '^p[0-9]+', 'software_whitelist': ['git'],
+          'terminal_warning': 'stop it'}
+
+
+def snapshot_of(uids, cpu_percent):
+    snapshot = make_snapshot([(10 + i, 0, 0) for i in range(len(uids))])
+    for i, (uid, cpu) in enumerate(zip(uids, cpu_percent)):
+        snapshot.uids[i] = uid
+        snapshot.cpu_percent[i] = cpu
+    return snapshot
+
+
+class UsersTestCase(unittest.TestCase):
+    def test_processes_are_built_when_asked(self):
+        users = Users(5)
+        p1, p2 = users.add('p1'), users.add('p2')
+        self.assertIs(users.add('p1'), p1)
+        users.owners[0] = users.owners[3] = p1.number
+        users.owners[2] = p2.number
+        p1['cpu_percent'] += 50
+        self.assertIsNone(p1._processes)
+        users.materialize(['p1', 'p3'])
+        self.assertEqual(p1['processes'], [0, 3])
+        self.assertIsNone(p2._processes)
+        self.assertEqual(p2.processes, [2])
+        self.assertEqual(p1['cpu_percent'], 50)
+        self.assertEqual(p1.get('gpu_memory', 1), 0)
+        self.assertEqual(sorted(counted_processes(users)),
+                         [('p1', 0), ('p1', 3), ('p2', 2)])
+
+    def test_top_processes(self):
+        snapshot = snapshot_of([1000] * 4, [5, 50, 20, 50])
+        snapshot.memory_percent[3] = 1
+        self.assertEqual(top_processes(range(4), snapshot, 2), [3, 1])
+
+
+class CollectUsersTestCase(unittest.TestCase):
+    def test_lookups_once_per_uid(self):
+        snapshot = snapshot_of([1001, 1002, 1001, 1002, 1001],
+                               [100, 10, 200, 10, 0])
+        snapshot.names[2] = 'git'
+        lookups = []
+
+        def username(self, i):
+            lookups.append(i)
+            return {1001: 'p1', 1002: 'root2'}[self.uids[i]]
+
+        profile = ScanProfile()
+        with mock.patch.object(ProcSnapshot, 'username', username):
+            users = kill_hogs.collect_users(CONFIG, snapshot, {},
+                                            IdentityCache(), profile)
+        self.assertEqual(lookups, [0, 1])
+        self.assertEqual(list(users), ['p1'])
+        self.assertEqual(users['p1']['cpu_percent'], 100)
+        self.assertEqual(users['p1']['processes'], [0])
+        self.assertEqual(profile.counts['unrestricted'], 2)
+        self.assertEqual(profile.counts['whitelisted'], 1)
+        self.assertEqual(profile.counts['below_threshold'], 1)
+
+    def test_report_lists_the_heaviest_processes(self):
+        snapshot = snapshot_of([1001] * 5, [100, 300, 200, 150, 50])
+        with self.assertLogs(level='INFO') as logs:
+            _, terminate = scan(snapshot, CONFIG, report_processes=2)
+        report = [line for line in '\n'.join(logs.output).splitlines()
+                  if line.startswith('p1')]
+        self.assertEqual(report, [
+            'p1 pid 11 python memory 0.00% cpu 300.00%',
+            'p1 pid 12 python memory 0.00% cpu 200.00%',
+            'p1 and 3 more processes',
+        ])
+        # All processes are killed, not only the ones in the report.
+        self.assertEqual(sorted(terminate.call_args[0][0]), [0, 1, 2, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()